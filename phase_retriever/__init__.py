@@ -1,5 +1,13 @@
 # GUI should be separate from the main program to avoid wx dependency in command line mode.
-from .interface import PhaseRetrieverGUI
-from .wx_gui import wxGUI
+import importlib
 
 from .retriever import PhaseRetriever
+
+# The GUIs (and their toolkits: tkinter, wxPython and matplotlib) are only imported
+# the first time they are accessed
+_GUIS = {"PhaseRetrieverGUI": ".interface", "wxGUI": ".wx_gui"}
+
+def __getattr__(name):
+    if name in _GUIS:
+        return getattr(importlib.import_module(_GUIS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
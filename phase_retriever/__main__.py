@@ -2,18 +2,17 @@ import sys
 import os
 
 import platform
-import wx
-import tkinter as tk
-import tkinter.ttk as ttk
-
-from .interface import PhaseRetrieverGUI
-from .wx_gui import wxGUI
-from .test import test_basics
 
 PROGRAM_NAME = "Phase retriever"
 
+# The GUI toolkits are only imported when a GUI is launched, so that the headless
+# subcommands (batch, test) run on machines without them
+
 
 def wxMain(data_dir=""):
+    import wx
+    from .wx_gui import wxGUI
+
     app = wx.App()
     gui = wxGUI(None, PROGRAM_NAME, search_dir=data_dir)
     gui.Show()
@@ -21,6 +20,10 @@ def wxMain(data_dir=""):
 
 
 def TkMain():
+    import tkinter as tk
+    import tkinter.ttk as ttk
+    from .interface import PhaseRetrieverGUI
+
     root = tk.Tk()
     style = ttk.Style()
     if platform.system() == "Linux":
@@ -42,6 +45,8 @@ def print_help(error_code=0, epilog=''):
           f"distance nearby the focus. It also calculates the electric field longitudinal component.")
     print(f"")
     print(f"usage: {program_cmd} [path=<path>|get_test_data=<path>|demo|test] [-h|--help]")
+    print(f"       {program_cmd} batch <dataset> [<dataset> ...] [--jobs N] [--threads T] [...]")
+    print(f"       {program_cmd} watch <folder> [--planes N] [--irradiance] [...]")
     print(f"")
     print(f"Options:")
     print(f"  path:           Opens the program with the dataset in the specified path.")
@@ -51,6 +56,10 @@ def print_help(error_code=0, epilog=''):
           f"                  N: 1 or 'empty' -> Simulated data ; 2 -> Experimental data.\n"
           f"                  *It can be combined with get_test_data.*")
     print(f"  test:           Runs the unit test suite.")
+    print(f"  batch:          Retrieves the datasets in the given folders (or glob patterns)\n"
+          f"                  without GUI, see '{program_cmd} batch --help'.")
+    print(f"  watch:          Retrieves each measurement written into a folder as soon as\n"
+          f"                  it is complete, see '{program_cmd} watch --help'.")
     print(f"")
     print(f"  -h, --help:     Shows this help message.")
     print(f"")
@@ -69,6 +78,13 @@ if __name__ == "__main__":
 
     data_dir = os.getcwd()
 
+    if sys.argv[1:2] == ["batch"]:
+        from .batch import main
+        sys.exit(main(sys.argv[2:]))
+    if sys.argv[1:2] == ["watch"]:
+        from .watch import main
+        sys.exit(main(sys.argv[2:]))
+
     verbose = False
     for arg in sys.argv[1:]:
         if arg in ["-h", "--help"]:
@@ -76,6 +92,7 @@ if __name__ == "__main__":
         elif arg == "-v":
             verbose = True
         elif arg == "test":
+            from .test import test_basics
             err = test_basics()
             sys.exit(err)
         elif arg.startswith("demo"):
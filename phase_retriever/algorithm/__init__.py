@@ -1 +1,2 @@
-from .multipass_retrieval import multi
+from .multipass_retrieval import multi, multi_batch, multi_start, multi_pyramid
+from .registry import ALGORITHMS, register_algorithm, get_algorithm, iterations_to_threshold
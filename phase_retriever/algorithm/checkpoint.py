@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checkpoints of the multipass retrieval. The iteration state of multi (the buffers
+xk, yk, g_k1, g_k2 and hk of its workspace, the number of iterations done and the
+MSE and alpha histories) is saved to a .npz file, so that a retrieval stopped at
+niter, or killed, can carry on from where it was instead of starting over:
+
+    multi(H, 500, phi0, *As, checkpoint="run_X.npz", checkpoint_every=50)
+    multi(H, 800, phi0, *As, checkpoint="run_X.npz", resume="run_X.npz")
+
+The Anderson history and the stopping policy start afresh on resuming.
+"""
+import os
+import numpy as np
+
+STATE = ("xk", "yk", "g_k1", "g_k2", "hk")
+
+def save_checkpoint(path, ws, iteration, mses, alphes):
+    """Save the state of the workspace ws after iteration iterations, along with the
+    MSE and alpha histories up to it. The file is written and then renamed, so that a
+    process killed meanwhile leaves the previous checkpoint intact."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, iteration=iteration, mses=mses[:iteration], alphes=alphes[:iteration],
+                 **{name: getattr(ws, name) for name in STATE})
+    os.replace(tmp_path, path)
+
+def load_checkpoint(path):
+    """Dict with the state saved by save_checkpoint."""
+    with np.load(path) as data:
+        state = {key: data[key] for key in data.files}
+    state["iteration"] = int(state["iteration"])
+    return state
+
+def restore_state(ws, state):
+    """Copy the buffers of a checkpoint into the workspace ws."""
+    for name in STATE:
+        getattr(ws, name)[:] = state[name]
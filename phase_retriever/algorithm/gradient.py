@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Gradient based retrieval engine. Instead of alternating projections, the phase phi
+at the initial plane is found by minimizing the amplitude mismatch at the rest of
+the planes,
+
+    E(phi) = sum_i sum |P^i(A_0*exp(i*phi))| - A_i)**2,     P = ifft2(H*fft2(.)),
+
+through scipy.optimize.minimize with L-BFGS-B. The gradient is analytic: with
+R_i = (|U_i|-A_i)*U_i/|U_i| the residual at each plane, it is propagated back to
+the initial plane through the adjoint P^H = ifft2(conj(H)*fft2(.)), so that each
+evaluation costs a forward and a backward sweep through the planes.
+"""
+import numpy as np
+from scipy.optimize import minimize
+
+from phase_retriever.constants import MSE_THRESHOLD
+from phase_retriever.misc.fft_backend import get_backend
+from phase_retriever.algorithm.multipass_retrieval import PRECISIONS, store_field
+from phase_retriever.algorithm.stopping import StoppingPolicy, store_reason
+from phase_retriever.misc.shared import report
+from phase_retriever.misc.planes import plane_steps
+
+class AmplitudeMismatch():
+    def __init__(self, H, As, complex_t=np.complex128, backend=None, workers=None):
+        """Objective function of the gradient engine and its gradient.
+
+        Parameters:
+            - H: Free space transfer function between two consecutive planes, or stack
+            of those of each step (see multi).
+            - As: Measured moduli at each plane, in the order they are visited.
+            - complex_t: Complex dtype of the propagated fields.
+            - backend, workers: FFT backend and number of threads (see misc.fft_backend).
+        """
+        real_t = np.float32 if complex_t == np.complex64 else np.float64
+        self.As = [np.asarray(Ai, dtype=real_t) for Ai in As]
+        H = np.asarray(H, dtype=complex_t)
+        self.H, _ = plane_steps(H, len(As))
+        self.H_adj = [np.conj(Hi) for Hi in H] if H.ndim == 3 else [np.conj(H)]*(len(As)-1)
+        self.complex_t = complex_t
+        self.fft = get_backend(backend, workers)
+        # Normalization, so that the error is comparable to the MSE of multi
+        self.k = 1/sum(np.sum(np.asarray(Ai, dtype=np.float64)**2) for Ai in As[1:])
+        self.evaluations = 0
+        self.last = (None, None)    # Last evaluated point and its error
+
+    def _propagate(self, U, H):
+        return self.fft.ifft2(self.fft.fft2(U)*H)
+
+    def __call__(self, phi):
+        """Normalized error and its gradient with respect to phi (flattened, as
+        scipy.optimize works with 1D float64 arrays)."""
+        self.evaluations += 1
+        A0 = self.As[0]
+        U0 = (A0*np.exp(1j*phi.reshape(A0.shape))).astype(self.complex_t)
+        U = U0
+        residuals = []
+        error = 0.
+        for Ai, Hi in zip(self.As[1:], self.H):
+            U = self._propagate(U, Hi)
+            absU = abs(U)
+            error += np.sum((absU-Ai)**2, dtype=np.float64)
+            residuals.append((absU-Ai)*U/(absU+1e-16))
+        # Adjoint sweep, from the last plane back to the initial one
+        G = residuals[-1]
+        for R, H_adj in zip(residuals[-2::-1], self.H_adj[:0:-1]):
+            G = self._propagate(G, H_adj)+R
+        G = self._propagate(G, self.H_adj[0])
+        grad = 2*np.imag(G*np.conj(U0))*self.k
+        self.last = (phi.copy(), error*self.k)
+        return error*self.k, grad.ravel().astype(np.float64)
+
+    def error(self, phi):
+        """Normalized error at phi, reusing the last evaluation if it was at phi."""
+        last_phi, last_error = self.last
+        if last_phi is not None and np.array_equal(last_phi, phi):
+            return last_error
+        return self(phi)[0]
+
+def multi_lbfgs(H, niter, phi0, *As, verbose=False, queue=None, real=None, imag=None,
+                eps=MSE_THRESHOLD, backend=None, workers=None, precision="double",
+                memory=10, stopping=None, reason_out=None, out=None):
+    """Phase retrieval minimizing the amplitude mismatch at the planes after the first
+    one with L-BFGS-B. Same interface as multi.
+
+    Parameters:
+        - memory: Number of corrections kept by L-BFGS (maxcor).
+        - The rest, as in multi. The iteration stops once the normalized mismatch
+        falls below eps or the stopping policy says so (mse_every does not apply,
+        as every evaluation yields the error). The mixed precision mode runs in
+        double precision.
+    Output:
+        - phi: Estimation of the phase (as a unit modulus field).
+        - MSE: Normalized mismatch at each iteration. Unlike the MSE of multi, which
+        compares the moduli at the initial plane after a full pass, it measures the
+        error at the planes after the first one.
+        - ffts: FFTs computed at each iteration (the line search may need several
+        evaluations of the objective).
+        - reason: Why the iteration stopped (see algorithm.stopping). L-BFGS-B may
+        also stop by itself when it cannot improve further, reported as "stagnation".
+    """
+    _, complex_t = PRECISIONS["double" if precision == "mixed" else precision]
+    objective = AmplitudeMismatch(H, As, complex_t, backend, workers)
+    mses = np.zeros(niter)
+    ffts = np.zeros(niter)
+    ffts_per_evaluation = 4*(len(As)-1)
+    state = {"i": 0, "phi": np.asarray(phi0, dtype=np.float64).ravel(), "evaluations": 0,
+             "reason": None}
+    policy = StoppingPolicy(niter, eps, **(stopping or {}))
+
+    def callback(phi):
+        i = state["i"]
+        state["phi"] = phi.copy()
+        mse = objective.error(phi)
+        mses[i] = mse
+        ffts[i] = (objective.evaluations-state["evaluations"])*ffts_per_evaluation
+        state["evaluations"] = objective.evaluations
+        state["i"] += 1
+        if verbose:
+            print(f"MSE = {mse:8.4g}")
+        state["reason"] = policy.check(i, mse)
+        if state["reason"]:
+            raise StopIteration
+        report(queue, mse, ffts[i])
+
+    try:
+        minimize(objective, state["phi"], jac=True, method="L-BFGS-B", callback=callback,
+                 options={"maxiter": niter, "maxcor": memory, "ftol": 0, "gtol": 0})
+    except StopIteration:
+        pass    # Older scipy versions do not handle it themselves
+    reason = state["reason"] or ("niter" if state["i"] >= niter else "stagnation")
+    xk = np.exp(1j*state["phi"].reshape(np.shape(As[0])))
+    store_field(xk, out, real, imag)
+    store_reason(reason, reason_out)
+    return xk, mses, ffts, reason
@@ -1,92 +1,475 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import os
+import time
 import numpy as np
-import matplotlib.pyplot as plt
 
 from phase_retriever.constants import MSE_THRESHOLD
+from phase_retriever.misc.fft_backend import get_backend
+from phase_retriever.algorithm.workspace import Workspace
+from phase_retriever.algorithm.stopping import StoppingPolicy, store_reason
+from phase_retriever.algorithm.checkpoint import save_checkpoint, load_checkpoint, restore_state
+from phase_retriever.misc.shared import report
+from phase_retriever.misc.planes import plane_steps
+from phase_retriever.misc.resample import resample_amplitude, resample_phase, \
+    crop_transfer_function, spectral_resample
 
-fft2 = np.fft.fft2
-ifft2 = np.fft.ifft2
-fftshift = np.fft.fftshift
+# Real and complex dtypes used by each precision mode. Mixed precision iterates in
+# single precision and promotes to double once the MSE flattens.
+PRECISIONS = {"double": (np.float64, np.complex128),
+              "single": (np.float32, np.complex64),
+              "mixed": (np.float32, np.complex64)}
 
-def multi(H, niter, phi0, *As, verbose=False, queue=None, real=None, imag=None, eps=MSE_THRESHOLD):
+def mse_flattened(mses, i, window=5, tol=1e-3):
+    """Whether the MSE history, (niter,) or (B, niter), improved less than a relative
+    tol over the last window iterations up to iteration i."""
+    if i < window:
+        return False
+    return bool(np.all(mses[..., i-window]-mses[..., i] < tol*mses[..., i]))
+
+def multi(H, niter, phi0, *As, verbose=False, queue=None, real=None, imag=None, eps=MSE_THRESHOLD,
+          backend=None, workers=None, precision="double", jit=False, anderson=0, stopping=None,
+          reason_out=None, out=None, checkpoint=None, checkpoint_every=0, resume=None):
     """Multipass phase retrieval. Estimates the phase that best approximates
     the experimental moduli obtained in propagation. The method assumes
     plane wave spectrum propagation, with its benefits and limitations.
-    Moreover, we assume that the planes where the moduli are equidistant.
+    The planes need not be equidistant (see misc.planes).
     
     Parameters:
-        - H: Free space transfer function between two planes.
+        - H: Free space transfer function between two consecutive planes, if they
+        are equidistant, or stack of those of each step, (len(As)-1, n, n).
         - niter: Number of iterations for the algorithm
         - phi0: Initial guess for the phase
-        - *As: Moduli of the complex amplitudes taken each at a distance z
-        from each other. The minimum number for the algorithm to work is 2.
+        - *As: Moduli of the complex amplitudes at each plane, in the order they are
+        visited. The minimum number for the algorithm to work is 2.
         - verbose: Print status of the phase retrieval at each iteration.
+        - queue: Progress block (see misc.shared) receiving the MSE and alpha of each
+        iteration, or a queue receiving its MSE. Iterations where the MSE is not
+        evaluated report the last evaluated value.
+        - backend, workers: FFT backend and number of threads to use (see
+        misc.fft_backend). None selects the package defaults.
+        - precision: "double" (complex128), "single" (complex64) or "mixed", which
+        iterates in single precision and switches to double once the MSE flattens.
+        - jit: Run the elementwise part of the iteration through the numba fused
+        kernels (see algorithm.workspace), if numba is installed.
+        - anderson: If nonzero, replace the one step momentum by Anderson mixing of
+        the last anderson iterations.
+        - stopping: Dict with the options of the stopping policy besides eps (see
+        algorithm.stopping): window, tol, extrapolate, max_seconds, mse_every, cancel
+        and check_every. Runs interrupted by max_seconds or cancel return the field
+        with the lowest MSE found so far.
+        - reason_out: Shared character array receiving the stop reason.
+        - out: Complex array receiving the result, typically the view of a shared
+        memory block (see misc.shared). real and imag, two shared arrays receiving its
+        real and imaginary parts, are kept for compatibility.
+        - checkpoint: Path of the .npz file where the iteration state is saved every
+        checkpoint_every iterations (if nonzero) and at the end (see algorithm.checkpoint).
+        - resume: Checkpoint (path or loaded dict) to carry on from, instead of phi0.
+        niter then counts the iterations of the checkpoint too.
     Output:
         - phi: Estimation of the phase that best approximates the specified
         propagation.
-        - MSE: Mean squared errors at each iteration
-        - alpha: Values of the acceleration parameters at each iteration
+        - MSE: Mean squared errors at each iteration. Iterations where it was not
+        evaluated keep the last evaluated value.
+        - alpha: Values of the acceleration parameters at each iteration (norm of
+        the mixing coefficients for Anderson acceleration)
+        - reason: Why the iteration stopped (see algorithm.stopping).
     """
+    real_t, complex_t = PRECISIONS[precision]
+    As_full, H_full = As, H     # Kept for a later promotion to double precision
+    As = [np.asarray(Ai, dtype=real_t) for Ai in As]
+    H = np.asarray(H, dtype=complex_t)
     ny, nx = As[0].shape
-    xk = np.zeros((ny, nx), dtype=np.complex128)
-    yk = np.zeros_like(xk)
-    g_k1 = np.zeros_like(xk)
-    g_k2 = np.zeros_like(xk)
-    hk = np.zeros_like(xk)
-    H_back = np.conj(H)**(len(As)-1)   # Back propagation from the final plane
+    ws = Workspace((ny, nx), complex_t, backend, workers, jit, anderson)
+    steps, H_back = plane_steps(H, len(As))    # H_back: back propagation from the final plane
     alphes = np.zeros(niter)
     mses = np.zeros(niter)
-    Ui = np.zeros(As[0].shape, dtype=np.complex128)
 
-    k = 1/np.sum(As[0]**2)
-    yk[:] = np.exp(1j*phi0)
+    k = 1/np.sum(np.asarray(As_full[0], dtype=np.float64)**2)
+    i0 = 0
+    if resume is not None:
+        state = load_checkpoint(resume) if isinstance(resume, (str, os.PathLike)) else resume
+        restore_state(ws, state)
+        i0 = min(state["iteration"], niter)
+        mses[:i0] = state["mses"][:i0]
+        alphes[:i0] = state["alphes"][:i0]
+        mse = mses[i0-1] if i0 else np.inf
+    else:
+        ws.yk[:] = np.exp(1j*phi0)
+    policy = StoppingPolicy(niter, eps, **(stopping or {}))
+    # Interruptible runs keep the best field so far, as the last one may be worse
+    best = np.empty_like(ws.xk) if policy.interruptible else None
+    best_mse = np.inf
+    reason = "niter"
+    i = i0-1
+    for i in range(i0, niter):
+
+        ws.begin_iteration()
+        # --- Calculation of psi(yk)
+        # Forward
+        for Ai, Hi in zip(As[:-1], steps):
+            ws.propagate(Ai, Hi)
+
+        # Backward, comparing the moduli in the initial plane (if the MSE is due)
+        evaluate = policy.evaluate(i)
+        error = ws.propagate(As[-1], H_back, A0=As[0] if evaluate else None)
+        if evaluate:
+            mse = error*k
+
+        # --- 
+
+        alpha = ws.anderson() if anderson else ws.accelerate()
+        alphes[i] = alpha
+
+        mses[i] = mse
+        if best is not None and evaluate and mse < best_mse:
+            best_mse = mse
+            np.copyto(best, ws.xk)
+        # BREAK CONDITION: MSE < EPS (TARGET) OR ANY OTHER STOPPING POLICY
+        stop = policy.check(i, mse if evaluate else None)
+        if stop:
+            reason = stop
+            break
+        if verbose and evaluate:
+            print(f"alpha = {alpha:8.3g}\tMSE = {mse:8.4g}")
+        # Every iteration is reported, so that consumers can count them
+        report(queue, mse, alpha)
+        # Mixed precision: carry on in double precision once the MSE flattens
+        if precision == "mixed" and complex_t is np.complex64 and evaluate and \
+                mse_flattened(mses, i):
+            real_t, complex_t = PRECISIONS["double"]
+            ws = ws.astype(complex_t)
+            best = best.astype(complex_t) if best is not None else None
+            As = [np.asarray(Ai, dtype=real_t) for Ai in As_full]
+            steps, H_back = plane_steps(np.asarray(H_full, dtype=complex_t), len(As))
+        if checkpoint and checkpoint_every and (i+1) % checkpoint_every == 0:
+            save_checkpoint(checkpoint, ws, i+1, mses, alphes)
+    if checkpoint:
+        save_checkpoint(checkpoint, ws, i+1, mses, alphes)
+    xk = ws.xk
+    if reason in ("time", "cancelled") and best_mse < mse:
+        xk = best
+    store_field(xk, out, real, imag)
+    store_reason(reason, reason_out)
+    return xk, mses, alphes, reason
+
+def multi_anderson(H, niter, phi0, *As, m=5, **kwargs):
+    """multi with Anderson acceleration of depth m."""
+    return multi(H, niter, phi0, *As, anderson=m, **kwargs)
+
+def store_field(xk, out=None, real=None, imag=None):
+    """Write a complex field into out, a complex array of its size, and/or into the
+    shared arrays (multiprocessing.Array) holding its real and imaginary parts."""
+    if out is not None:
+        out[...] = np.reshape(xk, out.shape)
+    if real is not None:
+        np.ctypeslib.as_array(real.get_obj())[:] = xk.real.ravel()
+        np.ctypeslib.as_array(imag.get_obj())[:] = xk.imag.ravel()
+
+def pyramid_iterations(niter, n_levels, fine_fraction=0.1):
+    """Split niter among the levels of a pyramid: a fine_fraction of them (at least 5)
+    for the full resolution level and the rest evenly among the coarser ones. A single
+    level gets them all."""
+    if n_levels <= 1:
+        return [niter]
+    fine = min(niter, max(5, int(niter*fine_fraction)))
+    coarse = niter-fine
+    iters = [coarse//(n_levels-1)]*(n_levels-1)
+    iters[-1] += coarse-sum(iters)
+    return iters+[fine]
+
+def multi_pyramid(H, niter, phi0, *As, levels=(4, 2), verbose=False, queue=None, real=None,
+                  imag=None, eps=MSE_THRESHOLD, fine_fraction=0.1, min_size=0, stopping=None,
+                  reason_out=None, out=None, **kwargs):
+    """Coarse-to-fine multipass phase retrieval. The retrieval is first solved on
+    grids downsampled by each of the factors in levels (spectral cropping of the
+    moduli and of H, i.e. same window with coarser pixels), and each solution is
+    upsampled to warm-start the next level, so that most of the iterations run on
+    small grids and only a fine_fraction of niter at full resolution.
+
+    Parameters:
+        - H, niter, phi0, *As, verbose, eps: As in multi.
+        - levels: Downsampling factors of the coarse levels, from coarsest to finest.
+        - queue, real, imag, out: As in multi. The queue receives the MSE of every
+        level, one after another.
+        - fine_fraction: Fraction of niter spent at full resolution.
+        - min_size: Smallest grid of a level. Grids smaller than the spectral support of
+        the irradiances alias them and spoil the warm start. If no level is smaller
+        than the full grid, this is just multi.
+        - stopping, reason_out: As in multi. Each level stops on its own, but the
+        wall-clock budget is shared by all of them.
+        - **kwargs: Passed to multi at each level (backend, precision...)
+    Output:
+        - phi: Estimation of the phase at full resolution.
+        - MSE: Mean squared errors at each iteration, all levels concatenated.
+        - alpha: Values of the acceleration parameters at each iteration.
+        - reason: Why the last level run stopped.
+    """
+    n = As[0].shape[-1]
+    sizes = sorted({min(n, max(n//f - (n//f) % 2, min_size)) for f in levels} | {n})
+    iters = pyramid_iterations(niter, len(sizes), fine_fraction)
+    # Levels left without iterations are skipped, they would lose the incoming phase
+    kept = [(m, it) for m, it in zip(sizes, iters) if it or m == n]
+    sizes, iters = [m for m, _ in kept], [it for _, it in kept]
+    if len(sizes) == 1:
+        # No coarse level fits (min_size of the whole grid) or has iterations left
+        return multi(H, niter, phi0, *As, verbose=verbose, queue=queue, real=real, imag=imag,
+                     eps=eps, stopping=stopping, reason_out=reason_out, out=out, **kwargs)
+    phi = resample_phase(phi0, sizes[0])
+    all_mses, all_alphes = [], []
+    stopping = dict(stopping or {})
+    deadline = stopping.get("max_seconds")
+    if deadline is not None:
+        deadline += time.perf_counter()
+    for level, (m, it) in enumerate(zip(sizes, iters)):
+        As_m = [resample_amplitude(Ai, m) for Ai in As]
+        H_m = crop_transfer_function(H, m)
+        if verbose:
+            print(f"Pyramid level {level}: {m}x{m}, {it} iterations")
+        if deadline is not None:
+            stopping["max_seconds"] = deadline-time.perf_counter()
+        xk, mses, alphes, reason = multi(H_m, it, phi, *As_m, verbose=verbose, queue=queue,
+                                         eps=eps, stopping=stopping, **kwargs)
+        all_mses.append(mses)
+        all_alphes.append(alphes)
+        if reason in ("time", "cancelled"):
+            break
+        if level < len(sizes)-1:
+            # Warm start of the next level, through the band limited field
+            phi = np.angle(spectral_resample(As_m[0]*xk, sizes[level+1]))
+    if m != n:
+        xk = np.exp(1j*np.angle(spectral_resample(As_m[0]*xk, n)))
+    store_field(xk, out, real, imag)
+    store_reason(reason, reason_out)
+    return xk, np.concatenate(all_mses), np.concatenate(all_alphes), reason
+
+def multi_batch(H, niter, phi0, *As, verbose=False, queues=None, reals=None, imags=None,
+                eps=MSE_THRESHOLD, backend=None, workers=None, groups=None, prune_after=None,
+                prune_margin=0.02, mse_outs=None, precision="double", outs=None, stopping=None,
+                reason_outs=None):
+    """Batched multipass phase retrieval. Same method as multi, but every modulus
+    carries a leading batch axis, so that several independent retrievals (e.g. the
+    X and Y components of a beam, or several datasets of the same size) are iterated
+    together through stacked FFTs. Each batch element has its own acceleration
+    factor and MSE, and leaves the loop as soon as it reaches eps.
+
+    Batch elements may also be alternative starts of the same retrieval, labelled
+    through groups. A group is finished as soon as any of its starts reaches eps,
+    and every prune_after iterations the starts lagging behind the best one of their
+    group by more than prune_margin (relative MSE) are dropped.
+
+    Parameters:
+        - H: Free space transfer function between two consecutive planes. Either
+        shared by all the batch elements, (n, n), or one per element, (B, n, n). Non
+        equidistant planes take the stack of the transfer functions of each step,
+        (len(As)-1, B or 1, n, n).
+        - niter: Number of iterations for the algorithm
+        - phi0: Initial guess for the phase, (n, n) or (B, n, n).
+        - *As: Moduli of the complex amplitudes taken each at a distance z
+        from each other, each of shape (B, n, n) or (n, n) if shared by all the
+        batch elements. The minimum number of planes for the algorithm to work is 2.
+        - verbose: Print status of the phase retrieval at each iteration.
+        - queues, outs, reals, imags: Optional sequences of queues and output arrays,
+        one per group, playing the same role as in multi. They receive the best MSE
+        and the best field of each group.
+        - eps: Target MSE of each batch element.
+        - backend, workers: FFT backend and number of threads to use.
+        - precision: "double", "single" or "mixed", as in multi. Mixed precision runs
+        are promoted once the MSE of every remaining element flattens.
+        - groups: Group label (0...G-1) of each batch element. By default, each
+        element is a group of its own.
+        - prune_after: Number of iterations between prunings. None disables it.
+        - prune_margin: Relative MSE excess over the best start that gets pruned.
+        - mse_outs: Optional sequence of arrays, one per group, receiving the MSE
+        history of each start of the group, (starts, niter) flattened.
+        - stopping: As in multi, only max_seconds, cancel and check_every apply. The
+        elements of an interrupted batch return their estimation of lowest MSE.
+        - reason_outs: Optional sequence of shared character arrays, one per group,
+        receiving its stop reason (see multi).
+    Output:
+        - phi: Estimation of the phases, (B, n, n).
+        - MSE: Mean squared errors at each iteration, (B, niter). Zero once an
+        element has left the batch.
+        - alpha: Values of the acceleration parameters at each iteration, (B, niter).
+        - reasons: Why the iteration of each group stopped: "threshold" once any of its
+        starts reached eps, else "time", "cancelled" or "niter" (see algorithm.stopping).
+    """
+    fft = get_backend(backend, workers)
+    nb = max([np.shape(phi0)[0] if np.ndim(phi0) == 3 else 1] +
+             [np.shape(Ai)[0] for Ai in As if np.ndim(Ai) == 3])
+    ny, nx = np.shape(As[0])[-2:]
+    real_t, complex_t = PRECISIONS[precision]
+    As = np.stack([np.broadcast_to(Ai, (nb, ny, nx)) for Ai in As])
+    k = 1/np.sum(As[0]**2, axis=(-2, -1))
+    # Kept for a later promotion to double precision
+    As_full, H_full = (As, H) if precision == "mixed" else (None, None)
+    As = As.astype(real_t, copy=False)
+    n_planes = len(As)
+    stacked = np.ndim(H) == 4   # A transfer function per step
+    H_shape = (len(H), nb, ny, nx) if stacked else (nb, ny, nx)
+    H = np.broadcast_to(np.asarray(H, dtype=complex_t), H_shape)
+    _, H_back = plane_steps(H, n_planes, ndim=3)   # Back propagation from the final plane
+    groups = np.arange(nb) if groups is None else np.asarray(groups)
+    n_groups = groups.max()+1
+    axes = (-2, -1)
+    result = np.zeros((nb, ny, nx), dtype=complex_t)
+    alphes = np.zeros((nb, niter))
+    mses = np.zeros((nb, niter))
+
+    # Indices of the batch elements still being iterated. Finished elements are
+    # removed from the working arrays, so that they do not cost any more FFTs.
+    active = np.arange(nb)
+    xk = np.zeros((nb, ny, nx), dtype=complex_t)
+    g_k1 = np.zeros_like(xk)
+    g_k2 = np.zeros_like(xk)
+    hk = np.zeros_like(xk)
+    policy = StoppingPolicy(niter, eps, **(stopping or {}))
+    reasons = ["niter"]*n_groups
+    interrupted = None
+    # Interruptible runs keep the best field of each element, as the last one may be worse
+    best_xk = np.zeros_like(result) if policy.interruptible else None
+    best_xk_mse = np.full(nb, np.inf)
+    yk = np.exp(1j*np.broadcast_to(phi0, (nb, ny, nx))).astype(complex_t)
     for i in range(niter):
 
-        g_k2[:] = g_k1[:]
+        g_k2[:] = g_k1
         g_k1[:] = yk    # Saving yk for next step
         hk[:] = xk
         # --- Calculation of psi(yk)
         # Forward
-        for Ai in As[:-1]:
-            Ui[:] = Ai*yk
-            Ui[:] = ifft2(fft2(Ui)*H)
+        for j, Ai in enumerate(As[:-1]):
+            Ui = fft.fft2(Ai*yk, axes=axes)
+            Ui = fft.ifft2(Ui*(H[j] if stacked else H), axes=axes, overwrite_x=True)
             yk[:] = Ui/(abs(Ui)+1e-16)  # Recover only the complex phase
 
         # Backward
-        Ui[:] = As[-1]*yk
-        Ui[:] = fft2(Ui)
-        Ui[:] = ifft2(Ui*H_back)
+        Ui = fft.fft2(As[-1]*yk, axes=axes)
+        Ui = fft.ifft2(Ui*H_back, axes=axes, overwrite_x=True)
         yk[:] = Ui/(abs(Ui)+1e-16)
 
-        # --- 
+        # ---
 
         g_k1[:] = yk-g_k1   # g_k1 = psi(y_k)-y_k
-        xk[:] = yk[:]
+        xk[:] = yk
         hk[:] = xk-hk
-        # Calculating the acceleration factor
-        alpha = np.sum(np.conj(g_k1)*g_k2)/(np.sum(np.conj(g_k2)*g_k2)+1e-16)
-        #alpha = np.sqrt(np.sum(g_k1*g_k1)/(np.sum(g_k2*g_k2)+1e-16))
-        alpha = min(max(0, np.real(alpha)), 1)   # 0 < alpha < 1
-        alphes[i] = alpha
+        # Calculating the acceleration factor of each batch element
+        alpha = (np.sum(np.conj(g_k1)*g_k2, axis=axes) /
+                 (np.sum(np.conj(g_k2)*g_k2, axis=axes)+1e-16))
+        alpha = np.clip(np.real(alpha), 0, 1)   # 0 < alpha < 1
+        alphes[active, i] = alpha
         # Acceleration method, new point estimation
-        yk[:] = xk+alpha*hk
+        yk[:] = xk+alpha[:, None, None]*hk
 
-        mse = np.sum((abs(Ui)-As[0])**2)*k
-        mses[i] = mse
-        # BREAK CONDITION: IF MSE < EPS (TARGET), TERMINATE PROCESS
-        if mse < eps:
-            break
+        mse = np.sum((abs(Ui)-As[0])**2, axis=axes)*k
+        mses[active, i] = mse
+        if best_xk is not None:
+            improved = mse < best_xk_mse[active]
+            best_xk[active[improved]] = xk[improved]
+            best_xk_mse[active[improved]] = mse[improved]
+        labels = groups[active]
+        best = np.full(n_groups, np.inf)
+        np.minimum.at(best, labels, mse)
         if verbose:
-            print(f"alpha = {alpha:8.3g}\tMSE = {mse:8.4g}")
-        if queue:
-            queue.put(mse)
-    if queue:
-        n = nx*ny
-        rk = xk.real.flatten()
-        ik = xk.imag.flatten()
-        for i in range(n):
-            real[i] = rk[i]
-            imag[i] = ik[i]
-    if not queue:
-        return xk, mses, alphes
+            for b, a, m in zip(active, alpha, mse):
+                print(f"[{b}] alpha = {a:8.3g}\tMSE = {m:8.4g}")
+        # BREAK CONDITION: GROUPS WITH MSE < EPS (TARGET) LEAVE THE BATCH
+        converged = best < eps
+        for g in np.flatnonzero(converged):
+            reasons[g] = "threshold"
+        if queues:
+            for g in np.unique(labels):
+                if not converged[g]:
+                    j = np.argmin(np.where(labels == g, mse, np.inf))
+                    report(queues[g], best[g], alpha[j])
+        done = converged[labels]
+        if prune_after and (i+1) % prune_after == 0:
+            done |= mse > best[labels]*(1+prune_margin)
+        if done.any():
+            result[active[done]] = xk[done]
+            keep = ~done
+            active = active[keep]
+            As = As[:, keep]
+            H = H[:, keep] if stacked else H[keep]
+            H_back, k = H_back[keep], k[keep]
+            xk, yk, hk = xk[keep], yk[keep], hk[keep]
+            g_k1, g_k2 = g_k1[keep], g_k2[keep]
+            if not active.size:
+                break
+        interrupted = policy.check(i)
+        if interrupted:
+            break   # Cancelled or out of time
+        # Mixed precision: carry on in double precision once the MSE flattens
+        if precision == "mixed" and complex_t is np.complex64 and mse_flattened(mses[active], i):
+            real_t, complex_t = PRECISIONS["double"]
+            xk, yk, hk, g_k1, g_k2, result = [a.astype(complex_t) for a in (xk, yk, hk, g_k1, g_k2, result)]
+            best_xk = best_xk.astype(complex_t) if best_xk is not None else None
+            As = As_full[:, active].astype(real_t)
+            H = np.broadcast_to(np.asarray(H_full, dtype=complex_t), H_shape)
+            H = H[:, active] if stacked else H[active]
+            _, H_back = plane_steps(H, n_planes, ndim=3)
+    result[active] = xk
+    if interrupted:
+        result = best_xk
+
+    if outs is not None or reals is not None:
+        for g, b in enumerate(best_starts(mses, groups, lowest=bool(interrupted))):
+            store_field(result[b], outs[g] if outs is not None else None,
+                        reals[g] if reals is not None else None,
+                        imags[g] if imags is not None else None)
+    if mse_outs is not None:
+        for g in range(n_groups):
+            mse_outs[g][:] = mses[groups == g].ravel()
+    if interrupted:
+        reasons = [interrupted if reason == "niter" else reason for reason in reasons]
+    for reason, reason_out in zip(reasons, reason_outs or []):
+        store_reason(reason, reason_out)
+    return result, mses, alphes, reasons
+
+def multi_start(H, niter, phi0, *As, verbose=False, queue=None, real=None, imag=None,
+                eps=MSE_THRESHOLD, backend=None, workers=None, prune_after=20, prune_margin=0.02,
+                mse_out=None, precision="double", out=None, stopping=None, reason_out=None):
+    """Multi-start multipass phase retrieval. Iterates several initial guesses of
+    the same retrieval as a single batch (see multi_batch), periodically pruning
+    those lagging behind the best one, and keeps the best of them.
+
+    Parameters:
+        - H: Free space transfer function(s), as in multi.
+        - niter: Number of iterations for the algorithm
+        - phi0: Initial guesses for the phase, (N, n, n).
+        - *As: Moduli of the complex amplitudes at each plane, as in multi.
+        - queue, real, imag, out: As in multi, for the best start.
+        - backend, workers: FFT backend and number of threads to use.
+        - precision: "double", "single" or "mixed", as in multi.
+        - prune_after, prune_margin: Pruning policy, see multi_batch.
+        - mse_out: Optional array receiving the (N, niter) MSE histories, flattened.
+        - stopping, reason_out: As in multi_batch and multi.
+    Output:
+        - phi: Estimation of the phase given by the best start (that of the lowest
+        final MSE, or lowest MSE overall if interrupted, see best_starts).
+        - MSE: Mean squared errors of every start at each iteration, (N, niter).
+        - alpha: Acceleration parameters of every start at each iteration, (N, niter).
+        - reason: Why the iteration stopped, as in multi_batch.
+    """
+    n_starts = len(phi0)
+    groups = np.zeros(n_starts, dtype=int)
+    if np.ndim(H) == 3:
+        H = np.asarray(H)[:, None]  # Steps shared by every start
+    xk, mses, alphes, reasons = multi_batch(
+        H, niter, phi0, *As, verbose=verbose, queues=[queue] if queue else None, outs=[out],
+        reals=[real], imags=[imag], eps=eps, backend=backend, workers=workers, groups=groups,
+        prune_after=prune_after, prune_margin=prune_margin,
+        mse_outs=None if mse_out is None else [mse_out], precision=precision, stopping=stopping,
+        reason_outs=[reason_out])
+    best = best_starts(mses, groups, lowest=reasons[0] in ("time", "cancelled"))[0]
+    return xk[best], mses, alphes, reasons[0]
+
+def best_starts(mses, groups, lowest=False):
+    """Index of the batch element with the lowest final MSE within each group or, if
+    lowest (interrupted batches, returning the best estimation of each element), with
+    the lowest MSE of its history."""
+    if lowest:
+        last = np.array([m[m > 0].min() if m.any() else np.inf for m in mses])
+    else:
+        last = np.array([m[np.flatnonzero(m)[-1]] if m.any() else np.inf for m in mses])
+    return [np.flatnonzero(groups == g)[np.argmin(last[groups == g])]
+            for g in range(groups.max()+1)]
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Projection based variants of the multipass phase retrieval. Each of them combines
+two constraints on the complex field z at the initial plane:
+
+    - P_A: Modulus projection at the initial plane, z -> A_0*z/|z|.
+    - P_B: Multiplane pass, propagating z through every plane, replacing its modulus
+    by the measured one at each of them and propagating it back to the initial plane,
+    as multi does.
+
+so that the plain Gerchberg-Saxton iteration is z -> P_A(P_B(z)). HIO, RAAR and the
+difference map mix both constraints through a relaxation parameter beta, which lets
+the iteration escape from the stagnation points of the plain alternating scheme.
+All of them share the signature and outputs of multi (see algorithm.registry).
+"""
+import numpy as np
+
+from phase_retriever.constants import MSE_THRESHOLD
+from phase_retriever.misc.fft_backend import get_backend
+from phase_retriever.algorithm.multipass_retrieval import PRECISIONS, mse_flattened, store_field
+from phase_retriever.algorithm.stopping import StoppingPolicy, store_reason
+from phase_retriever.misc.shared import report
+from phase_retriever.misc.planes import plane_steps
+
+class MultiplaneConstraints():
+    def __init__(self, H, As, complex_t=np.complex128, backend=None, workers=None):
+        """Constraints of the multipass retrieval, with a preallocated propagation buffer.
+
+        Parameters:
+            - H: Free space transfer function between two consecutive planes, or stack
+            of those of each step (see multi).
+            - As: Measured moduli at each plane, in the order they are visited.
+            - complex_t: Complex dtype of the fields (complex128 or complex64).
+            - backend, workers: FFT backend and number of threads (see misc.fft_backend).
+        """
+        real_t = np.float32 if complex_t == np.complex64 else np.float64
+        self.As = [np.asarray(Ai, dtype=real_t) for Ai in As]
+        # H_back: back propagation from the final plane
+        self.H, self.H_back = plane_steps(np.asarray(H, dtype=complex_t), len(As))
+        self.U = np.zeros(self.As[0].shape, dtype=complex_t)
+        fft = get_backend(backend, workers)
+        self.fft2 = fft.plan_inplace(self.U)
+        self.ifft2 = fft.plan_inplace(self.U, inverse=True)
+        self.error = 0.
+
+    def P_A(self, z):
+        return self.As[0]*z/(abs(z)+1e-16)
+
+    def P_B(self, z):
+        """Multiplane pass of z. The squared error between the modulus of the result
+        and the initial plane modulus is kept in self.error."""
+        self.U[:] = z
+        for Ai, Hi in zip(self.As[1:], self.H):
+            self._propagate(Hi)
+            self.U *= Ai/(abs(self.U)+1e-16)
+        self._propagate(self.H_back)
+        self.error = np.sum((abs(self.U)-self.As[0])**2)
+        return self.U.copy()
+
+    def _propagate(self, H):
+        self.fft2()
+        self.U *= H
+        self.ifft2()
+
+def hio(z, c, beta):
+    """Hybrid input-output: z + P_A((1+beta)P_B z - z) - beta P_B z."""
+    pb = c.P_B(z)
+    return z+c.P_A((1+beta)*pb-z)-beta*pb, pb
+
+def raar(z, c, beta):
+    """Relaxed averaged alternating reflections: beta/2 (R_A R_B + I) z + (1-beta) P_B z."""
+    pb = c.P_B(z)
+    rb = 2*pb-z
+    return .5*beta*(2*c.P_A(rb)-rb+z)+(1-beta)*pb, pb
+
+def difference_map(z, c, beta):
+    """Elser's difference map, with gamma_A = -1/beta and gamma_B = 1/beta. Needs two
+    multiplane passes per iteration."""
+    pa = c.P_A(z)
+    f_a = pa-(pa-z)/beta
+    pb = c.P_B(z)
+    f_b = pb+(pb-z)/beta
+    pb_fa = c.P_B(f_a)
+    return z+beta*(c.P_A(f_b)-pb_fa), pb_fa
+
+def iterate_projections(update, H, niter, phi0, *As, verbose=False, queue=None, real=None,
+                        imag=None, eps=MSE_THRESHOLD, backend=None, workers=None,
+                        precision="double", beta=0.9, stopping=None, reason_out=None,
+                        out=None):
+    """Common driver of the projection algorithms. Iterates z -> update(z, constraints, beta)
+    from z = A_0*exp(i*phi0), where update returns the new iterate and the multiplane
+    pass P_B giving the current estimation of the field at the initial plane.
+
+    Parameters:
+        - update: One of hio, raar or difference_map.
+        - beta: Relaxation parameter.
+        - The rest, as in multi.
+    Output:
+        - phi: Estimation of the phase (as a unit modulus field).
+        - MSE: Mean squared errors at each iteration.
+        - beta: Relaxation parameter at each iteration.
+        - reason: Why the iteration stopped (see algorithm.stopping).
+    """
+    real_t, complex_t = PRECISIONS[precision]
+    c = MultiplaneConstraints(H, As, complex_t, backend, workers)
+    betas = np.zeros(niter)
+    mses = np.zeros(niter)
+    k = 1/np.sum(np.asarray(As[0], dtype=np.float64)**2)
+    z = (c.As[0]*np.exp(1j*phi0)).astype(complex_t)
+    # The error comes with every multiplane pass, so it is always checked (no mse_every)
+    policy = StoppingPolicy(niter, eps, **(stopping or {}))
+    # The iteration is not monotonic, so interrupted runs return the best estimate so far
+    best, best_mse = None, np.inf
+    reason = "niter"
+    for i in range(niter):
+        z, estimate = update(z, c, beta)
+        mse = c.error*k
+        betas[i] = beta
+        mses[i] = mse
+        if policy.interruptible and mse < best_mse:
+            best, best_mse = estimate, mse
+        stop = policy.check(i, mse)
+        if stop:
+            reason = stop
+            break
+        if verbose:
+            print(f"beta = {beta:8.3g}\tMSE = {mse:8.4g}")
+        report(queue, mse, beta)
+        # Mixed precision: carry on in double precision once the MSE flattens
+        if precision == "mixed" and complex_t is np.complex64 and mse_flattened(mses, i):
+            real_t, complex_t = PRECISIONS["double"]
+            c = MultiplaneConstraints(H, As, complex_t, backend, workers)
+            z = z.astype(complex_t)
+    if reason in ("time", "cancelled"):
+        estimate = best
+    xk = estimate/(abs(estimate)+1e-16)
+    store_field(xk, out, real, imag)
+    store_reason(reason, reason_out)
+    return xk, mses, betas, reason
+
+def multi_hio(H, niter, phi0, *As, beta=0.9, **kwargs):
+    return iterate_projections(hio, H, niter, phi0, *As, beta=beta, **kwargs)
+
+def multi_raar(H, niter, phi0, *As, beta=0.9, **kwargs):
+    return iterate_projections(raar, H, niter, phi0, *As, beta=beta, **kwargs)
+
+def multi_dm(H, niter, phi0, *As, beta=0.9, **kwargs):
+    return iterate_projections(difference_map, H, niter, phi0, *As, beta=beta, **kwargs)
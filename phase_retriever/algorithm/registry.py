@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Registry of the phase retrieval algorithms. Every registered algorithm iterates one
+component with the interface of multi:
+
+    fun(H, niter, phi0, *As, verbose=False, queue=None, real=None, imag=None,
+        eps=MSE_THRESHOLD, backend=None, workers=None, precision="double",
+        stopping=None, reason_out=None, out=None)
+        -> (field, mses, parameters, reason)
+
+so that SinglePhaseRetriever can run any of them through its "algorithm" option.
+Besides the function, each entry keeps the number of multiplane passes (i.e. of
+propagations through all the planes and back) per iteration, so that algorithms
+can be compared by the FFTs they need to reach a given MSE. Algorithms whose cost
+changes between iterations (passes=None) return their FFTs at each iteration as
+third output instead.
+"""
+import numpy as np
+
+from phase_retriever.constants import MSE_THRESHOLD
+from phase_retriever.algorithm.multipass_retrieval import multi, multi_anderson
+from phase_retriever.algorithm.projections import multi_hio, multi_raar, multi_dm
+from phase_retriever.algorithm.gradient import multi_lbfgs
+
+ALGORITHMS = {}
+
+def register_algorithm(name, function, passes=1):
+    """Make function available as name. passes: multiplane passes per iteration, or
+    None if function returns the FFTs of each iteration."""
+    ALGORITHMS[name] = {"function": function, "passes": passes}
+
+def get_algorithm(name):
+    if name not in ALGORITHMS:
+        raise ValueError(f"Unknown algorithm {name}. Options: {list(ALGORITHMS)}")
+    return ALGORITHMS[name]["function"]
+
+def iterations_to_threshold(H, niter, phi0, *As, names=None, eps=MSE_THRESHOLD, **kwargs):
+    """Run each of the named algorithms (all of them by default) from the same initial
+    phase and report, for each one, the iterations and FFTs needed to reach an MSE
+    below eps (None if it was not reached in niter iterations) and its final MSE.
+    kwargs are passed to every algorithm."""
+    report = {}
+    for name in names or ALGORITHMS:
+        _, mses, params, _ = get_algorithm(name)(H, niter, phi0, *As, eps=eps, **kwargs)
+        below = np.flatnonzero(mses[:np.count_nonzero(mses)] < eps)
+        iterations = int(below[0])+1 if below.size else None
+        last = below[0] if below.size else np.count_nonzero(mses)-1
+        passes = ALGORITHMS[name]["passes"]
+        if passes is None:
+            ffts = int(np.sum(params[:iterations])) if iterations else None
+        else:
+            ffts = iterations*2*len(As)*passes if iterations else None
+        report[name] = {"iterations": iterations, "ffts": ffts, "mse": float(mses[last])}
+    return report
+
+register_algorithm("multi", multi)
+register_algorithm("anderson", multi_anderson)
+register_algorithm("hio", multi_hio)
+register_algorithm("raar", multi_raar)
+register_algorithm("dm", multi_dm, passes=2)
+register_algorithm("lbfgs", multi_lbfgs, passes=None)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stopping policies of the iterative retrieval algorithms. Besides reaching the MSE
+threshold, an iteration can be stopped when the MSE stagnates, when the trend of
+its last values shows the threshold will not be reached within the remaining
+iterations, when a wall-clock budget runs out or when it is cancelled from another
+thread or process. Each algorithm builds its policy
+from a dict of options (see StoppingPolicy), and returns the reason of its stop:
+
+    - "threshold": The MSE fell below eps.
+    - "stagnation": Relative improvement below tol over the last window iterations.
+    - "unreachable": The extrapolated MSE at niter is still above eps.
+    - "time": The wall-clock budget was exhausted.
+    - "cancelled": The cancellation token was set.
+    - "niter": All the iterations were run.
+
+Interrupted runs ("time" or "cancelled") return the field with the lowest MSE found
+so far.
+"""
+import time
+import numpy as np
+
+STOP_REASONS = ("threshold", "stagnation", "unreachable", "time", "cancelled", "niter")
+
+class StoppingPolicy():
+    def __init__(self, niter, eps, window=0, tol=1e-3, extrapolate=False, max_seconds=None,
+                 mse_every=1, cancel=None, check_every=1):
+        """Parameters:
+            - niter: Maximum number of iterations.
+            - eps: MSE threshold.
+            - window: Iterations over which stagnation and trends are measured (0: the
+            MSE is only compared against eps).
+            - tol: Smallest relative improvement of the MSE over window iterations.
+            - extrapolate: Stop when a log-linear fit of the MSE over the last window
+            iterations predicts an MSE above eps at niter.
+            - max_seconds: Wall-clock budget, measured from the creation of the policy.
+            - mse_every: Evaluate the MSE only every mse_every iterations (and at the
+            last one). The rest of the iterations skip its reduction.
+            - cancel: Cancellation token, any object with an is_set method (e.g.
+            misc.shared.CancelToken or threading.Event).
+            - check_every: Iterations between checks of the token and of the clock.
+        """
+        self.niter = niter
+        self.eps = eps
+        self.window = window
+        self.tol = tol
+        self.extrapolate = extrapolate
+        self.max_seconds = max_seconds
+        self.mse_every = max(1, int(mse_every))
+        self.cancel = cancel
+        self.check_every = max(1, int(check_every))
+        self.t0 = time.perf_counter()
+        self.evaluated = []     # (iteration, MSE) of every evaluation
+
+    def evaluate(self, i):
+        """Whether the MSE has to be computed at iteration i."""
+        return i % self.mse_every == 0 or i == self.niter-1
+
+    def check(self, i, mse=None):
+        """Reason to stop after iteration i, given its MSE (None if it was not
+        evaluated), or None to carry on."""
+        if mse is not None:
+            if mse < self.eps:
+                return "threshold"
+            self.evaluated.append((i, mse))
+            if self.window and self._stagnated(i):
+                return "stagnation"
+            if self.window and self.extrapolate and self._unreachable(i):
+                return "unreachable"
+        if i % self.check_every == 0:
+            if self.cancel is not None and self.cancel.is_set():
+                return "cancelled"
+            if self.max_seconds is not None and time.perf_counter()-self.t0 > self.max_seconds:
+                return "time"
+        return None
+
+    @property
+    def interruptible(self):
+        """Whether the iteration may be interrupted by the clock or a cancellation."""
+        return self.cancel is not None or self.max_seconds is not None
+
+    def _past(self, i):
+        """Evaluations from the last window iterations up to i, or None if the
+        history is still shorter."""
+        if i < self.window:
+            return None
+        past = [(j, mse) for j, mse in self.evaluated if j >= i-self.window]
+        return past if len(past) > 1 else None
+
+    def _stagnated(self, i):
+        past = self._past(i)
+        if past is None:
+            return False
+        first, last = past[0][1], past[-1][1]
+        return first-last < self.tol*last
+
+    def _unreachable(self, i):
+        past = self._past(i)
+        if past is None or i < 2*self.window:
+            return False
+        its, mses = np.array(past).T
+        slope, intercept = np.polyfit(its, np.log(mses), 1)
+        return slope*(self.niter-1)+intercept > np.log(self.eps)
+
+def store_reason(reason, reason_out):
+    """Write the stop reason into reason_out, if given: a bytes array of shape () (e.g.
+    the view of a shared memory block, see misc.shared) or a shared character array
+    (multiprocessing.Array("c"))."""
+    if isinstance(reason_out, np.ndarray):
+        reason_out[...] = reason.encode()
+    elif reason_out is not None:
+        reason_out.value = reason.encode()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Initial phase estimate from the transport of intensity equation (TIE),
+
+    k dI/dz = -div(I grad(phi)),
+
+given the irradiances at two close planes. It is solved through the auxiliary
+function psi, grad(psi) = I grad(phi), with two FFT based Poisson solvers:
+
+    phi = -k L^-1 div(grad(L^-1 dI/dz)/I),
+
+where L^-1 is the (regularized) inverse laplacian. Its cost is a handful of FFTs,
+negligible compared to the retrieval itself.
+"""
+import numpy as np
+
+from phase_retriever.misc.fft_backend import fft2, ifft2
+
+def _frequencies(shape, pixel_size):
+    ny, nx = shape
+    fy = np.fft.fftfreq(ny, d=pixel_size)[:, None]
+    fx = np.fft.fftfreq(nx, d=pixel_size)[None, :]
+    return fx, fy
+
+def tie_phase(I0, I1, dz, pixel_size, reg=1e-3, threshold=0.1):
+    """Phase at the plane of I0 solving the TIE from the irradiances I0 and I1,
+    measured a distance dz apart.
+
+    Parameters:
+        - I0, I1: Irradiances at both planes.
+        - dz: Distance between the planes, in wavelength units.
+        - pixel_size: Pixel size, in wavelength units.
+        - reg: Regularization of the inverse laplacian, relative to its smallest
+        nonzero frequency.
+        - threshold: Smallest irradiance, relative to max(I0), dividing the phase
+        gradient.
+    Output:
+        - phi: Phase estimation, with zero mean.
+    """
+    I0 = np.asarray(I0, dtype=np.float64)
+    I1 = np.asarray(I1, dtype=np.float64)
+    k = 2*np.pi     # Wavelength units
+    fx, fy = _frequencies(I0.shape, pixel_size)
+    lap = -4*np.pi**2*(fx*fx+fy*fy)     # Laplacian in the Fourier domain
+    lap_min = 4*np.pi**2/(max(I0.shape)*pixel_size)**2
+    inv_lap = lap/(lap*lap+(reg*lap_min)**2)
+    dIdz = (I1-I0)/dz
+    # Outside the beam, grad(psi)/I would be just noise over nearly zero
+    I = np.maximum(I0, threshold*I0.max())
+    # psi = L^-1 (-k dI/dz), then grad(phi) = grad(psi)/I
+    psi_ft = fft2(-k*dIdz)*inv_lap
+    gx = np.real(ifft2(2j*np.pi*fx*psi_ft))/I
+    gy = np.real(ifft2(2j*np.pi*fy*psi_ft))/I
+    div_ft = 2j*np.pi*(fx*fft2(gx)+fy*fft2(gy))
+    phi = np.real(ifft2(div_ft*inv_lap))
+    return phi-phi.mean()
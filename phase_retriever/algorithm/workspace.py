@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Preallocated workspace for the iterations of the multipass phase retrieval. All
+the buffers and in-place FFT plans are created once, and each iteration runs the
+phase projection, the acceleration step and the MSE reduction in place, either
+through out= ufuncs or, when numba is installed and asked for, through fused JIT
+kernels. Hence, no full size temporary is allocated inside the loop.
+
+    The acceleration step is either the original one step momentum (accelerate) or
+Anderson mixing of depth m (anderson), whose history is kept in two preallocated
+(m, ny, nx) ring buffers.
+"""
+import warnings
+import numpy as np
+
+from phase_retriever.misc.fft_backend import get_backend
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+class Workspace():
+    def __init__(self, shape, complex_t=np.complex128, backend=None, workers=None, jit=False,
+                 anderson=0):
+        """Allocate the buffers of an iteration on fields of the given shape.
+
+        Parameters:
+            - shape: Shape of the fields (ny, nx).
+            - complex_t: Complex dtype of the fields (complex128 or complex64).
+            - backend, workers: FFT backend and number of threads (see misc.fft_backend).
+            - jit: Use the numba fused kernels, if numba is installed. Otherwise, a
+            RuntimeWarning is issued and the numpy kernels are used.
+            - anderson: Depth of the Anderson mixing history (0: not used).
+        """
+        real_t = np.float32 if complex_t == np.complex64 else np.float64
+        self.shape = shape
+        self.complex_t = complex_t
+        self.backend, self.workers = backend, workers
+        self.jit = jit and numba is not None
+        if jit and numba is None:
+            warnings.warn("numba is not installed, using the numpy kernels", RuntimeWarning,
+                          stacklevel=2)
+        self.xk = np.zeros(shape, dtype=complex_t)
+        self.yk = np.zeros_like(self.xk)
+        self.g_k1 = np.zeros_like(self.xk)
+        self.g_k2 = np.zeros_like(self.xk)
+        self.hk = np.zeros_like(self.xk)
+        self.Ui = np.zeros_like(self.xk)
+        self.absU = np.zeros(shape, dtype=real_t)
+        self.res = np.zeros(shape, dtype=real_t)
+        fft = get_backend(backend, workers)
+        self.fft2 = fft.plan_inplace(self.Ui)
+        self.ifft2 = fft.plan_inplace(self.Ui, inverse=True)
+        self.m = anderson
+        if anderson:
+            self.dF = np.zeros((anderson, )+tuple(shape), dtype=complex_t)   # Residual differences
+            self.dG = np.zeros_like(self.dF)   # Differences of the iteration map outputs
+            self.f_prev = np.zeros_like(self.xk)
+            self.gram = np.zeros((anderson, anderson), dtype=np.complex128)
+            self.rhs = np.zeros(anderson, dtype=np.complex128)
+            self.n_mixed = 0    # Iterations since the last restart of the history
+            self.norm_prev = np.inf
+
+    def astype(self, complex_t):
+        """Return a new workspace of the given precision, holding the same state. The
+        Anderson history, if any, is restarted."""
+        other = Workspace(self.shape, complex_t, self.backend, self.workers, self.jit, self.m)
+        for name in ("xk", "yk", "g_k1", "g_k2", "hk", "Ui"):
+            np.copyto(getattr(other, name), getattr(self, name))
+        return other
+
+    def begin_iteration(self):
+        """Keep the last two estimations, needed by the acceleration step."""
+        self.g_k1, self.g_k2 = self.g_k2, self.g_k1
+        np.copyto(self.g_k1, self.yk)   # Saving yk for next step
+        np.copyto(self.hk, self.xk)
+
+    def propagate(self, A, H, A0=None):
+        """Propagate the field A*yk through the transfer function H and keep only
+        its phase in yk. If the reference modulus A0 is given, return the sum of
+        the squared differences between |Ui| and A0."""
+        np.multiply(A, self.yk, out=self.Ui)
+        self.fft2()
+        self.Ui *= H
+        self.ifft2()
+        return self.project(A0)
+
+    def project(self, A0=None):
+        """yk = Ui/|Ui|, optionally returning sum((|Ui|-A0)**2)."""
+        if self.jit:
+            if A0 is None:
+                _normalize_jit(self.Ui, self.yk)
+                return None
+            return _normalize_error_jit(self.Ui, A0, self.yk)
+        np.abs(self.Ui, out=self.absU)
+        error = None
+        if A0 is not None:
+            np.subtract(self.absU, A0, out=self.res)
+            error = np.dot(self.res.ravel(), self.res.ravel())
+        self.absU += 1e-16
+        np.divide(self.Ui, self.absU, out=self.yk)  # Recover only the complex phase
+        return error
+
+    def accelerate(self):
+        """Acceleration step: new estimation yk = xk+alpha*hk, where alpha is obtained
+        from the last two residuals. Return alpha."""
+        np.subtract(self.yk, self.g_k1, out=self.g_k1)  # g_k1 = psi(y_k)-y_k
+        np.copyto(self.xk, self.yk)
+        np.subtract(self.xk, self.hk, out=self.hk)
+        # Calculating the acceleration factor
+        alpha = np.vdot(self.g_k1, self.g_k2)/(np.vdot(self.g_k2, self.g_k2)+1e-16)
+        alpha = min(max(0, np.real(alpha)), 1)   # 0 < alpha < 1
+        # Acceleration method, new point estimation
+        np.multiply(self.hk, alpha, out=self.yk)
+        self.yk += self.xk
+        return alpha
+
+    def anderson(self, reg=1e-10, beta=2.):
+        """Anderson acceleration step of the fixed point iteration y -> G(y), with the
+        input y_k in g_k1 and G(y_k) in yk: the new estimation is
+            yk = G(y_k) + (beta-1) f_k - sum_j gamma_j (dG_j + (beta-1) dF_j),
+        where gamma minimizes |f_k - sum_j gamma_j dF_j|, f = G(y)-y, and dF, dG are
+        the differences of the last m residuals and outputs. gamma is kept real, as a
+        complex one also mixes global phase rotations, to which the moduli are blind.
+        Right after a restart the plain step yk = G(y_k) is taken. Return |gamma|."""
+        np.copyto(self.xk, self.yk)
+        np.subtract(self.yk, self.g_k1, out=self.g_k1)  # f_k = G(y_k)-y_k
+        m = self.m
+        norm = np.real(np.vdot(self.g_k1, self.g_k1))
+        if norm > self.norm_prev:
+            self.n_mixed = 0    # Safeguard: the residual grew, restart the history
+        self.norm_prev = norm
+        if self.n_mixed:
+            j = (self.n_mixed-1) % m    # Oldest column of the ring buffers
+            np.subtract(self.g_k1, self.f_prev, out=self.dF[j])
+            np.subtract(self.yk, self.hk, out=self.dG[j])   # hk = G(y_k-1), see begin_iteration
+            # Only the row and column of the new difference change
+            for i in range(min(self.n_mixed, m)):
+                self.gram[j, i] = np.vdot(self.dF[j], self.dF[i])
+                self.gram[i, j] = np.conj(self.gram[j, i])
+        np.copyto(self.f_prev, self.g_k1)
+        depth = min(self.n_mixed, m)
+        self.n_mixed += 1
+        if not depth:
+            return 0.
+        for i in range(depth):
+            self.rhs[i] = np.vdot(self.dF[i], self.g_k1)
+        gram = np.real(self.gram[:depth, :depth])
+        try:
+            gamma = np.linalg.solve(gram+reg*np.trace(gram)*np.eye(depth),
+                                    np.real(self.rhs[:depth]))
+        except np.linalg.LinAlgError:
+            gamma = None
+        if gamma is None or not np.all(np.isfinite(gamma)):
+            self.n_mixed = 0    # Restart the history, keeping the plain step
+            return 0.
+        np.multiply(self.g_k1, beta-1, out=self.Ui)
+        self.yk += self.Ui
+        for i in range(depth):
+            # g_k1 holds f_k, no longer needed, as scratch
+            np.multiply(self.dF[i], beta-1, out=self.g_k1)
+            self.g_k1 += self.dG[i]
+            self.g_k1 *= gamma[i]
+            self.yk -= self.g_k1
+        return float(np.linalg.norm(gamma))
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def _normalize_jit(U, y):
+        ny, nx = U.shape
+        for i in numba.prange(ny):
+            for j in range(nx):
+                y[i, j] = U[i, j]/(abs(U[i, j])+1e-16)
+
+    @numba.njit(parallel=True, cache=True)
+    def _normalize_error_jit(U, A0, y):
+        ny, nx = U.shape
+        error = 0.
+        for i in numba.prange(ny):
+            for j in range(nx):
+                a = abs(U[i, j])
+                y[i, j] = U[i, j]/(a+1e-16)
+                error += (a-A0[i, j])**2
+        return error
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless batch retrieval of many datasets. Each dataset folder goes through the
+same pipeline as the wx GUI (load_dataset, center_window, align_polarimetric_images,
+select_phase_origin, compute_bandwidth, retrieve and export), configured by the
+*.json file saved by the GUI in that folder, if any:
+
+    python -m phase_retriever batch "data/2023*" other/dataset --jobs 4 --threads 2
+
+Datasets are processed in parallel by --jobs worker processes, each of them running
+its retrieval in place with --threads FFT threads (by default, the fft_workers option
+given by --set or the configuration or, if there is none, the cores split among the
+jobs). Results are exported as {beam}_retrieved.npz (Ex, Ey and Ez, as the
+GUI does, or only Ey for scalar retrievals) next to the images, or in the
+--output folder.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+from phase_retriever.retriever import PhaseRetriever
+from phase_retriever.misc.focalprop import FocalPropagator
+
+EXTENSIONS = ["png", "npy"]     # Indexed by the "ext" entry of the GUI configurations
+# GUI configuration entries and the retriever options they set
+GUI_OPTIONS = {"lamb": "lamb", "pixel_size": "pixel_size", "n_iter": "n_iter",
+               "window_size": "dim"}
+
+def find_datasets(patterns):
+    """Dataset folders given by a list of paths or glob patterns, in order and without
+    repetitions."""
+    folders = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            if os.path.isdir(path) and path not in folders:
+                folders.append(path)
+    return folders
+
+def load_config(path):
+    """Settings of a configuration file, either saved by the wx GUI or holding retriever
+    options directly (e.g. "algorithm": "raar"). Entries proper to the GUI only (roi,
+    window_center...) are ignored, as the window and the phase origin are searched anew.
+
+    Output:
+        - options: Retriever options.
+        - ext: Extension of the images.
+        - bandwidth: Bandwidth, None if it has to be computed.
+        - ref_size: Size of the reference window (window_sizeR), 0 if none.
+    """
+    with open(path, "r") as f:
+        config = json.load(f)
+    options = {GUI_OPTIONS.get(key, key): value for key, value in config.items()
+               if key in GUI_OPTIONS or key in PhaseRetriever().options}
+    for key in ("path", "ext", "bandwidth", "origin", "rect", "rectR"):
+        options.pop(key, None)
+    ext = config.get("ext", "png")
+    ext = EXTENSIONS[ext] if isinstance(ext, int) else ext
+    return options, ext, config.get("bandwidth") or None, config.get("window_sizeR", 0)
+
+def dataset_config(folder, default=None):
+    """Configuration of a dataset: the first *.json in its folder (as the GUI does) or,
+    if there is none, the default one."""
+    candidates = sorted(glob.glob(os.path.join(folder, "*.json")))
+    if candidates:
+        return candidates[0]
+    return default
+
+def process_dataset(folder, config=None, threads=None, output=None, options=None, cores=None):
+    """Retrieve and export the field of the dataset in folder.
+
+    Parameters:
+        - folder: Dataset folder.
+        - config: Configuration file to use when the folder has none.
+        - threads: FFT threads of the retrieval. If None, the fft_workers of options,
+        else that of the configuration, else cores.
+        - output: Folder of the results (None: next to the images).
+        - options: Retriever options overriding those of the configuration.
+        - cores: Cores available to this dataset (None: all of them).
+    Output:
+        - summary: Dict with the dataset, the result path, the number of iterations,
+        the final MSE of each component and the elapsed seconds.
+    """
+    t0 = time.perf_counter()
+    config = dataset_config(folder, config)
+    settings, ext, bandwidth, ref_size = load_config(config) if config else ({}, "png", None, 0)
+    settings.update(options or {})
+
+    retriever = PhaseRetriever()
+    # No worker processes within a job: the retrieval runs in place, with its FFT threads
+    retriever.config(**{**settings, "executor": "inline",
+                        "fft_workers": (threads or settings.get("fft_workers") or cores
+                                        or os.cpu_count())})
+    beam_name = retriever.load_dataset(folder, ftype=ext)
+    prepare(retriever, bandwidth, ref_size)
+    retriever.retrieve()
+
+    path = os.path.join(output or folder, f"{beam_name}_retrieved.npz")
+    export_fields(retriever, path)
+    return {"dataset": folder, "path": path, "iterations": max(map(len, retriever.mse)),
+            "mse": [m[-1] if m else None for m in retriever.mse],
+            "seconds": time.perf_counter()-t0}
+
+def prepare(retriever, bandwidth=None, ref_size=0):
+    """Steps of the wx GUI between loading a dataset and retrieving: window centering,
+    alignment of the images, phase origin and bandwidth (computed, if not given)."""
+    retriever.center_window()
+    if ref_size:
+        retriever.center_window(ref_beam_size=ref_size)
+    if retriever.images[0].get("Irr", None) is not None:
+        retriever.align_polarimetric_images()
+    retriever.select_phase_origin()
+    if bandwidth:
+        retriever.config(bandwidth=bandwidth)
+    else:
+        retriever.compute_bandwidth()
+
+def export_fields(retriever, path):
+    """Save the retrieved field at the first plane, as the export of the wx GUI."""
+    Ex, Ey = retriever.get_trans_fields()
+    if Ey is None:
+        # Scalar retrieval, of the Y component, as loaded by misc.warm_start
+        np.savez(path, Ey=Ex)
+        return
+    propagator = FocalPropagator()
+    propagator["Ex"] = Ex
+    propagator["Ey"] = Ey
+    propagator["pixel_size"] = retriever.options["pixel_size"]/retriever.options["lamb"]
+    propagator.create_spectra()
+    propagator.create_gamma()
+    Ex, Ey, Ez = propagator.propagate_field_to(0)
+    np.savez(path, Ex=Ex, Ey=Ey, Ez=Ez)
+
+def run_batch(folders, jobs=1, threads=None, config=None, output=None, options=None):
+    """Process the dataset folders, jobs at a time, yielding (folder, summary, error) as
+    each of them finishes. threads: FFT threads of each job, overriding any fft_workers
+    option (None: that of the options or configuration, else the cores split among the
+    jobs)."""
+    kwargs = {"config": config, "threads": threads, "output": output, "options": options,
+              "cores": max(1, (os.cpu_count() or 1)//jobs)}
+    if jobs == 1:
+        for folder in folders:
+            try:
+                yield folder, process_dataset(folder, **kwargs), None
+            except Exception as error:
+                yield folder, None, error
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(process_dataset, folder, **kwargs): folder for folder in folders}
+        for future in as_completed(futures):
+            error = future.exception()
+            yield futures[future], None if error else future.result(), error
+
+def parse_options(items):
+    """Retriever options given as OPTION=VALUE strings, with JSON values."""
+    options = {}
+    for item in items:
+        key, _, value = item.partition("=")
+        try:
+            options[key] = json.loads(value)
+        except json.JSONDecodeError:
+            options[key] = value    # Plain strings need no quotes
+    return options
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m phase_retriever batch",
+                                     description="Retrieve the phase of many datasets, without GUI.")
+    parser.add_argument("datasets", nargs="+", help="Dataset folders or glob patterns")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Datasets processed in parallel (default: 1)")
+    parser.add_argument("-t", "--threads", type=int, default=None,
+                        help="FFT threads of each job (default: the fft_workers option, "
+                             "else cores/jobs)")
+    parser.add_argument("-c", "--config", default=None,
+                        help="Configuration of the datasets without their own *.json")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Folder of the results (default: each dataset folder)")
+    parser.add_argument("--set", nargs="*", default=[], metavar="OPTION=VALUE",
+                        help="Retriever options overriding the configurations, with JSON "
+                             "values (e.g. n_iter=300 algorithm=raar)")
+    args = parser.parse_args(argv)
+
+    options = parse_options(args.set)
+    folders = find_datasets(args.datasets)
+    if not folders:
+        parser.error("No dataset folder found")
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    n_errors = 0
+    for folder, summary, error in run_batch(folders, args.jobs, args.threads, args.config,
+                                            args.output, options):
+        if error is not None:
+            n_errors += 1
+            print(f"{folder}: FAILED ({error})", file=sys.stderr)
+            continue
+        mses = ", ".join(f"{m:.4g}" for m in summary["mse"] if m is not None)
+        print(f"{folder}: {summary['iterations']} iterations, MSE {mses}, "
+              f"{summary['seconds']:.1f} s -> {summary['path']}")
+    return n_errors
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the multipass phase retrieval on synthetic data. bench_multi compares
+the iterations per second of the original allocating loop with the preallocated
+workspace kernel of multi (and its numba variant, if installed) for several window
+sizes, and bench_algorithms the iterations and FFTs each registered algorithm
+needs to reach the MSE threshold.
+
+    python -m phase_retriever.benchmark
+"""
+import time
+import numpy as np
+
+from phase_retriever.constants import MSE_THRESHOLD
+from phase_retriever.algorithm import multi, iterations_to_threshold
+from phase_retriever.algorithm.workspace import numba
+from phase_retriever.misc.fft_backend import get_backend, fftshift
+
+def synthetic_dataset(n, n_planes=2, pixel_size=0.3, dz=20., bandwidth=None):
+    """Moduli of a vortex beam with a Gaussian envelope at n_planes equidistant planes,
+    together with the transfer function H between consecutive planes (pixel_size and
+    dz in wavelength units) and the ground truth field at the first plane."""
+    y, x = np.mgrid[-n//2:n//2, -n//2:n//2]
+    bw = bandwidth or n//8
+    bandwidth_mask = x*x+y*y < bw*bw
+    umax = .5/pixel_size
+    rho2 = (x*x+y*y)*(umax/(n//2))**2
+    gamma = np.zeros((n, n))
+    np.sqrt(1-rho2, out=gamma, where=bandwidth_mask)
+    H = fftshift(np.exp(2j*np.pi*gamma*dz)*bandwidth_mask)
+
+    sigma = n/16
+    r2 = (x*x+y*y)/(sigma*sigma)
+    U = np.sqrt(r2)*np.exp(-r2/2)*np.exp(1j*np.arctan2(y, x))
+    fft = get_backend()
+    U = fft.ifft2(fft.fft2(U)*fftshift(bandwidth_mask))  # Band limited field
+    As = [abs(U)]
+    Uz = U
+    for _ in range(n_planes-1):
+        Uz = fft.ifft2(fft.fft2(Uz)*H)
+        As.append(abs(Uz))
+    return H, As, U
+
+def _multi_reference(H, niter, phi0, *As, backend=None, workers=None):
+    """Former implementation of multi, allocating its temporaries at each iteration.
+    Kept only as the baseline of this benchmark."""
+    fft = get_backend(backend, workers)
+    ny, nx = As[0].shape
+    xk = np.zeros((ny, nx), dtype=np.complex128)
+    yk = np.zeros_like(xk)
+    g_k1 = np.zeros_like(xk)
+    g_k2 = np.zeros_like(xk)
+    hk = np.zeros_like(xk)
+    H_back = np.conj(H)**(len(As)-1)
+    mses = np.zeros(niter)
+    Ui = np.zeros(As[0].shape, dtype=np.complex128)
+    k = 1/np.sum(As[0]**2)
+    yk[:] = np.exp(1j*phi0)
+    for i in range(niter):
+        g_k2[:] = g_k1[:]
+        g_k1[:] = yk
+        hk[:] = xk
+        for Ai in As[:-1]:
+            Ui[:] = Ai*yk
+            Ui[:] = fft.ifft2(fft.fft2(Ui)*H)
+            yk[:] = Ui/(abs(Ui)+1e-16)
+        Ui[:] = As[-1]*yk
+        Ui[:] = fft.fft2(Ui)
+        Ui[:] = fft.ifft2(Ui*H_back)
+        yk[:] = Ui/(abs(Ui)+1e-16)
+        g_k1[:] = yk-g_k1
+        xk[:] = yk[:]
+        hk[:] = xk-hk
+        alpha = np.sum(np.conj(g_k1)*g_k2)/(np.sum(np.conj(g_k2)*g_k2)+1e-16)
+        alpha = min(max(0, np.real(alpha)), 1)
+        yk[:] = xk+alpha*hk
+        mses[i] = np.sum((abs(Ui)-As[0])**2)*k
+    return xk, mses
+
+def _iterations_per_second(fun, niter, repeat, *args, **kwargs):
+    fun(*args, **kwargs)    # Warm up (FFT plans, JIT compilation...)
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fun(*args, **kwargs)
+        best = min(best, time.perf_counter()-t0)
+    return niter/best
+
+def bench_multi(sizes=(256, 512, 1024), niter=20, repeat=3, backend=None, workers=None):
+    """Print the iterations per second of each kernel for every window size."""
+    kernels = [("allocating (before)", _multi_reference, {}),
+               ("workspace (after)", multi, {"eps": 0})]
+    if numba is not None:
+        kernels.append(("workspace + numba", multi, {"eps": 0, "jit": True}))
+    fft = get_backend(backend, workers)
+    print(f"FFT backend: {fft.name}, workers: {fft.workers}, {niter} iterations")
+    print(f"{'size':>6}" + "".join(f"{name:>22}" for name, _, _ in kernels))
+    for n in sizes:
+        H, As, _ = synthetic_dataset(n)
+        phi0 = np.random.rand(n, n)
+        rates = [_iterations_per_second(fun, niter, repeat, H, niter, phi0, *As,
+                                        backend=backend, workers=workers, **kwargs)
+                 for _, fun, kwargs in kernels]
+        print(f"{n:>6}" + "".join(f"{rate:>16.1f} it/s " for rate in rates))
+
+def bench_algorithms(n=256, n_planes=3, niter=300, eps=MSE_THRESHOLD, names=None, seed=0):
+    """Print the iterations and FFTs each algorithm needs to reach an MSE below eps."""
+    H, As, _ = synthetic_dataset(n, n_planes)
+    phi0 = np.random.default_rng(seed).random((n, n))
+    report = iterations_to_threshold(H, niter, phi0, *As, names=names, eps=eps)
+    print(f"{n}x{n}, {n_planes} planes, MSE threshold {eps}")
+    print(f"{'algorithm':>10}{'iterations':>12}{'FFTs':>8}{'MSE':>12}")
+    for name, r in report.items():
+        print(f"{name:>10}{str(r['iterations']):>12}{str(r['ffts']):>8}{r['mse']:>12.4g}")
+
+if __name__ == "__main__":
+    bench_multi()
+    bench_algorithms()
@@ -3,28 +3,30 @@
 import numpy as np
 import imageio
 import subprocess
-from scipy.fft import fft2, ifft2, fftshift, set_workers
+from ..misc.fft_backend import fftshift, get_backend
+from ..misc.grids import axial_frequency
 import matplotlib.pyplot as plt
 import os
 
 def propaga_video(Ux, Uy, y, x, circ, carpeta, nim=100, delta_z=40,
-        Izmax=None, lamb=520e-6, queue=None, video=False, fps=8):
+        Izmax=None, lamb=520e-6, queue=None, video=False, fps=8, workers=None):
     """Propagate the complex amplitudes a distance delta_z by takin
-    nim steps. REQUIRES ffmpeg to properly save the videos.
+    nim steps. REQUIRES ffmpeg to properly save the videos. workers: FFT
+    threads (None: all the cores).
     """
+    fft = get_backend(None, workers)
     fps = float(fps)
     zetes = np.linspace(0, delta_z, nim)*lamb
     x = fftshift(x)
     y = fftshift(y)
     circ = fftshift(circ)
-    rho2 = x*x+y*y
-    Asx = fft2(Ux)*circ
-    Asy = fft2(Uy)*circ
+    Asx = fft.fft2(Ux)*circ
+    Asy = fft.fft2(Uy)*circ
     maxIz = np.zeros(nim)
     maxIt = np.zeros(nim)
     # We assume non paraxiality, therefore we need to determine wz = kz/2pi
     over_l = 1/lamb
-    wz = np.sqrt(np.complex128(1/lamb/lamb-rho2))
+    wz = axial_frequency(x, y, lamb)
     # Writers for the videos
     if video:
         it_writer = imageio.get_writer(os.path.join(carpeta, "v_intensity.mp4"), fps=fps)
@@ -34,10 +36,9 @@ def propaga_video(Ux, Uy, y, x, circ, carpeta, nim=100, delta_z=40,
     print("Generating images...")
     for i, z in enumerate(zetes):
         H = np.exp(2j*np.pi*z*wz)
-        with set_workers(4):
-            Uzx = ifft2(H*Asx)
-            Uzy = ifft2(H*Asy)
-            Uzz = ifft2((Asx*x + Asy*y)*H/wz)
+        Uzx = fft.ifft2(H*Asx)
+        Uzy = fft.ifft2(H*Asy)
+        Uzz = fft.ifft2((Asx*x + Asy*y)*H/wz)
 
         # Irradiances and phases
         Iz = np.real(np.conj(Uzx)*Uzx)+np.real(np.conj(Uzy)*Uzy)
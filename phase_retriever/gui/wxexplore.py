@@ -1,7 +1,7 @@
 import wx
 import wx.lib.agw.floatspin
 import numpy as np
-from scipy.fft import fft2, ifft2, fftshift, ifftshift
+from ..misc.fft_backend import fft2, ifft2, fftshift, ifftshift
 
 class DataExplorer(wx.Panel):
     """Class to contain the controls for the exploration of the resulting data."""
@@ -6,7 +6,7 @@ GUI for the calculation of the phase retreival with polarimetric images.
 """
 import numpy as np
 import json
-from scipy.fft import fft2, ifft2, fftshift, ifftshift
+from .misc.fft_backend import fft2, ifft2, fftshift, ifftshift
 import tkinter as tk
 import tkinter.ttk as ttk
 from tkinter.filedialog import askdirectory, asksaveasfilename, askopenfilename
@@ -25,6 +25,9 @@ from .gui.menubar import Menubar
 from .gui.exportwindow import ExportWindow
 from .misc.focalprop import FocalPropagator
 from .misc.radial import get_function_radius
+from .misc.grids import physical_frequencies, physical_transfer_function
+from .misc.planes import plane_positions, is_uniform, step_transfer_functions
+from .misc.shared import SharedArray, Progress, CancelToken, run_shared
 
 class PhaseRetrieverGUI:
     def __init__(self, parent, bg):
@@ -69,6 +72,7 @@ class PhaseRetrieverGUI:
         self.parent.protocol("WM_DELETE_WINDOW", self.quit)
 
         self.processes = None
+        self.cancel_token = CancelToken()
         self.zetes = None
 
     def loadset(self, event=None):
@@ -278,46 +282,41 @@ class PhaseRetrieverGUI:
             self.Ay.append(np.sqrt(Iy))
             
         # Create the free space transfer function
-        y, x = np.mgrid[-self.n:self.n, -self.n:self.n]
-        self.circ = x*x+y*y < self.r**2
-        umax = .5/self.p
-        self.y = y/self.n*umax
-        self.x = x/self.n*umax
-        rho2 = self.x*self.x+self.y*self.y
-        wz = np.sqrt(np.complex128(1/self.lamb**2-rho2))  # mm^-1, spatial frequency in the z direction
-        # Check if all images are equally spaced. Work only with equally spaced images.
-        old_delta = self.zetes[1]-self.zetes[0]
-        max_i = 1000 
-        for i in range(len(self.zetes)-1):
-            new_delta = self.zetes[i+1]-self.zetes[i]
-            if new_delta != old_delta:
-                max_i = i
-                break
-        z = old_delta*self.names_dict[0]["scale"]
-
-        H = np.exp(2j*np.pi*z*wz)*self.circ
-        H[:] = fftshift(H)
+        shape = (self.n*2, self.n*2)
+        # wz: mm^-1, spatial frequency in the z direction
+        self.x, self.y, self.circ, wz = physical_frequencies(shape, self.p, self.lamb, self.r)
+        # Every plane is used, equally spaced or not (see misc.planes)
+        positions = plane_positions(self.names_dict, self.zetes)
+        def transfer(dz):
+            return physical_transfer_function(shape, self.p, self.lamb, dz, self.r)
+        if is_uniform(positions, range(len(positions))):
+            H = transfer(positions[1]-positions[0])
+        else:
+            H = step_transfer_functions(transfer, positions)
         phi_0 = np.zeros((self.n*2, self.n*2))
         self.wz = wz    # FIXME: Dirty hack
 
         # Create MSE lists to hold all values
         self.mse = [[], []]
 
-        # Spawn processess with queues
-        self.queues = [mp.Queue(), mp.Queue()]
+        # Spawn processess, publishing their progress in shared memory
+        self.progress = [Progress(niter), Progress(niter)]
+        self.cancel_token = CancelToken()
         p1, c1 = mp.Pipe()
         p2, c2 = mp.Pipe()
-        self.reals = [mp.Array("d", range(0, int((self.n*2)**2))),
-                mp.Array("d", range(0, int((self.n*2)**2)))]
-        self.imags = [mp.Array("d", range(0, int((self.n*2)**2))),
-                mp.Array("d", range(0, int((self.n*2)**2)))]
+        # Inputs and results shared with the processes without copies, see misc.shared
+        self.fields = [SharedArray(shape, np.complex128), SharedArray(shape, np.complex128)]
+        H = SharedArray.copy_of(H)
+        phi_0 = SharedArray.copy_of(phi_0)
         self.processes = \
-                [mp.Process(target=multi, args=(H, niter, phi_0, *(self.Ax[:max_i])), 
-                    kwargs={"queue":self.queues[0], "real":self.reals[0], 
-                        "imag":self.imags[0]}),
-                 mp.Process(target=multi, args=(H, niter, phi_0, *(self.Ay[:max_i])), 
-                    kwargs={"queue":self.queues[1], "real":self.reals[1],
-                        "imag":self.imags[1]})]
+                [mp.Process(target=run_shared, args=(multi, (H, niter, phi_0,
+                    *[SharedArray.copy_of(A) for A in self.Ax]),
+                    {"queue":self.progress[0], "out":self.fields[0],
+                     "stopping":{"cancel":self.cancel_token}})),
+                 mp.Process(target=run_shared, args=(multi, (H, niter, phi_0,
+                    *[SharedArray.copy_of(A) for A in self.Ay]),
+                    {"queue":self.progress[1], "out":self.fields[1],
+                     "stopping":{"cancel":self.cancel_token}}))]
         # Start each process
         for process in self.processes:
             process.start()
@@ -330,16 +329,11 @@ class PhaseRetrieverGUI:
         if self.running:
             alive = False
             for i, process in enumerate(self.processes):
-                #FIXME: això pot no acabar mai...
-                full = True
-                while full:
-                    try:
-                        data = self.queues[i].get_nowait()
-                        self.mse[i].append(data)
-                    except:
-                        full = False
+                # Status before the values, not to miss the last ones
+                finished = self.progress[i].finished
+                self.mse[i].extend(self.progress[i].read()[:, 0].tolist())
                 # Check if alive
-                alive = alive or process.is_alive()
+                alive = alive or (not finished and process.is_alive())
 
             # Update XY mse plot
             self.subplot_notebook.plots["MSE"].plot(0, self.mse[0])
@@ -355,10 +349,8 @@ class PhaseRetrieverGUI:
             self.recovered_phases = True
             self.beam_notebook.set_state("explorer", "enable")
             # Retrieve the phases
-            self.exphi_x = (np.asarray(self.reals[0])+1j*np.asarray(self.imags[0]))
-            self.exphi_x = self.exphi_x.reshape((2*self.n, 2*self.n))
-            self.exphi_y = np.asarray(self.reals[1])+1j*np.asarray(self.imags[1])
-            self.exphi_y = self.exphi_y.reshape((2*self.n, 2*self.n))
+            self.exphi_x = np.array(self.fields[0])
+            self.exphi_y = np.array(self.fields[1])
 
             ny, nx = self.Ax[0].shape
             n = min(ny, nx)
@@ -445,6 +437,8 @@ class PhaseRetrieverGUI:
     def quit(self, event=None):
         self.parent.quit()
         self.parent.destroy()
+        # Running retrievals stop within a few iterations
+        self.cancel_token.set()
         if self.processes:
             for process in self.processes:
                 process.join()
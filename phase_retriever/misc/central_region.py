@@ -1,5 +1,5 @@
 import numpy as np
-from scipy.fft import fft2, ifft2, fftshift, ifftshift
+from .fft_backend import fft2, ifft2, fftshift, ifftshift
 
 def find_rect_region(array: np.ndarray , dim: int):
     """Find the place where a rectangle of size dim X dim best encapsulates the
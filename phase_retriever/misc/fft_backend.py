@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FFT BACKEND
+    Single entry point for every FFT computed by the package. Three backends
+are available:
+
+        - "numpy": numpy.fft, single threaded.
+        - "scipy": scipy.fft, with a configurable number of workers (default).
+        - "pyfftw": pyFFTW builders, only if pyfftw is installed. Plans are cached
+        per (shape, dtype, axes, threads) and the FFTW wisdom is persisted to
+        disk, so that later runs (and worker processes) skip the planning.
+
+    All transforms act on the last two axes by default, so that batches of 2D
+fields are transformed at once. Besides, plan_inplace returns a callable that
+transforms a given (preallocated) array in place, which lets the iterative
+kernels run without allocating a new array at every FFT.
+"""
+import os
+import pickle
+import warnings
+import numpy as np
+import scipy.fft
+
+_defaults = {"backend": "scipy",
+             "workers": os.cpu_count() or 1,
+             "wisdom_path": os.path.join(os.path.expanduser("~"), ".phase_retriever",
+                                         "fftw_wisdom.pkl")}
+_backends = {}
+
+fftshift = np.fft.fftshift
+ifftshift = np.fft.ifftshift
+
+class NumpyBackend():
+    name = "numpy"
+
+    def __init__(self, workers=1):
+        self.workers = 1
+
+    # Older numpy versions always compute in double precision, so we keep the input one
+    def fft2(self, a, axes=(-2, -1), overwrite_x=False):
+        return np.fft.fft2(a, axes=axes).astype(complex_dtype(a), copy=False)
+
+    def ifft2(self, a, axes=(-2, -1), overwrite_x=False):
+        return np.fft.ifft2(a, axes=axes).astype(complex_dtype(a), copy=False)
+
+    def plan_inplace(self, a, inverse=False, axes=(-2, -1)):
+        transform = self.ifft2 if inverse else self.fft2
+        return lambda: np.copyto(a, transform(a, axes=axes))
+
+class ScipyBackend():
+    name = "scipy"
+
+    def __init__(self, workers=1):
+        self.workers = workers
+
+    def fft2(self, a, axes=(-2, -1), overwrite_x=False):
+        return scipy.fft.fft2(a, axes=axes, workers=self.workers, overwrite_x=overwrite_x)
+
+    def ifft2(self, a, axes=(-2, -1), overwrite_x=False):
+        return scipy.fft.ifft2(a, axes=axes, workers=self.workers, overwrite_x=overwrite_x)
+
+    def plan_inplace(self, a, inverse=False, axes=(-2, -1)):
+        transform = self.ifft2 if inverse else self.fft2
+
+        def execute():
+            # pocketfft works in place on contiguous complex input when allowed to
+            out = transform(a, axes=axes, overwrite_x=True)
+            if not np.may_share_memory(out, a):
+                np.copyto(a, out)
+        return execute
+
+class PyFFTWBackend():
+    name = "pyfftw"
+
+    def __init__(self, workers=1, wisdom_path=None):
+        import pyfftw
+        self.pyfftw = pyfftw
+        self.workers = workers
+        self.wisdom_path = wisdom_path
+        self.plans = {}
+        self.load_wisdom()
+
+    def _plan(self, builder, a, axes):
+        a = np.asarray(a)
+        a = a.astype(complex_dtype(a), copy=False)
+        key = (builder, a.shape, a.dtype, axes)
+        plan = self.plans.get(key)
+        if plan is None:
+            build = getattr(self.pyfftw.builders, builder)
+            plan = build(a, axes=axes, threads=self.workers, planner_effort="FFTW_MEASURE")
+            self.plans[key] = plan
+            # New plans may have produced new wisdom, keep it for the next runs
+            self.save_wisdom()
+        return plan, a
+
+    def fft2(self, a, axes=(-2, -1), overwrite_x=False):
+        plan, a = self._plan("fft2", a, axes)
+        # The output array belongs to the plan, so it must be copied
+        return plan(a).copy()
+
+    def ifft2(self, a, axes=(-2, -1), overwrite_x=False):
+        plan, a = self._plan("ifft2", a, axes)
+        return plan(a).copy()
+
+    def plan_inplace(self, a, inverse=False, axes=(-2, -1)):
+        # Planning with FFTW_MEASURE destroys the contents of a, so plan before filling it
+        plan = self.pyfftw.FFTW(a, a, axes=axes, threads=self.workers,
+                                direction="FFTW_BACKWARD" if inverse else "FFTW_FORWARD",
+                                flags=("FFTW_MEASURE", ))
+        self.save_wisdom()
+        return plan     # Calling it executes the transform (normalised if inverse)
+
+    def load_wisdom(self):
+        if not self.wisdom_path or not os.path.isfile(self.wisdom_path):
+            return
+        try:
+            with open(self.wisdom_path, "rb") as f:
+                self.pyfftw.import_wisdom(pickle.load(f))
+        except Exception:
+            warnings.warn(f"Could not load the FFTW wisdom from {self.wisdom_path}", RuntimeWarning)
+
+    def save_wisdom(self):
+        if not self.wisdom_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.wisdom_path), exist_ok=True)
+            # Write and rename, so that concurrent processes never read half a file
+            tmp_path = f"{self.wisdom_path}.{os.getpid()}"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(self.pyfftw.export_wisdom(), f)
+            os.replace(tmp_path, self.wisdom_path)
+        except OSError:
+            warnings.warn(f"Could not save the FFTW wisdom to {self.wisdom_path}", RuntimeWarning)
+
+def complex_dtype(a):
+    """Complex dtype matching the precision of a (complex64 for single precision input)."""
+    return np.complex64 if np.asarray(a).dtype in (np.float32, np.complex64) else np.complex128
+
+BACKENDS = {"numpy": NumpyBackend, "scipy": ScipyBackend, "pyfftw": PyFFTWBackend}
+
+def configure(backend=None, workers=None, wisdom_path=None):
+    """Set the default backend and number of workers used by the package."""
+    if backend is not None:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown FFT backend {backend}. Options: {list(BACKENDS)}")
+        _defaults["backend"] = backend
+    if workers is not None:
+        _defaults["workers"] = max(1, int(workers))
+    if wisdom_path is not None:
+        _defaults["wisdom_path"] = wisdom_path
+
+def get_backend(backend=None, workers=None):
+    """Return a (cached) backend instance. None selects the configured defaults. If
+    pyfftw is requested but not installed, scipy.fft is used instead, with a
+    RuntimeWarning (as are the failures to load or save the FFTW wisdom)."""
+    backend = backend or _defaults["backend"]
+    workers = max(1, int(workers or _defaults["workers"]))
+    key = (backend, workers)
+    if key not in _backends:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown FFT backend {backend}. Options: {list(BACKENDS)}")
+        if backend == "pyfftw":
+            try:
+                _backends[key] = PyFFTWBackend(workers, _defaults["wisdom_path"])
+            except ImportError:
+                warnings.warn("pyfftw is not installed, falling back to scipy.fft", RuntimeWarning,
+                              stacklevel=2)
+                _backends[key] = ScipyBackend(workers)
+        else:
+            _backends[key] = BACKENDS[backend](workers)
+    return _backends[key]
+
+def fft2(a, axes=(-2, -1), overwrite_x=False):
+    return get_backend().fft2(a, axes=axes, overwrite_x=overwrite_x)
+
+def ifft2(a, axes=(-2, -1), overwrite_x=False):
+    return get_backend().ifft2(a, axes=axes, overwrite_x=overwrite_x)
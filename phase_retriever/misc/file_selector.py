@@ -12,8 +12,9 @@ import regex as re
 
 WAVELENGTH_um = 0.514  # FIXME: wavelength in microns is hardcoded !!!!
 
-def get_polarimetric_names(folder, pol_keys={0:"a0", 1:"a45", 2:"a90",
-    3:"a135", 4:"aLev", 5:"aDex", 6:"aIrr"}, ftype="png"):
+POL_KEYS = {0:"a0", 1:"a45", 2:"a90", 3:"a135", 4:"aLev", 5:"aDex", 6:"aIrr"}
+
+def get_polarimetric_names(folder, pol_keys=POL_KEYS, ftype="png"):
     """Return a set of dictionaries containing the set of polarimetric images
     for each family of measurements. Assumes a filename of the form
 
@@ -30,78 +31,63 @@ def get_polarimetric_names(folder, pol_keys={0:"a0", 1:"a45", 2:"a90",
     filenames = os.listdir(folder)
     filenames.sort()
     polarimetric_sets = {}
-    pol_idx = None  # just an initialization
-    z_idx = None  # just an initialization
     beam_name = ''
     for fname in filenames:
-        # Try to get the fname and ftype. If not divisible, get out
-        try:
-            image_name, f_type = fname.split(".")
-        except:
-            continue
-        # Recognize the filetype and bail out if not the correct one
-        if f_type != ftype:
+        parsed = parse_polarimetric_name(fname, pol_keys, ftype)
+        if parsed is None:
             continue
-        # Retrieve the necessary information. If not possible, bail out
-        try:
-            fields = image_name.split("_")
-        except:
-            continue
-
-        if fields[-1] == "retrieved":
-            continue  # It probably will be an already retrieved file
-
-        if len(fields) < 3:
-            continue  # Not a valid filename!
-
-        beam_name = fields[0]
-
-        # Get the index for the analyzer field
-        if pol_idx is None:  # just the first time
-            for idx, field in enumerate(fields):
-                if field in pol_keys.values():
-                    pol_idx = idx
-                    break
-
-        # Get the index for the z field
-        if z_idx is None:  # just the first time
-            for idx, field in enumerate(fields):
-                if field.startswith("z"):
-                    z_idx = idx
-                    break
-        complete_fname = f"{folder}/{fname}"
-
-        # Check if the dict for the distance already exists
-        z, z_units = get_z_suffix(fields[z_idx])
-        z_int = int(z)  # TODO: consider to replace int with str
-        if z_int not in polarimetric_sets:  # if not, create it
-            polarimetric_sets[z_int] = {}
-
-        # let's fill the dictionary
-        if fields[pol_idx] == pol_keys[0]:
-            polarimetric_sets[z_int][0] = complete_fname
-            polarimetric_sets[z_int]["f"] = z
-
-        elif fields[pol_idx] == pol_keys[1]:
-            polarimetric_sets[z_int][1] = complete_fname
-            
-        elif fields[pol_idx] == pol_keys[2]:
-            polarimetric_sets[z_int][2] = complete_fname
-
-        elif fields[pol_idx] == pol_keys[3]:
-            polarimetric_sets[z_int][3] = complete_fname
-
-        elif fields[pol_idx] == pol_keys[4]:
-            polarimetric_sets[z_int][4] = complete_fname
-            
-        elif fields[pol_idx] == pol_keys[5]:
-            polarimetric_sets[z_int][5] = complete_fname
+        beam_name, _, z, scale, polarization = parsed
+        add_polarimetric_image(polarimetric_sets, f"{folder}/{fname}", z, scale, polarization)
+    return polarimetric_sets, beam_name
 
-        elif fields[pol_idx] == pol_keys[6]:
-            polarimetric_sets[z_int]["Irr"] = complete_fname
+def parse_polarimetric_name(fname, pol_keys=POL_KEYS, ftype="png"):
+    """Fields of the filename of a polarimetric image (see get_polarimetric_names), None if
+    it is not one.
 
-        polarimetric_sets[z_int]["scale"] = z_units
-    return polarimetric_sets, beam_name
+    Output:
+        - beam_name: First field of the name.
+        - set_name: Name without the z and polarimetric fields, shared by all the images
+        of a measurement.
+        - z, scale: z value and its scale to microns.
+        - polarization: Index of the analyzer (0 to 5), or "Irr" for the irradiance.
+    """
+    # Try to get the fname and ftype. If not divisible, get out
+    try:
+        image_name, f_type = fname.split(".")
+    except ValueError:
+        return None
+    # Recognize the filetype and bail out if not the correct one
+    if f_type != ftype:
+        return None
+    fields = image_name.split("_")
+    if fields[-1] == "retrieved":
+        return None  # It probably will be an already retrieved file
+    if len(fields) < 3:
+        return None  # Not a valid filename!
+
+    pol_idx = next((idx for idx, field in enumerate(fields) if field in pol_keys.values()), None)
+    z_idx = next((idx for idx, field in enumerate(fields) if field.startswith("z")), None)
+    if pol_idx is None or z_idx is None:
+        return None
+    try:
+        z, scale = get_z_suffix(fields[z_idx])
+    except ValueError:
+        return None
+    polarization = next(key for key, value in pol_keys.items() if value == fields[pol_idx])
+    if polarization == 6:
+        polarization = "Irr"
+    set_name = "_".join(field for idx, field in enumerate(fields) if idx not in (pol_idx, z_idx))
+    return fields[0], set_name, z, scale, polarization
+
+def add_polarimetric_image(polarimetric_sets, path, z, scale, polarization):
+    """Add the image at path to the dictionary of polarimetric sets, keyed by the integer
+    z value and then by polarization."""
+    z_int = int(z)  # TODO: consider to replace int with str
+    plane = polarimetric_sets.setdefault(z_int, {})
+    plane[polarization] = path
+    if polarization == 0:
+        plane["f"] = z
+    plane["scale"] = scale
 
 def get_polarimetric_npz(folder, pol_keys={0:"a0", 1:"a45", 2:"a90",
     3:"a135", 4:"aLev", 5:"aDex"}):
@@ -1,11 +1,10 @@
 import numpy as np
-from scipy.fft import fftshift, ifftshift, fft2, ifft2, set_workers
-import multiprocessing as mp
+from .fft_backend import fftshift, ifftshift, get_backend
+from .grids import focal_directions
 
-sfft2 = lambda field: fftshift(fft2(ifftshift(field)))
-sifft2 = lambda spectr: ifftshift(ifft2(fftshift(spectr)))
-
-workers = mp.cpu_count()
+# Centered transforms. fft: FFT backend to use (default: the package one)
+sfft2 = lambda field, fft=None: fftshift((fft or get_backend()).fft2(ifftshift(field)))
+sifft2 = lambda spectr, fft=None: ifftshift((fft or get_backend()).ifft2(fftshift(spectr)))
 
 class FocalPropagator():
     properties = {
@@ -15,7 +14,9 @@ class FocalPropagator():
             "pixel_size"    : None,
             }
 
-    def __init__(self, Ex=None, Ey=None, wz=None):
+    def __init__(self, Ex=None, Ey=None, wz=None, workers=None):
+        # FFT threads, e.g. the share of the cores given by a Scheduler (None: all of them)
+        self.fft = get_backend(None, workers)
 
         if (isinstance(Ex, np.ndarray) and isinstance(Ey, np.ndarray)):
             self.set_fields(Ex, Ey, wz)
@@ -40,10 +41,9 @@ class FocalPropagator():
                 mask = np.real(phase) < 0
                 phase[mask] = -phase[mask]
             H = np.exp(phase)
-            with set_workers(6):
-                Ex = sifft2(H*self.Ax)
-                Ey = sifft2(H*self.Ay)
-                Ez = sifft2(H*self.Az)
+            Ex = sifft2(H*self.Ax, self.fft)
+            Ey = sifft2(H*self.Ay, self.fft)
+            Ez = sifft2(H*self.Az, self.fft)
             I = np.real(np.conj(Ex)*Ex)+\
                 np.real(np.conj(Ey)*Ey)
             I[:] /= self.Imax
@@ -58,19 +58,17 @@ class FocalPropagator():
                 phase[mask] = -phase[mask]
             H = np.exp(phase)
 
-            with set_workers(6):
-                Ex = sifft2(H*self.Ax)
-                Ey = sifft2(H*self.Ay)
-                Ez = sifft2(H*self.Az)
+            Ex = sifft2(H*self.Ax, self.fft)
+            Ey = sifft2(H*self.Ay, self.fft)
+            Ez = sifft2(H*self.Az, self.fft)
             return Ex, Ey, Ez
         else:
             raise Exception("Field not ready to be propagated")
 
     def set_fields(self, Ex, Ey, wz=None):
         self.Ex, self.Ey = Ex, Ey
-        with set_workers(4):
-            self.Ax = sfft2(Ex)
-            self.Ay = sfft2(Ey)
+        self.Ax = sfft2(Ex, self.fft)
+        self.Ay = sfft2(Ey, self.fft)
 
         self.wz = np.copy(wz) if wz else self.wz
         self.wz[:] = fftshift(wz)
@@ -88,19 +86,14 @@ class FocalPropagator():
             raise ValueError("p_size must be specified")
         if not isinstance(Ex, np.ndarray) and not isinstance(Ey, np.ndarray):
             raise ValueError("Ex, Ey must be specified")
-        ny, nx = Ex.shape
-        y, x = np.mgrid[-ny//2:ny//2, -nx//2:nx//2]
-        umax = .5 / p_size
-        alpha = x/x.max()*umax
-        beta = -y/y.max()*umax
-        
-        theta2 = alpha*alpha + beta*beta
-        self.wz = np.zeros((ny, nx), dtype=np.float64)
-        np.sqrt(1-theta2, where=theta2 < 1, out=self.wz)
+        # Keep the precision of the fields (single precision fields stay complex64)
+        real_t = np.real(Ex).dtype
+        alpha, beta, wz = focal_directions(Ex.shape, p_size, real_t)
+        self.wz = wz.copy()     # set_fields writes into it
 
         self.Az = (alpha * self.Ax + beta * self.Ay)
         self.Az[self.wz > 0] /= (self.wz[self.wz > 0] + 1e-16)
-        self['Ez'] = sifft2(self.Az)
+        self['Ez'] = sifft2(self.Az, self.fft)
 
     def create_spectra(self):
         Ex, Ey = self["Ex"], self["Ey"]
@@ -113,7 +106,6 @@ class FocalPropagator():
         self.Imax = I.max()
 
         # Compute the spectra
-        with set_workers(4):
-            self.Ax = sfft2(Ex)
-            self.Ay = sfft2(Ey)
+        self.Ax = sfft2(Ex, self.fft)
+        self.Ay = sfft2(Ey, self.fft)
 
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GRIDS
+    Module level LRU cache of the precomputed arrays of the package: coordinate
+grids, bandwidth masks, longitudinal frequencies (gamma, wz) and free space
+transfer functions. Each array is keyed by what determines its content,
+
+    (kind, shape, pixel_size, lamb, dz, bandwidth, dtype),
+
+so that parameter sweeps and GUI interaction stop rebuilding the same grids.
+Returned arrays are read-only, as they are shared by every caller: copy them
+before modifying them in place. The total size of the cache is capped, the least
+recently used entries being dropped first (see set_cache_limit).
+"""
+from collections import OrderedDict
+import numpy as np
+
+from .fft_backend import fftshift
+
+_cache = OrderedDict()
+_state = {"limit": 256*2**20, "bytes": 0, "hits": 0, "misses": 0}
+
+def _arrays(value):
+    return value if isinstance(value, tuple) else (value, )
+
+def cached(kind, build, shape, pixel_size=None, lamb=None, dz=None, bandwidth=None, dtype=None):
+    """Return build() for the given key, computing it only if it is not cached. build
+    returns an array or a tuple of arrays, which are made read-only."""
+    key = (kind, tuple(shape), pixel_size, lamb, dz, bandwidth,
+           np.dtype(dtype).str if dtype is not None else None)
+    if key in _cache:
+        _state["hits"] += 1
+        _cache.move_to_end(key)
+        return _cache[key]
+    _state["misses"] += 1
+    value = build()
+    for array in _arrays(value):
+        array.flags.writeable = False
+    size = sum(array.nbytes for array in _arrays(value))
+    if size <= _state["limit"]:
+        _cache[key] = value
+        _state["bytes"] += size
+        _evict()
+    return value
+
+def _evict():
+    while _state["bytes"] > _state["limit"] and _cache:
+        _, value = _cache.popitem(last=False)
+        _state["bytes"] -= sum(array.nbytes for array in _arrays(value))
+
+def set_cache_limit(max_bytes):
+    """Cap the memory used by the cached arrays."""
+    _state["limit"] = int(max_bytes)
+    _evict()
+
+def clear_cache():
+    _cache.clear()
+    _state["bytes"] = 0
+
+def cache_info():
+    """Entries, bytes, limit, hits and misses of the cache."""
+    return {"entries": len(_cache), **_state}
+
+def centered_grid(shape):
+    """Integer coordinates (y, x) with the origin at the center of the window."""
+    ny, nx = shape
+    return cached("centered_grid", lambda: tuple(np.mgrid[-ny//2:ny//2, -nx//2:nx//2]), shape)
+
+def bandwidth_mask(shape, bandwidth):
+    """Centered disc of radius bandwidth (in frequency pixels)."""
+    def build():
+        y, x = centered_grid(shape)
+        return x*x+y*y < bandwidth*bandwidth
+    return cached("bandwidth_mask", build, shape, bandwidth=bandwidth)
+
+def propagation_gamma(shape, pixel_size, bandwidth, dtype=np.float64):
+    """Normalized longitudinal frequency, sqrt(1-rho^2), inside the bandwidth (zero out of
+    it), of a window of the given pixel size in wavelength units."""
+    def build():
+        ny, nx = centered_grid(shape)
+        umax = .5/pixel_size
+        x = nx/nx.max()*umax
+        y = ny/ny.max()*umax
+        rho2 = x*x+y*y
+        gamma = np.zeros(shape, dtype=dtype)
+        np.sqrt(1-rho2, out=gamma, where=bandwidth_mask(shape, bandwidth))
+        return gamma
+    return cached("propagation_gamma", build, shape, pixel_size, bandwidth=bandwidth, dtype=dtype)
+
+def transfer_function(shape, pixel_size, dz, bandwidth, dtype=np.complex128):
+    """Free space transfer function exp(2j*pi*gamma*dz), band limited and fftshifted, with
+    pixel_size and dz in wavelength units."""
+    def build():
+        gamma = propagation_gamma(shape, pixel_size, bandwidth)
+        H = fftshift(np.exp(2j*np.pi*gamma*dz)*bandwidth_mask(shape, bandwidth))
+        return H.astype(dtype, copy=False)
+    return cached("transfer_function", build, shape, pixel_size, dz=dz, bandwidth=bandwidth,
+                  dtype=dtype)
+
+def focal_directions(shape, pixel_size, dtype=np.float64):
+    """Direction cosines (alpha, beta, wz) of the plane waves of a window of the given pixel
+    size in wavelength units, wz being zero for evanescent waves."""
+    def build():
+        y, x = centered_grid(shape)
+        umax = .5/pixel_size
+        alpha = (x/x.max()*umax).astype(dtype)
+        beta = (-y/y.max()*umax).astype(dtype)
+        theta2 = alpha*alpha+beta*beta
+        wz = np.zeros(shape, dtype=dtype)
+        np.sqrt(1-theta2, where=theta2 < 1, out=wz)
+        return alpha, beta, wz
+    return cached("focal_directions", build, shape, pixel_size, dtype=dtype)
+
+def physical_frequencies(shape, pixel_size, lamb, bandwidth):
+    """Spatial frequencies (x, y), bandwidth disc and longitudinal frequency wz, complex
+    for evanescent waves, with pixel_size and lamb in physical units."""
+    def build():
+        ny, nx = shape
+        y, x = centered_grid(shape)
+        circ = x*x+y*y < bandwidth**2
+        umax = .5/pixel_size
+        y = y/(ny//2)*umax
+        x = x/(nx//2)*umax
+        wz = np.sqrt(np.complex128(1/lamb**2-(x*x+y*y)))
+        return x, y, circ, wz
+    return cached("physical_frequencies", build, shape, pixel_size, lamb, bandwidth=bandwidth)
+
+def physical_transfer_function(shape, pixel_size, lamb, dz, bandwidth):
+    """Free space transfer function exp(2j*pi*dz*wz) in the bandwidth disc, fftshifted,
+    with every length in physical units."""
+    def build():
+        _, _, circ, wz = physical_frequencies(shape, pixel_size, lamb, bandwidth)
+        return fftshift(np.exp(2j*np.pi*dz*wz)*circ)
+    return cached("physical_transfer_function", build, shape, pixel_size, lamb, dz, bandwidth)
+
+def axial_frequency(x, y, lamb):
+    """Longitudinal frequency wz = sqrt(1/lamb^2-x^2-y^2), complex for evanescent waves, of
+    the regular frequency grids x and y (e.g. those of physical_frequencies, shifted or
+    not), which are fully determined by their first value and step along each axis."""
+    sampling = (float(x[0, 0]), float(x[0, 1]-x[0, 0]), float(y[0, 0]), float(y[1, 0]-y[0, 0]))
+    return cached("axial_frequency", lambda: np.sqrt(np.complex128(1/lamb**2-(x*x+y*y))),
+                  x.shape, pixel_size=sampling, lamb=lamb)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PLANES
+    Geometry of the multiplane acquisitions: axial position of each plane, order in
+which the retrieval visits them and free space transfer functions of the steps
+between consecutive visited planes. The planes need not be equidistant:
+
+    positions = plane_positions(polarimetric_sets)     # Physical units (um)
+    order = visiting_order("alternate", len(positions))
+    H = step_transfer_functions(lambda dz: transfer_function(shape, p, dz/lamb, bw),
+                                positions, order)
+
+H is then the (len(order)-1, n, n) stack taken by the multiplane algorithms, with
+the amplitudes given in the same order. Equidistant planes visited sequentially
+can still use a single (n, n) transfer function, shared by every step.
+"""
+import numpy as np
+
+ORDERS = ("sequential", "alternate")
+
+def plane_positions(polarimetric_sets, keys=None):
+    """Axial position of each plane, its key (as returned by get_polarimetric_names)
+    times its scale, i.e. in micrometers. keys: Planes to consider (default: all)."""
+    keys = list(polarimetric_sets) if keys is None else keys
+    return [z*polarimetric_sets[z].get("scale", 1) for z in keys]
+
+def visiting_order(order, n_planes):
+    """Indices of the planes in the order they are visited, starting with the first one
+    (where the phase is retrieved).
+
+    Parameters:
+        - order: "sequential" (0, 1, ..., N-1), "alternate" (0, N-1, 1, N-2, ...) or an
+        explicit sequence of plane indices starting with 0. Planes may be visited more
+        than once.
+        - n_planes: Number of planes, N.
+    Output:
+        - order: List of plane indices.
+    """
+    if isinstance(order, str):
+        if order == "sequential":
+            return list(range(n_planes))
+        if order == "alternate":
+            low, high = list(range(n_planes//2)), list(range(n_planes-1, n_planes//2-1, -1))
+            return [i for pair in zip(low+[None], high) for i in pair if i is not None]
+        raise ValueError(f"Unknown plane order {order}. Options: {', '.join(ORDERS)} or a list")
+    order = [int(i) for i in order]
+    if len(order) < 2 or order[0] != 0:
+        raise ValueError("The plane order must visit at least two planes, starting with 0")
+    if min(order) < 0 or max(order) >= n_planes:
+        raise ValueError(f"Plane indices must lie between 0 and {n_planes-1}")
+    return order
+
+def is_uniform(positions, order, rtol=1e-9):
+    """Whether the planes are visited sequentially and equidistant, so that a single
+    transfer function serves every step."""
+    steps = np.diff(np.asarray(positions, dtype=np.float64)[order])
+    return list(order) == list(range(len(positions))) and np.allclose(steps, steps[0], rtol=rtol, atol=0)
+
+def step_transfer_functions(transfer, positions, order=None):
+    """Stack of the transfer functions of the steps between the planes at positions,
+    visited in order (default: sequentially). transfer(dz) gives the transfer function
+    of a step of dz (its grids cache makes repeated steps free)."""
+    order = list(range(len(positions))) if order is None else order
+    return np.stack([transfer(positions[b]-positions[a]) for a, b in zip(order[:-1], order[1:])])
+
+def plane_steps(H, n_planes, ndim=2):
+    """Transfer functions of the n_planes-1 steps of a multiplane pass and that of the
+    back propagation from the last plane to the first one.
+
+    Parameters:
+        - H: Transfer function of every step (ndim dimensional), or stack of those of
+        each step along a leading axis (ndim+1 dimensional).
+        - n_planes: Number of visited planes.
+        - ndim: Dimensions of a single transfer function.
+    Output:
+        - steps: Sequence of the n_planes-1 transfer functions.
+        - H_back: Back propagation transfer function.
+    """
+    if np.ndim(H) <= ndim:
+        return [H]*(n_planes-1), np.conj(H)**(n_planes-1)
+    if len(H) != n_planes-1:
+        raise ValueError(f"{len(H)} transfer functions given for {n_planes} planes")
+    return H, np.conj(np.prod(H, axis=0))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WORKER POOL
+    Module level pool of long-lived retrieval processes, built on a
+concurrent.futures.ProcessPoolExecutor. Its workers are started once, and their
+initializer builds the FFT backend (loading the FFTW wisdom and the scipy FFT
+state), so that back to back retrievals (sweeps, batch runs) skip the start up of
+a new process per component and keep their FFT plans warm. Inputs and results
+still travel through shared memory (see misc.shared).
+
+    pool = get_pool(2, backend="pyfftw", workers=4)
+    task = PoolTask(pool, run_shared, (multi, args, kwargs))
+    task.start()
+
+The pool is recreated whenever it is requested with another configuration, and it
+is shut down at exit, or explicitly through shutdown_pool.
+
+    Retrievals can also run within the calling process, in a thread (ThreadTask) or
+right away (InlineTask), sharing their arrays with no copy at all. As scipy.fft
+and most numpy loops release the GIL, the threads of both components overlap
+their FFTs. auto_executor chooses among processes, threads and inline runs.
+"""
+import os
+import atexit
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+import numpy as np
+
+from .fft_backend import get_backend
+
+_state = {"executor": None, "key": None}
+
+def _initializer(backend, workers):
+    """Runs once in each worker process: builds the FFT backend and warms it up."""
+    fft = get_backend(backend, workers)
+    fft.ifft2(fft.fft2(np.zeros((64, 64), dtype=np.complex128)))
+
+def get_pool(max_workers=2, backend=None, workers=None):
+    """Persistent pool of max_workers processes, whose FFTs use the given backend and
+    number of threads (see misc.fft_backend). Created on the first call, and reused
+    while the configuration does not change."""
+    key = (max_workers, backend, workers)
+    if _state["executor"] is None or _state["key"] != key:
+        shutdown_pool()
+        _state["executor"] = ProcessPoolExecutor(max_workers=max_workers, initializer=_initializer,
+                                                 initargs=(backend, workers))
+        _state["key"] = key
+    return _state["executor"]
+
+def shutdown_pool(wait=True, cancel_futures=False):
+    """Stop the worker processes of the pool, if any."""
+    executor = _state["executor"]
+    _state["executor"] = _state["key"] = None
+    if executor is not None:
+        executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+atexit.register(shutdown_pool)
+
+class PoolTask():
+    def __init__(self, pool, target, args=(), kwargs=None):
+        """Call of target(*args, **kwargs) in pool, with the interface of the
+        multiprocessing.Process objects the retrievers keep track of (start, is_alive
+        and join)."""
+        self.pool = pool
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.future = None
+
+    def start(self):
+        self.future = self.pool.submit(self.target, *self.args, **self.kwargs)
+
+    def is_alive(self):
+        return self.future is not None and not self.future.done()
+
+    def join(self, timeout=None):
+        """Wait for the task, raising the exception it may have ended with."""
+        if self.future is None:
+            return
+        done, _ = wait([self.future], timeout=timeout)
+        if done:
+            self.future.result()
+
+class ThreadTask(threading.Thread):
+    def __init__(self, target, args=(), kwargs=None):
+        """Call of target(*args, **kwargs) in a daemon thread. join raises the exception
+        it may have ended with."""
+        super().__init__(daemon=True)
+        self.call = target, args, kwargs or {}
+        self.error = None
+
+    def run(self):
+        target, args, kwargs = self.call
+        try:
+            target(*args, **kwargs)
+        except BaseException as error:
+            self.error = error
+
+    def join(self, timeout=None):
+        super().join(timeout)
+        if self.error is not None and not self.is_alive():
+            error, self.error = self.error, None
+            raise error
+
+class InlineTask(ThreadTask):
+    """Call of target(*args, **kwargs) within the calling thread, as soon as it is
+    started."""
+    def start(self):
+        self.run()
+
+    def is_alive(self):
+        return False
+
+    def join(self, timeout=None):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+# Grid size (pixels x planes) below which the start up of a process costs more than
+# the GIL contention between the threads
+THREAD_MAX_SIZE = 512*512*4
+
+def auto_executor(dim, n_planes, n_workers, cores=None):
+    """Execution mode ("process", "thread" or "inline") of n_workers retrievals of
+    n_planes planes of dim x dim pixels, given the available cores."""
+    cores = cores or os.cpu_count() or 1
+    if n_workers == 1 or cores == 1:
+        # Nothing to overlap, a thread still keeps the caller responsive
+        return "thread" if cores > 1 else "inline"
+    return "thread" if dim*dim*n_planes <= THREAD_MAX_SIZE else "process"
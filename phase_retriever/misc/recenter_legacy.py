@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 import numpy as np
 import imageio
-from scipy.fft import fft2, ifft2, fftshift
+from fft_backend import fft2, ifft2, fftshift
 from file_selector import get_polarimetric_names
 
 class Recenterer:
@@ -0,0 +1,52 @@
+import numpy as np
+from scipy.fft import next_fast_len
+
+from .fft_backend import fft2, ifft2, fftshift, ifftshift
+
+def reduced_size(bandwidth, n, oversampling=2):
+    """Smallest even, FFT friendly grid size holding the spectral support of the
+    irradiances of a field of the given bandwidth (radius in frequency pixels of an
+    n x n window), i.e. a disc of diameter 4*bandwidth, times oversampling. Some
+    oversampling is needed, as the modulus projections of the phase retrieval are
+    not band limited. Never larger than n."""
+    m = next_fast_len(int(np.ceil(4*bandwidth*oversampling))+2)
+    while m % 2:
+        m = next_fast_len(m+1)
+    return min(m, n)
+
+def resize_spectrum(spectrum, m):
+    """Crop or zero pad a centered spectrum (last two axes) to m x m."""
+    n = spectrum.shape[-1]
+    resized = np.zeros(spectrum.shape[:-2]+(m, m), dtype=spectrum.dtype)
+    c = min(m, n)
+    src = (n-c)//2
+    dst = (m-c)//2
+    resized[..., dst:dst+c, dst:dst+c] = spectrum[..., src:src+c, src:src+c]
+    return resized
+
+def spectral_resample(field, m):
+    """Resample the last two axes of field to m x m samples covering the same window,
+    by cropping or zero padding its spectrum. Sample values are preserved, which is
+    exact for band limited fields fitting in both grids."""
+    n = field.shape[-1]
+    if m == n:
+        return field
+    axes = (-2, -1)
+    spectrum = fftshift(fft2(field), axes=axes)
+    resized = ifftshift(resize_spectrum(spectrum, m), axes=axes)
+    return ifft2(resized)*(m/n)**2
+
+def resample_amplitude(A, m):
+    """Resample a modulus through its irradiance, which is the band limited quantity."""
+    I = np.real(spectral_resample(np.asarray(A)**2, m))
+    return np.sqrt(np.clip(I, 0, None)).astype(np.asarray(A).dtype, copy=False)
+
+def resample_phase(phi, m):
+    """Resample a phase distribution through its complex exponential."""
+    return np.angle(spectral_resample(np.exp(1j*np.asarray(phi)), m))
+
+def crop_transfer_function(H, m):
+    """Keep the m x m lowest frequencies of a transfer function given in FFT order
+    (i.e. already fftshifted, with the zero frequency at [0, 0])."""
+    axes = (-2, -1)
+    return ifftshift(resize_spectrum(fftshift(H, axes=axes), m), axes=axes)
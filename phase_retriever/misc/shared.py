@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Zero-copy transport of numpy arrays between the retriever and its worker processes,
+through multiprocessing.shared_memory blocks. A SharedArray only pickles the name,
+shape and dtype of its block, so that the workers map the very same memory instead
+of receiving a copy of the transfer function, the initial phases and the amplitudes,
+and write their complex results straight into the memory read by the retriever.
+
+    H = SharedArray.copy_of(H)
+    out = SharedArray((n, n), np.complex128)
+    p = mp.Process(target=run_shared, args=(multi, (H, niter, phi0, *As), {"out": out}))
+
+The process that creates a block owns it: the block is released (unlinked) once its
+SharedArray is garbage collected, or explicitly through release.
+
+The progress of each worker is published the same way, through a Progress block
+that the retriever polls without any IPC (see Progress and report), and so is the
+request to cancel them (CancelToken).
+"""
+import weakref
+import numpy as np
+from multiprocessing import shared_memory
+
+class _SharedMemory(shared_memory.SharedMemory):
+    def close(self):
+        try:
+            super().close()
+        except BufferError:
+            pass    # Views of the block still alive, it is unmapped along with them
+
+def _release(shm, unlink):
+    if unlink:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+    shm.close()
+
+class SharedArray():
+    def __init__(self, shape, dtype=np.float64, name=None):
+        """Numpy array backed by a shared memory block.
+
+        Parameters:
+            - shape, dtype: Those of the array.
+            - name: Name of an existing block to attach to. If None, a new (zeroed) block
+            is created and owned by this object.
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(self.shape))*self.dtype.itemsize)
+        owner = name is None
+        self.shm = _SharedMemory(name=name, create=owner, size=size if owner else 0)
+        # frombuffer holds an export of the mapping, which cannot be closed under a view
+        self.array = np.frombuffer(self.shm.buf, dtype=self.dtype,
+                                   count=int(np.prod(self.shape))).reshape(self.shape)
+        self._finalizer = weakref.finalize(self, _release, self.shm, owner)
+
+    @classmethod
+    def copy_of(cls, array):
+        """New shared block holding a copy of array."""
+        array = np.asarray(array)
+        shared = cls(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __array__(self, dtype=None, copy=None):
+        if copy:
+            return np.array(self.array, dtype=dtype)
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    def __reduce__(self):
+        return SharedArray, (self.shape, self.dtype.str, self.name)
+
+    def release(self):
+        """Unmap the block (and unlink it, if owned). The array is no longer usable."""
+        self.array = None
+        self._finalizer()
+
+IDLE, RUNNING, DONE, FAILED = range(4)
+
+class Progress():
+    def __init__(self, capacity):
+        """Progress block of a worker: a ring with the (MSE, alpha) pairs of the last
+        capacity iterations, the number of pairs ever pushed and a status flag (IDLE,
+        RUNNING, DONE or FAILED), all in shared memory. The worker writes each pair
+        before bumping the counter, so the reader never sees a half written one.
+        """
+        self.capacity = max(1, int(capacity))
+        self.header = SharedArray((2, ), np.int64)      # Counter, status
+        self.records = SharedArray((self.capacity, 2))
+        self.cursor = 0     # Pairs already read
+
+    def push(self, mse, alpha=np.nan):
+        count = int(self.header.array[0])
+        self.records.array[count % self.capacity] = mse, alpha
+        self.header.array[0] = count+1
+
+    @property
+    def count(self):
+        """Pairs ever pushed, one per iteration."""
+        return int(self.header.array[0])
+
+    @property
+    def status(self):
+        return int(self.header.array[1])
+
+    @status.setter
+    def status(self, value):
+        self.header.array[1] = value
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def read(self):
+        """(MSE, alpha) pairs pushed since the last read, (k, 2). Those already
+        overwritten in the ring are skipped."""
+        count = int(self.header.array[0])
+        first = max(self.cursor, count-self.capacity)
+        self.cursor = count
+        return self.records.array[np.arange(first, count) % self.capacity]
+
+class CancelToken():
+    def __init__(self):
+        """Cancellation request of the retrievals running in other processes or threads,
+        with the interface of threading.Event (set, clear, is_set). Checking it reads
+        shared memory only."""
+        self.flag = SharedArray((1, ), np.int8)
+
+    def set(self):
+        self.flag.array[0] = 1
+
+    def clear(self):
+        self.flag.array[0] = 0
+
+    def is_set(self):
+        return bool(self.flag.array[0])
+
+def report(channel, mse, alpha=np.nan):
+    """Publish the MSE and the acceleration (or relaxation) parameter of an iteration
+    through a Progress block or, for compatibility, a queue receiving only the MSE."""
+    if isinstance(channel, Progress):
+        channel.push(mse, alpha)
+    elif channel:
+        channel.put(mse)
+
+def _progress_blocks(value):
+    if isinstance(value, Progress):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            yield from _progress_blocks(v)
+
+def _resolve(value):
+    if isinstance(value, SharedArray):
+        return value.array
+    if isinstance(value, (list, tuple)):
+        return type(value)(_resolve(v) for v in value)
+    return value
+
+def run_shared(target, args=(), kwargs={}):
+    """Entry point of a worker process: call target with every SharedArray of args and
+    kwargs (also inside lists and tuples) replaced by its numpy array. The status of
+    the Progress blocks among kwargs follows the call (RUNNING, then DONE or FAILED)."""
+    blocks = list(_progress_blocks(list(kwargs.values())))
+    for block in blocks:
+        block.status = RUNNING
+    try:
+        result = target(*_resolve(tuple(args)),
+                        **{key: _resolve(value) for key, value in kwargs.items()})
+    except BaseException:
+        for block in blocks:
+            block.status = FAILED
+        raise
+    for block in blocks:
+        block.status = DONE
+    return result
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Warm start of the phase retrieval from a previous result. Accepted sources:
+
+    - A complex field (exphi or the full transversal field) or a real phase
+    distribution, shared by both components, or a pair of them (X, Y).
+    - The path of a phases.npz saved by interface.save_results (phi_x, phi_y).
+    - The path of a *_retrieved.npz exported by the wx GUI or by batch runs (Ex, Ey,
+    or only Ey for scalar retrievals).
+
+The fields are brought to the current window assuming the same pixel size: they
+are center cropped or zero padded to its size and, when they carry an amplitude,
+shifted to the position maximizing the correlation between their irradiance and
+the one measured at the first plane.
+"""
+import os
+import numpy as np
+
+from .fft_backend import fft2, ifft2
+
+def load_initial_fields(init):
+    """Return the initial fields [X, Y] given by init (see the module docstring). Any
+    of them can be None."""
+    if isinstance(init, (str, os.PathLike)):
+        data = np.load(init)
+        for keys in (("Ex", "Ey"), ("phi_x", "phi_y")):
+            if all(key in data for key in keys):
+                return [data[key] for key in keys]
+        if "Ey" in data:
+            return [None, data["Ey"]]   # Scalar retrieval
+        raise ValueError(f"{init} holds no retrieved fields (Ex, Ey, phi_x, phi_y or Ey)")
+    if isinstance(init, (list, tuple)):
+        if len(init) != 2:
+            raise ValueError("A pair of initial fields (X, Y) is needed")
+        return [np.asarray(f) if f is not None else None for f in init]
+    init = np.asarray(init)
+    if init.ndim == 3 and len(init) == 2:
+        return [init[0], init[1]]
+    if init.ndim == 2:
+        return [init, init]
+    raise ValueError(f"Initial fields of shape {init.shape} not understood")
+
+def fit_to_window(field, irradiance):
+    """Phase of field, cropped or padded to the shape of irradiance and, if field has a
+    non uniform amplitude, recentered onto irradiance."""
+    field = np.asarray(field)
+    if not np.iscomplexobj(field):
+        field = np.exp(1j*field)    # A phase distribution
+    n = irradiance.shape[-1]
+    m = field.shape[-1]
+    c = min(m, n)
+    src = (m-c)//2
+    dst = (n-c)//2
+    fitted = np.zeros((n, n), dtype=np.complex128)
+    fitted[dst:dst+c, dst:dst+c] = field[src:src+c, src:src+c]
+    I = abs(fitted)**2
+    if np.ptp(I) > 1e-6*I.max():
+        # Circular cross correlation, its peak gives the displacement of the beam
+        corr = np.real(ifft2(fft2(irradiance)*np.conj(fft2(I))))
+        shift = np.unravel_index(np.argmax(corr), corr.shape)
+        fitted = np.roll(fitted, shift, axis=(0, 1))
+    return np.angle(fitted)
@@ -1,16 +1,33 @@
+import os
+import time
 import numpy as np
-from scipy.fft import fft2, ifft2, fftshift, ifftshift
+from .misc.fft_backend import fft2, ifft2, fftshift, ifftshift
 import multiprocessing as mp
 import imageio
 
-from .algorithm import multi
+from .algorithm import multi, multi_batch, multi_start, multi_pyramid, get_algorithm
+from .algorithm.tie import tie_phase
+from .misc.warm_start import load_initial_fields, fit_to_window
+from .misc.grids import bandwidth_mask, transfer_function
+from .misc.planes import plane_positions, visiting_order, is_uniform, step_transfer_functions, \
+    plane_steps
+from .misc.shared import SharedArray, Progress, CancelToken, run_shared
+from .misc.pool import get_pool, PoolTask, ThreadTask, InlineTask, auto_executor
+from .algorithm.multipass_retrieval import best_starts
+from .algorithm.checkpoint import load_checkpoint
 from .misc.radial import get_function_radius
 from .misc.file_selector import get_polarimetric_names, get_polarimetric_npz
 from .misc.central_region import find_rect_region, cross_correlation, center2rect, \
     cross_correlation2
 from .misc.stokes import get_stokes_parameters
+from .misc.resample import reduced_size, resample_amplitude, resample_phase, \
+    crop_transfer_function, spectral_resample
 # from .misc.print import print
 
+def read_image(path, ftype="png"):
+    """Decode a polarimetric image."""
+    return np.load(path) if ftype == "npy" else imageio.imread(path)
+
 def bound_rect_to_im(shape, rect):
     """Return correct rect coordinates, bound to the physical limits given by shape."""
     ny, nx = shape
@@ -35,9 +52,7 @@ def bound_rect_to_im(shape, rect):
     return (x0, y0), (x1, y1)
 
 def lowpass_filter(bw, *amps):
-    ny, nx = amps[0].shape
-    y, x = np.mgrid[-ny//2:ny//2, -nx//2:nx//2]
-    mask = x*x + y*y < bw*bw
+    mask = bandwidth_mask(amps[0].shape, bw)
     filtered = []
     for A in amps:
         a_ft = fftshift(fft2(ifftshift(A)))
@@ -60,7 +75,29 @@ class SinglePhaseRetriever():
                         "lamb": None,
                         "path": None,
                         "ext": "png",  # Extension of the images (it can also be npy)
-                        "mode": None   # vectorial or scalar
+                        "mode": None,  # vectorial or scalar
+                        "batched": False,  # Iterate both components in a single process
+                        "n_starts": 1,  # Number of initial guesses iterated together
+                        "prune_after": 20,  # Iterations between prunings of lagging starts
+                        "fft_backend": None,  # numpy, scipy or pyfftw (None: package default)
+                        "fft_workers": None,  # FFT threads per retrieval process (None: auto)
+                        "precision": "double",  # double, single (complex64) or mixed
+                        "reduced_grid": False,  # Iterate on the smallest grid holding the bandwidth
+                        "pyramid": False,  # Coarse-to-fine retrieval at dim/4, dim/2 and dim
+                        "algorithm": "multi",  # Iteration scheme, see algorithm.registry
+                        "init": "random",  # Initial phase: random or tie (transport of intensity)
+                        "plane_order": "sequential",  # sequential, alternate or list, see misc.planes
+                        # Stopping policies of single start runs, see algorithm.stopping
+                        "stop_window": 0,  # Iterations to detect stagnation (0: only eps)
+                        "stop_tol": 1e-3,  # Smallest relative MSE improvement over stop_window
+                        "stop_extrapolate": False,  # Stop if eps is not reachable within n_iter
+                        "max_seconds": None,  # Wall-clock budget of each retrieval process (any run)
+                        "mse_every": 1,  # Iterations between MSE evaluations
+                        "pool": False,  # Run in the persistent worker pool, see misc.pool
+                        "executor": "process",  # process, thread, inline or auto, see misc.pool
+                        # Checkpoints of single start multi runs, see algorithm.checkpoint
+                        "checkpoint": None,  # Path prefix of the files, {checkpoint}_X.npz and _Y.npz
+                        "checkpoint_every": 50  # Iterations between checkpoints (0: only at the end)
                         }
         self.irradiance = None
         self.images = {}
@@ -68,6 +105,12 @@ class SinglePhaseRetriever():
         self.cropped_irradiance = None
         self.a_ft = None
         self.mse = [[], []]
+        self.alphas = [[], []]  # Acceleration (or relaxation) parameters of each iteration
+        self.progress = []
+        self.processes = []
+        self.cancel_token = None    # Set by cancel, checked by the running retrieval
+        self.stop_reasons = []
+        self.grid = None    # Size of the grid where the phases are retrieved
 
         self.options["n_iter"] = n_iter          # Maximum number of iterations
         self.options["mode"] = mode            # vectorial or scalar
@@ -97,26 +140,36 @@ class SinglePhaseRetriever():
             self.options["path"] = path
             self.options["ext"] = ftype
 
-        self.polarimetric_sets, beam_name = get_polarimetric_names(path, ftype=ftype)
-        if not self.polarimetric_sets:
+        polarimetric_sets, beam_name = get_polarimetric_names(path, ftype=ftype)
+        if not polarimetric_sets:
             raise ValueError(f"Cannot load polarimetric images from {path}")
 
         # Load all images into memory
-        for z in self.polarimetric_sets:
-            self.images[z] = {}
-            for polarization in self.polarimetric_sets[z]:
+        images = {}
+        for z in polarimetric_sets:
+            images[z] = {}
+            for polarization in polarimetric_sets[z]:
                 if type(polarization) != int and polarization != "Irr":
                     continue
-                path = self.polarimetric_sets[z][polarization]
-                if ftype == "npy":
-                    image = np.load(path)
-                else:
-                    image = imageio.imread(path)
-                self.images[z][polarization] = image.astype(np.float64)
+                images[z][polarization] = read_image(polarimetric_sets[z][polarization], ftype)
+        self.set_images(polarimetric_sets, images)
+        return beam_name
 
+    def set_images(self, polarimetric_sets, images):
+        """Use images already in memory, {z: {polarization: image}}, as the dataset, e.g.
+        those decoded by a FolderWatcher as they land. polarimetric_sets: Their description,
+        as returned by get_polarimetric_names (the scale of each plane, at least)."""
+        self.irradiance = None
+        self.polarimetric_sets = polarimetric_sets
+        self.images = {z: {polarization: image.astype(self._real_dtype())
+                           for polarization, image in images[z].items()}
+                       for z in images}
         # Compute irradiance
         self._compute_irradiance()
-        return beam_name
+
+    def _real_dtype(self):
+        """Floating point type of the images and amplitudes, given the precision option."""
+        return np.float64 if self.options["precision"] == "double" else np.float32
 
     def _compute_irradiance(self):
         # Compute only the irradiance in the initial plane
@@ -273,9 +326,14 @@ class SinglePhaseRetriever():
         self.options["bandwidth"] = r
         return self.a_ft
 
-    def retrieve(self, args=(), monitor=True):
-        """Phase retrieval process. Using the configured parameters, begin the phase retrieval process."""
+    def _setup_retrieval(self, init=None):
+        """Compute the filtered amplitudes, the free space transfer function and the
+        initial phase guesses (one for each component) needed by the phase retrieval
+        process. init: Previous result to warm start from (see misc.warm_start)."""
         self.mse = [[], []] # Delete all possible values of the last mse
+        self.alphas = [[], []]
+        # Why the retrieval of each component stopped, see algorithm.stopping
+        self.stop_reasons = [SharedArray((), "S16"), SharedArray((), "S16")]
         if not self.options["pixel_size"]:
             raise ValueError("Pixel size not specified")
         if not self.options["bandwidth"]:
@@ -288,86 +346,318 @@ class SinglePhaseRetriever():
         # First, we construct the field amplitudes
         self.A_x = A_x = []
         self.A_y = A_y = []
-        for z in self.cropped:
-            I_x = self.cropped[z][2] if self.options["mode"] == "vectorial" else None
-            I_y = self.cropped[z][0]
+        real_t = self._real_dtype()
+        # Planes sorted by their axial position, then in the order they are visited
+        keys, positions = self.plane_positions()
+        order = visiting_order(self.options["plane_order"], len(keys))
+        for z in [keys[i] for i in order]:
+            I_x = self.cropped[z][2].astype(real_t) if self.options["mode"] == "vectorial" else None
+            I_y = self.cropped[z][0].astype(real_t)
             # Filtering the irradiances to remove high frequency noise fluctuations
             A_xfilt = np.real(np.sqrt(lowpass_filter(bw*2, I_x)[0])) if self.options["mode"] == "vectorial" else None
             A_yfilt = np.real(np.sqrt(lowpass_filter(bw*2, I_y)[0]))
             A_x.append(A_xfilt) #if self.options["mode"] == "vectorial" else None
             A_y.append(A_yfilt)
         # Then, we need to compute the free space transfer function H
-        n = self.options["dim"]
-        ny, nx = np.mgrid[-n//2:n//2, -n//2:n//2]
-        bandwidth_mask = (ny*ny+nx*nx < bw*bw)
-        umax = .5/p_size
-        x = nx/nx.max()*umax
-        y = ny/ny.max()*umax
-        rho2 = x*x+y*y
-        gamma = np.zeros((n, n), dtype=np.float64)
-        np.sqrt(1-rho2, out=gamma, where=bandwidth_mask)
-        zetes = list(self.images.keys())
-        dz = (zetes[1]-zetes[0])/lamb
-        H = np.exp(2j*np.pi*gamma*dz)
-        # Get the bandwidth of the beam we are computing and remove all values of H lying outside this region.
-        H[:] = fftshift(H*bandwidth_mask)
+        n = self.grid = self.options["dim"]
+        complex_t = np.complex128 if real_t is np.float64 else np.complex64
+        # Band limited to the bandwidth of the beam, shared (read-only) through the grid cache
+        def transfer(dz):
+            return transfer_function((n, n), p_size, dz/lamb, bw, complex_t)
+        if is_uniform(positions, order):
+            H = transfer(positions[1]-positions[0])     # Shared by every step
+        else:
+            H = step_transfer_functions(transfer, positions, order)
+        dz = (positions[order[1]]-positions[0])/lamb
         # Finally, we create an initial guess for the phase of both components
         #phi_0 = np.zeros((n, n))
-        phi_0 = np.random.rand(n, n)
+        n_starts = self.options["n_starts"]
+        phi_rand = np.random.rand(n, n) if n_starts == 1 else np.random.rand(n_starts, n, n)
+        phi_0 = [phi_rand, phi_rand]
+
+        def seed(c, phi):
+            # With several starts, only the first one, the rest still explore around it
+            if n_starts > 1:
+                phi_0[c] = phi_0[c].copy()
+                phi_0[c][0] = phi
+            else:
+                phi_0[c] = phi
+
+        if self.options["init"] == "tie":
+            # Solution of the transport of intensity equation between the first two planes
+            for c, A in enumerate((A_x, A_y)):
+                if A[0] is not None:
+                    seed(c, tie_phase(A[0]**2, A[1]**2, dz, p_size))
+        elif self.options["init"] != "random":
+            raise ValueError(f"Unknown initial phase {self.options['init']}. Options: random, tie")
+        if init is not None:
+            # Warm start from a previous result
+            fields = load_initial_fields(init)
+            for c, A in enumerate((A_x, A_y)):
+                field = fields[c] if fields[c] is not None else fields[1-c]
+                if A[0] is not None and field is not None:
+                    seed(c, fit_to_window(field, A[0]**2))
         #phi_0 = np.arctan2(x, y)
+        return A_x, A_y, H, phi_0
+
+    def plane_positions(self):
+        """Keys of the loaded planes and their axial positions (same units as lamb),
+        sorted by position. The positions are given by the keys and their scale (see
+        get_polarimetric_names), or by the keys alone if the images were set directly."""
+        keys = list(self.cropped or self.images)
+        positions = plane_positions(getattr(self, "polarimetric_sets", {}) or
+                                    {z: {} for z in keys}, keys)
+        ranks = np.argsort(positions, kind="stable")
+        return [keys[i] for i in ranks], [positions[i] for i in ranks]
+
+    def retrieve(self, args=(), monitor=True, init=None, resume=None, n_iter=None):
+        """Phase retrieval process. Using the configured parameters, begin the phase retrieval process.
+        init: Optional previous result to start from instead of the init option: an exphi
+        array (or a pair, X and Y), a phases.npz or an exported *_retrieved.npz path. It
+        is cropped or padded and recentered to the current window (see misc.warm_start).
+        resume: Number of iterations to carry on from the checkpoints of the last run
+        instead of starting over (see resume).
+        n_iter: Iterations of this run, instead of the n_iter option.
+        resume and n_iter may also be a pair, one for each component (X, Y), of single
+        start, non batched runs."""
+        if self.options["pyramid"] and (self.options["batched"] or self.options["n_starts"] > 1):
+            raise ValueError("Pyramid retrieval is only available for single start, non batched runs")
+        algorithm = get_algorithm(self.options["algorithm"])
+        if algorithm is not multi and (self.options["batched"] or self.options["n_starts"] > 1
+                                       or self.options["pyramid"]):
+            raise ValueError("Batched, multi-start and pyramid runs are only available for multi")
+        if (self.options["checkpoint"] or resume) and (algorithm is not multi or self.options["batched"]
+                                                       or self.options["n_starts"] > 1
+                                                       or self.options["pyramid"]):
+            raise ValueError("Checkpoints are only available for single start, non batched multi runs")
+        if resume and not self.options["checkpoint"]:
+            raise ValueError("No checkpoint configured to resume from")
+        if self.options["executor"] not in ("process", "thread", "inline", "auto"):
+            raise ValueError(f"Unknown executor {self.options['executor']}. "
+                             "Options: process, thread, inline, auto")
+        A_x_full, A_y_full, H, phi_0 = self._setup_retrieval(init)
+        A_x, A_y = A_x_full, A_y_full
+        if self.options["reduced_grid"]:
+            A_x, A_y, H, phi_0 = self._reduce_grid(A_x, A_y, H, phi_0)
+        n = self.grid
 
         # We set up the multiprocessing environment. Just two processes, as we have two phases to recover
-        self.queues = [mp.Queue(), mp.Queue()]
-        p1, c1 = mp.Pipe()
-        p2, c2 = mp.Pipe()
-        # As queues only work with base types, we need to separate real and imaginary parts of the result
-        self.reals = [mp.Array("d", range(0, int(n**2))), mp.Array("d", range(0, int(n**2)))]
-        self.imags = [mp.Array("d", range(0, int(n**2))), mp.Array("d", range(0, int(n**2)))]
-        # List with each of the processes, to keep track of them
+        niters = [int(k) for k in np.broadcast_to(resume or n_iter or self.options["n_iter"], (2, ))]
+        n_iter = max(niters)
+        if self.options["batched"] or self.options["n_starts"] > 1:
+            niters = [n_iter, n_iter]
+        checkpoints = [{}, {}]
+        if self.options["checkpoint"]:
+            for c in range(2):
+                path = self.checkpoint_path(c)
+                checkpoints[c] = {"checkpoint": path,
+                                  "checkpoint_every": self.options["checkpoint_every"]}
+                if resume and (A_x, A_y)[c][0] is not None:
+                    state = load_checkpoint(path)
+                    niters[c] = state["iteration"]+niters[c]  # Counting those of the checkpoints
+                    checkpoints[c]["resume"] = path
+                    self.mse[c] = state["mses"].tolist()
+                    self.alphas[c] = state["alphes"].tolist()
         eps = self["eps"]
-        self.processes = \
-                [mp.Process(target=multi, args=(H, self.options["n_iter"], phi_0, *A_x),
-                    kwargs={"queue":self.queues[0], "eps":eps,
-                            "real":self.reals[0], "imag":self.imags[0]})
-                 if self.options["mode"] == "vectorial" else None,
-                 mp.Process(target=multi, args=(H, self.options["n_iter"], phi_0, *A_y),
-                    kwargs={"queue":self.queues[1], "eps":eps,
-                            "real":self.reals[1], "imag":self.imags[1]})]
+        vectorial = self.options["mode"] == "vectorial"
+        n_processes = 2 if vectorial and not self.options["batched"] else 1
+        self.executor = self.options["executor"]
+        if self.executor == "auto":
+            self.executor = auto_executor(n, len(A_y), n_processes)
+        # Each process publishes its progress in shared memory, polled by monitor_process
+        self.progress = [Progress(n_iter) if A[0] is not None else None for A in (A_x, A_y)]
+        # Inputs and results of processes travel through shared memory blocks (see
+        # misc.shared): they map them instead of unpickling copies, and write the fields
+        # in place. Threads just share the very arrays.
+        if self.executor == "process":
+            share, alloc = SharedArray.copy_of, SharedArray
+        else:
+            share, alloc = np.asarray, np.zeros
+        complex_t = np.complex64 if self.options["precision"] == "single" else np.complex128
+        self.fields = [alloc((n, n), complex_t), alloc((n, n), complex_t)]
+        if self.options["batched"] and np.ndim(H) == 3:
+            H = H[:, None]  # Transfer functions of each step, shared by the whole batch
+        H = share(H)
+        # Per-start MSE histories, only when several initial guesses are iterated
+        n_starts = self.options["n_starts"]
+        self.start_mses = ([alloc((n_starts*n_iter, )), alloc((n_starts*n_iter, ))]
+                           if n_starts > 1 else None)
+        # FFT threads of each retrieval process, splitting the cores among them if not set
+        fft_kwargs = {"backend": self.options["fft_backend"],
+                      "workers": self.options["fft_workers"] or max(1, (os.cpu_count() or 1)//n_processes),
+                      "precision": self.options["precision"]}
+        # Budget and cancellation, checked by every kind of run
+        self.cancel_token = CancelToken()
+        fft_kwargs["stopping"] = {"max_seconds": self.options["max_seconds"],
+                                  "cancel": self.cancel_token}
+        # List with each of the processes, to keep track of them
+        if self.options["batched"]:
+            # A single process iterating both components (and all their starts) through stacked FFTs
+            components = [0, 1] if vectorial else [1]
+            amplitudes = [share(np.repeat(np.stack([A_x[j], A_y[j]]) if vectorial else A_y[j][None],
+                                          n_starts, axis=0))
+                          for j in range(len(A_y))]
+            phi_0 = share(np.concatenate([np.reshape(phi_0[c], (-1, n, n)) for c in components]))
+            groups = np.repeat(np.arange(len(components)), n_starts)
+            self.processes = \
+                    [self._worker(run_shared,
+                        (multi_batch, (H, n_iter, phi_0, *amplitudes),
+                         {"queues":[self.progress[c] for c in components], "eps":eps,
+                          "outs":[self.fields[c] for c in components],
+                          "groups":groups, "prune_after":self.options["prune_after"],
+                          "mse_outs":([self.start_mses[c] for c in components]
+                                      if n_starts > 1 else None),
+                          "reason_outs":[self.stop_reasons[c] for c in components],
+                          **fft_kwargs}))]
+        else:
+            target = algorithm if n_starts == 1 else multi_start
+            if n_starts == 1:
+                fft_kwargs["stopping"].update({"window": self.options["stop_window"],
+                                               "tol": self.options["stop_tol"],
+                                               "extrapolate": self.options["stop_extrapolate"],
+                                               "mse_every": self.options["mse_every"]})
+            if self.options["pyramid"]:
+                target = multi_pyramid
+                # No level coarser than the support of the irradiances
+                fft_kwargs["min_size"] = reduced_size(self.options["bandwidth"], n, oversampling=1)
+            self.processes = \
+                    [self._worker(run_shared,
+                        (target, (H, niters[c], share(phi_0[c]), *[share(Ai) for Ai in A]),
+                         {"queue":self.progress[c], "eps":eps, "out":self.fields[c], **fft_kwargs,
+                          **checkpoints[c],
+                          "reason_out":self.stop_reasons[c],
+                          **({"prune_after":self.options["prune_after"],
+                              "mse_out":self.start_mses[c]} if n_starts > 1 else {})}))
+                     if A[0] is not None else None
+                     for c, A in enumerate((A_x, A_y))]
         # Begin monitoring
         if monitor:
             self.monitor_process(*args)
-        return A_x, A_y
+        return A_x_full, A_y_full
+
+    def cancel(self, timeout=None):
+        """Ask the running retrieval to stop within a few iterations, and wait up to
+        timeout seconds (None: until they finish) for its workers. They still deliver
+        the best field found so far (see get_phases), with "cancelled" as stop reason."""
+        if self.cancel_token is not None:
+            self.cancel_token.set()
+        for p in self.processes:
+            if p is not None and p.is_alive():
+                p.join(timeout)
+
+    def resume(self, extra_iter=None, args=(), monitor=True):
+        """Carry on the last retrieval for extra_iter more iterations (by default, n_iter;
+        a pair gives those of each component) from its checkpoints, e.g. when it stopped
+        at n_iter above eps or was killed. The dataset and options must be those of the
+        checkpointed run, the MSE history is restored along with the iteration state."""
+        return self.retrieve(args, monitor, resume=extra_iter or self.options["n_iter"])
+
+    def checkpoint_path(self, c):
+        """Checkpoint file of component c (0: X, 1: Y)."""
+        return f"{self.options['checkpoint']}_{'XY'[c]}.npz"
+
+    def _worker(self, target, args):
+        """Worker running target(*args), given the executor: a thread, the calling thread
+        (inline), a new process or, with the pool option, a task of the persistent worker
+        pool, whose processes keep their FFT state warm."""
+        if self.executor == "thread":
+            return ThreadTask(target, args)
+        if self.executor == "inline":
+            return InlineTask(target, args)
+        if not self.options["pool"]:
+            return mp.Process(target=target, args=args)
+        workers = self.options["fft_workers"] or max(1, (os.cpu_count() or 1)//2)
+        return PoolTask(get_pool(2, self.options["fft_backend"], workers), target, args)
+
+    def _reduce_grid(self, A_x, A_y, H, phi_0):
+        """Resample the amplitudes, transfer function and initial phase onto the smallest
+        FFT friendly grid holding the spectral support given by the bandwidth. The
+        window is the same, only sampled more coarsely."""
+        m = self.grid = reduced_size(self.options["bandwidth"], self.options["dim"])
+        A_x = [resample_amplitude(A, m) if A is not None else None for A in A_x]
+        A_y = [resample_amplitude(A, m) for A in A_y]
+        # Needed to map the retrieved phases back to the full window
+        self.grid_amplitudes = A_x, A_y
+        phi_0 = [resample_phase(phi, m) for phi in phi_0]
+        return A_x, A_y, crop_transfer_function(H, m), phi_0
 
     def update_function(self, *args):
         pass
 
     def monitor_process(self, *args):
-        # TODO: Aconsegueix-ne les fases ajustades
         for p in self.processes:
             if p is None:
                 continue
             p.start()
-            p.join(timeout=0)
-        alive = any([p.is_alive() for p in self.processes if p is not None])
-        while alive:
-            for i, p in enumerate(self.processes):
-                full = True
-                while full:
-                    try:
-                        data = self.queues[i].get_nowait()
-                        self.mse[i].append(data)
-                    except:
-                        full = False
-            alive = any([p.is_alive() for p in self.processes if p is not None])
+        running = True
+        while running:
+            running, updated = self.poll_progress()
             # Update through an update function if necessary
-            self.update_function(*args)
-    
+            if updated:
+                self.update_function(*args)
+            time.sleep(0.01)
+        for p in self.processes:
+            if p is not None:
+                p.join()
+
+    def poll_progress(self):
+        """Move the MSE and alpha values published by the retrieval processes since the
+        last call into self.mse and self.alphas. Reads shared memory only.
+
+        Output:
+            - running: Whether any process has still to finish.
+            - updated: Whether there were new values.
+        """
+        running = updated = False
+        for i, progress in enumerate(self.progress):
+            if progress is None:
+                continue
+            # Status before the values, not to miss the last ones of a finishing process
+            finished = progress.finished
+            records = progress.read()
+            self.mse[i].extend(records[:, 0].tolist())
+            self.alphas[i].extend(records[:, 1].tolist())
+            running = running or not finished
+            updated = updated or len(records) > 0
+        # Processes killed before reporting their end would be waited for forever
+        running = running and any(p.is_alive() for p in self.processes if p is not None)
+        return running, updated
+
+    def get_iterations(self):
+        """Return the iterations done so far by the current retrieval of each component
+        (counted by its progress block, not by its MSE history), 0 where there is none."""
+        return [progress.count if progress is not None else 0 for progress in self.progress]
+
+    def get_stop_reasons(self):
+        """Return why the retrieval of each component stopped ("threshold", "stagnation",
+        "unreachable", "time", "cancelled" or "niter", see algorithm.stopping), None where
+        it is unknown."""
+        return [np.array(reason).item().decode() or None for reason in self.stop_reasons]
+
+    def get_start_mses(self):
+        """Return the MSE histories of every start, (n_starts, n_iter), for each component.
+        Only available when several initial guesses were iterated."""
+        if not self.start_mses:
+            return None
+        return [np.array(mses).reshape((self.options["n_starts"], -1)) for mses in self.start_mses]
+
+    def _get_field(self, c):
+        """Copy of the retrieved complex field of component c, on the full window."""
+        dim = self.options["dim"]
+        dtype = np.complex64 if self.options["precision"] == "single" else np.complex128
+        grid = self.grid or dim
+        field = np.array(self.fields[c], dtype=dtype).reshape((grid, grid))
+        if grid != dim:
+            # Back to the full window through the band limited field on the reduced grid
+            U = spectral_resample(self.grid_amplitudes[c][0]*field, dim)
+            field = (U/(abs(U)+1e-16)).astype(dtype)
+        return field
+
     def get_phases(self):
         """Convert the multiprocessing arrays into the 2D phase distributions."""
-        dim = self.options["dim"]
         if self.options['mode'] == 'vectorial':
-            exphi_x = (np.asarray(self.reals[0])+1j*np.asarray(self.imags[0])).reshape((dim, dim))
-            exphi_y = (np.asarray(self.reals[1])+1j*np.asarray(self.imags[1])).reshape((dim, dim))
+            exphi_x = self._get_field(0)
+            exphi_y = self._get_field(1)
             # Now, impose the phase difference as obtained experimentally through the Stokes parameters
             stokes = self.get_stokes()
             delta = np.arctan2(stokes[3], stokes[2])
@@ -381,8 +671,7 @@ class SinglePhaseRetriever():
             exphi_y *= e_delta_0
             return exphi_x, exphi_y
         else:
-            return ((np.asarray(self.reals[1])+1j*np.asarray(self.imags[1])).reshape((dim, dim)),
-                    (np.asarray(self.reals[1])+1j*np.asarray(self.imags[1])).reshape((dim, dim)))
+            return self._get_field(1), self._get_field(1)
 
     def get_trans_fields(self, zeroFill=False):
         """Return the transversal components of the field."""
@@ -391,8 +680,8 @@ class SinglePhaseRetriever():
             ex = self.A_x[0] * exphi_x
             ey = self.A_y[0] * exphi_y
         else:
-            ex = self.A_y[0] * np.exp(1j*exphi_x)
-            ey = np.zeros_like(ex, dtype=np.complex128) if zeroFill else None
+            ex = self.A_y[0] * exphi_x
+            ey = np.zeros_like(ex) if zeroFill else None
         return ex, ey
 
     def get_stokes(self):
@@ -428,3 +717,70 @@ class PhaseRetriever(SinglePhaseRetriever):
     # fases a la vegada.
     def __init__(sef, *args, **kwargs):
         super().__init__(**kwargs)
+
+
+# Options of retrieve_batch applying to the whole batch
+BATCH_OPTIONS = ("n_iter", "eps", "prune_after", "precision")
+# Options retrieve_batch cannot honour, and the only value it takes for each of them
+UNBATCHED_OPTIONS = {"algorithm": "multi", "pyramid": False, "reduced_grid": False,
+                     "checkpoint": None}
+
+def retrieve_batch(retrievers, backend=None, workers=None):
+    """Retrieve the phases of several same-size datasets at once, within this very
+    process. The X and Y components of every retriever are stacked along a batch axis
+    and iterated together through multi_batch, so no worker process is spawned and no
+    data needs to be pickled. All retrievers must share dim and the number of planes,
+    as well as the options of the batch loop (n_iter, eps, prune_after and precision):
+    a ValueError is raised otherwise, rather than overriding those of some retrievers.
+    So it is for the options the batch loop cannot honour (other algorithms, pyramid,
+    reduced grid or checkpoints, see UNBATCHED_OPTIONS).
+    Results are left in each retriever, ready for get_phases/get_trans_fields. The FFT
+    backend and workers default to those configured in the first retriever."""
+    for option, value in UNBATCHED_OPTIONS.items():
+        if any(retriever.options[option] != value for retriever in retrievers):
+            raise ValueError(f"Batched retrievals only take {option}={value!r}")
+    for option in BATCH_OPTIONS:
+        values = [retriever.options[option] for retriever in retrievers]
+        if any(value != values[0] for value in values):
+            raise ValueError(f"All retrievers of a batch must share {option}, got {values}")
+    amplitudes, Hs, phis, groups, owners = [], [], [], [], []
+    for retriever in retrievers:
+        A_x, A_y, H, phi_0 = retriever._setup_retrieval()
+        n = retriever.options["dim"]
+        n_starts = retriever.options["n_starts"]
+        retriever.progress = []
+        retriever.processes = []
+        dtype = np.complex64 if retriever.options["precision"] == "single" else np.complex128
+        retriever.fields = [np.zeros((n, n), dtype=dtype), np.zeros((n, n), dtype=dtype)]
+        retriever.start_mses = None
+        components = ((0, A_x), (1, A_y)) if retriever.options["mode"] == "vectorial" else ((1, A_y), )
+        for c, A in components:
+            for phi in (phi_0[c] if n_starts > 1 else [phi_0[c]]):
+                amplitudes.append(A)
+                Hs.append(H)
+                phis.append(phi)
+                groups.append(len(owners))
+            owners.append((retriever, c))
+    if len({A[0].shape for A in amplitudes}) > 1 or len({len(A) for A in amplitudes}) > 1:
+        raise ValueError("All datasets must share the window size and the number of planes")
+
+    # Stack each plane of every component along the batch axis
+    planes = [np.stack(plane) for plane in zip(*amplitudes)]
+    n_iter, eps, prune_after, precision = [retrievers[0].options[option] for option in BATCH_OPTIONS]
+    groups = np.asarray(groups)
+    backend = backend or retrievers[0].options["fft_backend"]
+    workers = workers or retrievers[0].options["fft_workers"]
+    if any(np.ndim(H) == 3 for H in Hs):
+        # Non equidistant planes: the transfer functions of each step, (steps, B, n, n)
+        Hs = [np.stack(plane_steps(H, len(planes))[0]) for H in Hs]
+        H = np.stack(Hs, axis=1)
+    else:
+        H = np.stack(Hs)
+    exphi, mses, _, _ = multi_batch(H, n_iter, np.stack(phis), *planes, eps=eps,
+                                    backend=backend, workers=workers, groups=groups,
+                                    prune_after=prune_after, precision=precision,
+                                    reason_outs=[retriever.stop_reasons[c].array
+                                                 for retriever, c in owners])
+    for (retriever, c), b in zip(owners, best_starts(mses, groups)):
+        retriever.fields[c][...] = exphi[b]
+        retriever.mse[c] = list(mses[b][mses[b] > 0])
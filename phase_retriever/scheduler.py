@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Scheduler of retrieval jobs sharing a machine. Each job is a retriever ready to
+retrieve (dataset loaded, window and bandwidth set). The scheduler runs at most
+max_jobs of them at a time and splits the cores between them: a job gets its share
+of the free cores when it starts, which is then divided among the FFT workers of
+its components, so that concurrent retrievals never ask for more threads than
+there are cores.
+
+    scheduler = Scheduler()
+    scheduler.submit(retriever_a, name="run A")
+    scheduler.submit(retriever_b, priority=INTERACTIVE, callback=show_results)
+    scheduler.run()     # Or call scheduler.poll() periodically, e.g. from a GUI timer
+
+Jobs start by decreasing priority. A queued job of higher priority than a running
+one preempts it when there is no room to start it: the running job is cancelled
+(see SinglePhaseRetriever.cancel) and queued again, carrying on later from its
+checkpoint, if its retriever has one configured, or else warm started from the
+field it had reached. The queue depth and the progress of every job, read from
+the iteration counters and the MSE stream of its retrieval, are available through
+status.
+
+While a job runs, the scheduler sets the executor, pool and fft_workers options of its
+retriever. The values set by the caller are restored whenever the job stops, either
+finished or preempted.
+"""
+import os
+import time
+import heapq
+import itertools
+
+from phase_retriever.algorithm.checkpoint import load_checkpoint
+
+QUEUED, RUNNING, PREEMPTING, DONE, FAILED = "queued", "running", "preempting", "done", "failed"
+# Retriever options set by the scheduler while a job runs
+SCHEDULED_OPTIONS = ("fft_workers", "pool", "executor")
+# Priorities of batch work and of the jobs a user is waiting for
+BATCH, INTERACTIVE = 0, 10
+
+class Job():
+    def __init__(self, retriever, priority=BATCH, name=None, init=None, callback=None):
+        """Retrieval job of a Scheduler.
+
+        Parameters:
+            - retriever: Retriever ready to retrieve.
+            - priority: Higher priorities start first, and preempt lower ones.
+            - name: Name of the job in the status reports.
+            - init: Previous result to warm start from (see SinglePhaseRetriever.retrieve).
+            - callback: Called with the job once it is done (or failed).
+        """
+        self.retriever = retriever
+        self.priority = priority
+        self.name = name
+        self.init = init
+        self.callback = callback
+        self.state = QUEUED
+        self.cores = 0
+        self.n_iter = retriever.options["n_iter"]
+        self.mse = [[], []]         # MSE history of each component, across preemptions
+        self._previous = [[], []]   # That of the runs before the current one
+        self.counts = [0, 0]        # Iterations done by each component, across preemptions
+        self._done = [0, 0]         # Those of the runs before the current one
+        self.preemptions = 0
+        self.error = None
+        self._options = {}          # Those of SCHEDULED_OPTIONS set by the caller
+
+    @property
+    def iterations(self):
+        return max(self.counts)
+
+    @property
+    def progress(self):
+        """Fraction of the iterations done."""
+        return 1. if self.state == DONE else min(1., self.iterations/max(1, self.n_iter))
+
+    def _sync(self):
+        self.mse = [previous+current for previous, current in zip(self._previous, self.retriever.mse)]
+        # The MSE history may be sparser than the iterations (mse_every)
+        self.counts = [done+current for done, current in zip(self._done, self.retriever.get_iterations())]
+
+class Scheduler():
+    def __init__(self, cores=None, max_jobs=None):
+        """Scheduler of retrieval jobs (see the module docstring).
+
+        Parameters:
+            - cores: Cores to share among the jobs (default: all of them).
+            - max_jobs: Jobs running at once (default: half the cores, so that both
+            components of each job get a core of their own).
+        """
+        self.cores = cores or os.cpu_count() or 1
+        self.max_jobs = max_jobs or max(1, self.cores//2)
+        self.queue = []     # Heap of (-priority, order of arrival, job)
+        self.running = []
+        self.finished = []
+        self._arrivals = itertools.count()
+
+    def submit(self, retriever, priority=BATCH, name=None, init=None, callback=None):
+        """Queue the retrieval of retriever (see Job), returning its job."""
+        job = Job(retriever, priority, name or f"job {len(self.jobs)}", init, callback)
+        self._push(job)
+        return job
+
+    def _push(self, job):
+        job.state = QUEUED
+        heapq.heappush(self.queue, (-job.priority, next(self._arrivals), job))
+
+    @property
+    def jobs(self):
+        return self.running+[job for _, _, job in sorted(self.queue)]+self.finished
+
+    @property
+    def queue_depth(self):
+        return len(self.queue)
+
+    def free_cores(self):
+        return self.cores-sum(job.cores for job in self.running)
+
+    def fft_workers(self):
+        """FFT threads for work outside the jobs, such as a FocalPropagator of the GUI:
+        the free cores, at least one."""
+        return max(1, self.free_cores())
+
+    def poll(self):
+        """Collect the progress of the running jobs, finish those done, and preempt and
+        start jobs as needed. Reads shared memory only, never blocks. Returns whether
+        there are jobs left."""
+        for job in list(self.running):
+            running, _ = job.retriever.poll_progress()
+            job._sync()
+            if not running:
+                self._finish(job)
+        self._preempt()
+        self._dispatch()
+        return bool(self.running or self.queue)
+
+    def run(self, interval=0.01):
+        """Poll until every job is finished."""
+        while self.poll():
+            time.sleep(interval)
+
+    def status(self):
+        """Queue depth, number of running and finished jobs, and the state of every job:
+        name, state, priority, cores, progress and last MSE of each component."""
+        return {"queued": self.queue_depth, "running": len(self.running),
+                "finished": len(self.finished),
+                "jobs": [{"name": job.name, "state": job.state, "priority": job.priority,
+                          "cores": job.cores, "progress": job.progress,
+                          "mse": [mse[-1] if mse else None for mse in job.mse]}
+                         for job in self.jobs]}
+
+    def _dispatch(self):
+        while self.queue and len(self.running) < self.max_jobs and self.free_cores() > 0:
+            # The free cores are split evenly among the jobs that can start now
+            starting = min(self.max_jobs-len(self.running), len(self.queue))
+            _, _, job = heapq.heappop(self.queue)
+            self._start(job, max(1, self.free_cores()//starting))
+
+    def _preempt(self):
+        if not self.queue or any(job.state == PREEMPTING for job in self.running):
+            return
+        if len(self.running) < self.max_jobs and self.free_cores() > 0:
+            return  # Room for the next job
+        priority = -self.queue[0][0]
+        # The lowest priority job, the latest started among equals
+        victims = [job for job in self.running if job.priority < priority]
+        if victims:
+            victim = min(reversed(victims), key=lambda job: job.priority)
+            victim.state = PREEMPTING
+            victim.retriever.cancel_token.set()
+
+    def _start(self, job, cores):
+        retriever = job.retriever
+        options = retriever.options
+        n_workers = 2 if options["mode"] == "vectorial" and not options["batched"] else 1
+        job._options = {key: options[key] for key in SCHEDULED_OPTIONS}
+        # Processes when each component gets a core, threads sharing a core otherwise.
+        # Never inline, the caller has to keep polling.
+        retriever.config(fft_workers=max(1, cores//n_workers), pool=False,
+                         executor="process" if cores >= n_workers else "thread")
+        job.cores = cores
+        job.state = RUNNING
+        self.running.append(job)
+        try:
+            # The components of a preempted job may have stopped an iteration apart, each
+            # one carries on up to n_iter
+            if job.preemptions and options["checkpoint"]:
+                # The checkpoints hold the whole history too, with the iteration cancelled
+                job._previous = [[], []]
+                job._done = [load_checkpoint(retriever.checkpoint_path(c))["iteration"]
+                             if os.path.exists(retriever.checkpoint_path(c)) else 0 for c in range(2)]
+                retriever.resume([max(0, job.n_iter-k) for k in job._done], monitor=False)
+            else:
+                retriever.retrieve(monitor=False, init=job.init,
+                                   n_iter=[max(1, job.n_iter-k) for k in job.counts])
+            for process in retriever.processes:
+                if process is not None:
+                    process.start()
+        except Exception as error:
+            job.error = error
+            self._finish(job)
+
+    def _finish(self, job):
+        self.running.remove(job)
+        job.cores = 0
+        if job.error is None:
+            try:
+                for process in job.retriever.processes:
+                    if process is not None:
+                        process.join()
+            except Exception as error:
+                job.error = error
+        job.retriever.config(**job._options)
+        if job.error is None and any(exitcode for exitcode in
+                                     (getattr(p, "exitcode", 0) for p in job.retriever.processes
+                                      if p is not None)):
+            job.error = RuntimeError(f"Retrieval process of {job.name} failed")
+        # Preempted runs carry on, unless they ended by themselves meanwhile
+        reasons = [reason for reason in job.retriever.get_stop_reasons() if reason]
+        stopped = reasons and "cancelled" not in reasons
+        if job.error is None and job.state == PREEMPTING and not stopped and \
+                job.iterations < job.n_iter:
+            # Carry on later from where it stopped
+            job.preemptions += 1
+            job._previous = [list(mse) for mse in job.mse]
+            job._done = list(job.counts)
+            job.init = job.retriever.get_phases()
+            self._push(job)
+            return
+        job.state = FAILED if job.error is not None else DONE
+        self.finished.append(job)
+        if job.callback is not None:
+            job.callback(job)
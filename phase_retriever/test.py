@@ -1,14 +1,595 @@
+import gc
 import os
+import sys
+import time
+import shutil
+import tempfile
+import weakref
+import subprocess
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.fft import fft2, ifft2, fftshift, ifftshift
 
 from phase_retriever import PhaseRetriever
 from phase_retriever.misc.focalprop import FocalPropagator
+from phase_retriever.misc.grids import transfer_function
+from phase_retriever.algorithm import multi, multi_batch, multi_start, multi_pyramid
+from phase_retriever.algorithm.multipass_retrieval import best_starts, multi_anderson
+from phase_retriever.algorithm.gradient import AmplitudeMismatch
+from phase_retriever.algorithm.tie import tie_phase
+from phase_retriever.algorithm.stopping import StoppingPolicy
+from phase_retriever.misc.warm_start import load_initial_fields, fit_to_window
+from phase_retriever.misc.resample import reduced_size, resample_amplitude, resample_phase, \
+    crop_transfer_function, spectral_resample
+from phase_retriever.batch import export_fields
+from phase_retriever.scheduler import Scheduler, INTERACTIVE, QUEUED, RUNNING, DONE
+from phase_retriever.watch import FolderWatcher
 
 OK = "\033[0;32mOK\033[0;0m"
 FAIL = "\033[91mFAIL\033[0;0m"
 
+# Modules that importing the core of the package must not load
+GUI_MODULES = ("wx", "tkinter", "matplotlib")
+
+def test_imports():
+    """Check, in a fresh interpreter, that importing PhaseRetriever loads no GUI
+    toolkit nor matplotlib."""
+    n_errors = 0
+    print("Lightweight import... ", end="")
+    code = ("import sys; from phase_retriever import PhaseRetriever; "
+            "print(' '.join(sorted({m.split('.')[0] for m in sys.modules})))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True)
+    loaded = set(result.stdout.split())
+    unwanted = [m for m in GUI_MODULES if m in loaded]
+    if result.returncode or unwanted or "phase_retriever" not in loaded:
+        print(FAIL, f"Loaded: {unwanted}" if unwanted else result.stderr.strip())
+        n_errors += 1
+    else:
+        print(OK)
+    return n_errors
+
+def simulated_retriever(**options):
+    """Retriever of the simulated dataset, ready to retrieve with the given options."""
+    test_data = os.path.join(os.path.dirname(__file__), "phase_retriever_dataset", "simulated")
+    retriever = PhaseRetriever()
+    retriever.load_dataset(test_data)
+    retriever.config(pixel_size=0.043, lamb=0.52)
+    retriever.center_window()
+    retriever.select_phase_origin()
+    retriever.compute_bandwidth()
+    retriever.config(**options)
+    return retriever
+
+def synthetic_planes(n=32, n_planes=2, dz=4., n_starts=3, seed=0, pixel_size=0.5, bandwidth=None):
+    """Moduli of a random band limited field at n_planes equidistant planes, the transfer
+    function between them and n_starts initial phases, to test the algorithms on. The
+    bandwidth defaults to n/4 frequency pixels."""
+    rng = np.random.default_rng(seed)
+    H = transfer_function((n, n), pixel_size, dz, bandwidth or n//4)
+    U = np.fft.ifft2(np.fft.fft2(rng.standard_normal((n, n))+1j*rng.standard_normal((n, n)))*(H != 0))
+    As = []
+    for _ in range(n_planes):
+        As.append(np.abs(U))
+        U = np.fft.ifft2(np.fft.fft2(U)*H)
+    return H, As, rng.random((n_starts, n, n))*2*np.pi
+
+def test_batch():
+    """Check that batched retrievals follow multi, and the pruning of multi-start."""
+    n_errors = 0
+    H, As, phis = synthetic_planes(n_planes=3)
+    niter = 30
+
+    print("Batched retrieval matches multi... ", end="")
+    try:
+        xk, mses, _, reasons = multi_batch(H, niter, phis, *As, eps=0)
+        assert reasons == ["niter"]*len(phis)
+        for b, phi in enumerate(phis):
+            xk_b, mses_b, _, _ = multi(H, niter, phi, *As, eps=0)
+            assert np.allclose(xk[b], xk_b, rtol=0, atol=1e-10)
+            assert np.allclose(mses[b], mses_b, rtol=1e-10, atol=0)
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+
+    print("Multi-start pruning... ", end="")
+    try:
+        prune_after = 5
+        xk, mses, _, reason = multi_start(H, niter, phis, *As, eps=0, prune_after=prune_after,
+                                          prune_margin=0)
+        best = best_starts(mses, np.zeros(len(phis), dtype=int))[0]
+        assert reason == "niter"
+        iterated = np.count_nonzero(mses, axis=1)
+        # Without margin, only the best start survives the first pruning
+        assert iterated[best] == niter
+        assert all(iterated[b] == prune_after for b in range(len(phis)) if b != best)
+        assert best == np.argmin(mses[:, prune_after-1])
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+
+    print("Interrupted batch keeps the best estimations... ", end="")
+    try:
+        class CancelAfter():
+            """Cancellation token set from the given number of checks on."""
+            def __init__(self, checks):
+                self.checks = checks
+            def is_set(self):
+                self.checks -= 1
+                return self.checks < 0
+        # The MSE of the first start goes up at iterations 53 and 54
+        H, As, phis = synthetic_planes(n_planes=2, seed=1)
+        xk, mses, _, reasons = multi_batch(H, 100, phis, *As, eps=0,
+                                           stopping={"cancel": CancelAfter(54)})
+        assert reasons == ["cancelled"]*len(phis), reasons
+        assert np.count_nonzero(mses[0]) == 55 and np.argmin(mses[0][:55]) == 52
+        for b, phi in enumerate(phis):
+            lowest = np.argmin(mses[b][:55])
+            xk_b = multi(H, lowest+1, phi, *As, eps=0)[0]
+            assert np.allclose(xk[b], xk_b, rtol=0, atol=1e-10), f"start {b}"
+        # And multi-start picks the start of lowest MSE, not of lowest final MSE
+        xk, mses, _, reason = multi_start(H, 100, phis, *As, eps=0, prune_after=None,
+                                          stopping={"cancel": CancelAfter(54)})
+        b = np.argmin(mses[:, :55].min(axis=1))
+        assert reason == "cancelled", reason
+        assert np.allclose(xk, multi(H, np.argmin(mses[b][:55])+1, phis[b], *As, eps=0)[0],
+                           rtol=0, atol=1e-10)
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+    return n_errors
+
+def test_precision():
+    """Check the dtypes and accuracy of each precision mode: single precision stalls
+    around its rounding errors, double and mixed ones go well below them."""
+    n_errors = 0
+    H, As, phis = synthetic_planes(n_planes=3)
+    niter = 200
+    expected = {"double": (np.complex128, 1e-25), "single": (np.complex64, 1e-10),
+                "mixed": (np.complex128, 1e-25)}
+    for precision, (dtype, tol) in expected.items():
+        print(f"Precision {precision}... ", end="")
+        try:
+            xk, mses, _, _ = multi(H, niter, phis[0], *As, eps=0, precision=precision)
+            xk_b, mses_b, _, _ = multi_batch(H, niter, phis[:2], *As, eps=0, precision=precision)
+            assert xk.dtype == dtype and xk_b.dtype == dtype
+            assert mses[-1] < tol and np.all(mses_b[:, -1] < tol), f"{mses[-1]}, {mses_b[:, -1]}"
+            if precision == "single":
+                assert mses[-1] > 1e-20    # Rounded to single precision, unlike the others
+            print(OK)
+        except Exception as error:
+            print(FAIL, error)
+            n_errors += 1
+    return n_errors
+
+def test_reduced_grid():
+    """Check that a beam of narrow bandwidth is retrieved on the reduced grid as on the
+    full one, once mapped back to the full window (as SinglePhaseRetriever does)."""
+    n_errors = 0
+    n, bandwidth = 64, 4
+    H, As, phis = synthetic_planes(n=n, n_planes=3, pixel_size=0.1, bandwidth=bandwidth)
+
+    print("Reduced grid retrieval... ", end="")
+    try:
+        m = reduced_size(bandwidth, n)
+        assert m < n
+        xk, _, _, _ = multi(H, 200, phis[0], *As, eps=0)
+        As_m = [resample_amplitude(Ai, m) for Ai in As]
+        xk_m, _, _, _ = multi(crop_transfer_function(H, m), 200, resample_phase(phis[0], m),
+                              *As_m, eps=0)
+        U, U_m = As[0]*xk, spectral_resample(As_m[0]*xk_m, n)
+        # Equal up to a global phase
+        c = np.vdot(U_m, U)
+        error = np.linalg.norm(U-U_m*c/abs(c))/np.linalg.norm(U)
+        assert error < 1e-8, error
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+    return n_errors
+
+def test_pyramid():
+    """Check the coarse-to-fine retrieval, also when no coarser level fits."""
+    n_errors = 0
+    H, As, phis = synthetic_planes(n=64)
+    niter = 30
+
+    print("Pyramid retrieval... ", end="")
+    try:
+        xk, mses, _, _ = multi_pyramid(H, niter, phis[0], *As, eps=0, min_size=16)
+        assert xk.shape == As[0].shape and len(mses) == niter
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+
+    print("Pyramid retrieval with few iterations... ", end="")
+    try:
+        # A narrow beam, exactly sampled by every level, starting from its solution. With
+        # 6 iterations the coarsest level gets none, yet the phase must reach the next one.
+        H_b, As_b, phis_b = synthetic_planes(n=128, n_planes=3, pixel_size=0.1, bandwidth=4)
+        xk, _, _, _ = multi(H_b, 200, phis_b[0], *As_b, eps=0)
+        xk, mses, _, _ = multi_pyramid(H_b, 6, np.angle(xk), *As_b, eps=0, levels=(3, 2),
+                                       min_size=36)
+        assert len(mses) == 6 and np.all(mses < 1e-6), mses
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+
+    print("Pyramid retrieval without coarse levels... ", end="")
+    try:
+        xk, mses, _, _ = multi_pyramid(H, niter, phis[0], *As, eps=0, min_size=64)
+        xk_m, mses_m, _, _ = multi(H, niter, phis[0], *As, eps=0)
+        assert np.array_equal(xk, xk_m) and np.array_equal(mses, mses_m)
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+    return n_errors
+
+def test_gradient():
+    """Check the adjoint gradient of the gradient engine against central finite
+    differences, with equidistant planes and with a transfer function per step."""
+    n_errors = 0
+    H, As, phis = synthetic_planes(n=16, n_planes=3)
+    H_steps = np.stack([H, transfer_function(H.shape, 0.5, 7., 4)])
+    h = 1e-6
+    rng = np.random.default_rng(1)
+    for name, H_i in (("equidistant", H), ("per step", H_steps)):
+        print(f"Gradient vs finite differences ({name})... ", end="")
+        try:
+            objective = AmplitudeMismatch(H_i, As)
+            phi = phis[0].ravel()
+            _, grad = objective(phi)
+            # Derivative along some pixels and some random directions
+            directions = [np.eye(phi.size)[j] for j in rng.choice(phi.size, 4, replace=False)]
+            directions += [rng.standard_normal(phi.size) for _ in range(4)]
+            for v in directions:
+                fd = (objective(phi+h*v)[0]-objective(phi-h*v)[0])/(2*h)
+                assert abs(grad @ v-fd) <= 1e-5*max(abs(fd), 1e-8), f"{grad @ v} vs {fd}"
+            print(OK)
+        except Exception as error:
+            print(FAIL, error)
+            n_errors += 1
+    return n_errors
+
+def test_anderson():
+    """Check that Anderson mixing ends at or below the momentum of multi on the
+    synthetic three plane problems."""
+    n_errors = 0
+    print("Anderson vs multi... ", end="")
+    try:
+        for seed in range(4):
+            H, As, phis = synthetic_planes(n_planes=3, seed=seed)
+            mse = multi(H, 50, phis[0], *As, eps=0)[1][-1]
+            mse_anderson = multi_anderson(H, 50, phis[0], *As, eps=0)[1][-1]
+            # Below 1e-28 both are at the rounding floor
+            assert mse_anderson <= max(mse, 1e-28), f"seed {seed}: {mse_anderson:.3g} vs {mse:.3g}"
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+    return n_errors
+
+def test_tie():
+    """Check that the TIE recovers the known phase of a gaussian beam with defocus and
+    astigmatism, within the beam."""
+    n_errors = 0
+    print("TIE initial phase... ", end="")
+    try:
+        n, pixel_size, dz = 128, 0.25, 1.
+        y, x = (np.mgrid[:n, :n]-n/2)*pixel_size
+        phi = 0.02*(x*x+y*y)-0.01*x*y
+        U0 = np.exp(-(x*x+y*y)/36+1j*phi)
+        U1 = np.fft.ifft2(np.fft.fft2(U0)*transfer_function((n, n), pixel_size, dz, 24))
+        I0, I1 = np.abs(U0)**2, np.abs(U1)**2
+        estimation = tie_phase(I0, I1, dz, pixel_size)
+        beam = I0 > 0.1*I0.max()
+        error = (estimation-phi)[beam]
+        error -= error.mean()
+        assert np.abs(error).max() < 0.05*np.ptp(phi[beam]), f"error {np.abs(error).max():.3g}"
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+    return n_errors
+
+def test_stopping():
+    """Check the stop reasons of the stopping policy on scripted MSE sequences, the
+    time budget of multi and that it reports every iteration with mse_every."""
+    n_errors = 0
+
+    def first_stop(policy, mses):
+        for i, mse in enumerate(mses):
+            reason = policy.check(i, mse)
+            if reason:
+                return i, reason
+        return None
+
+    print("Stopping by stagnation... ", end="")
+    try:
+        policy = StoppingPolicy(100, 1e-10, window=5, tol=1e-3)
+        assert first_stop(policy, [1.]*100) == (5, "stagnation"), "flat MSE not stopped"
+        policy = StoppingPolicy(100, 1e-10, window=5, tol=1e-3)
+        assert first_stop(policy, [.5**i for i in range(30)]) is None, "decaying MSE stopped"
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+
+    print("Stopping by unreachable threshold... ", end="")
+    try:
+        # 1% per iteration never gets to eps in niter, but does not stagnate either
+        policy = StoppingPolicy(1000, 1e-10, window=5, tol=1e-3, extrapolate=True)
+        assert first_stop(policy, [.99**i for i in range(100)]) == (10, "unreachable")
+        policy = StoppingPolicy(1000, 1e-10, window=5, tol=1e-3, extrapolate=True)
+        assert first_stop(policy, [.9**i for i in range(100)]) is None, "reachable eps"
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+
+    print("Stopping by time... ", end="")
+    try:
+        H, As, phis = synthetic_planes(n_planes=3)
+        _, mses, _, reason = multi(H, 50, phis[0], *As, stopping={"max_seconds": 0})
+        assert reason == "time", reason
+        assert np.count_nonzero(mses) == 1, f"{np.count_nonzero(mses)} iterations"
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+
+    print("Reports with mse_every... ", end="")
+    try:
+        reported = []
+        channel = type("Channel", (), {"put": lambda self, mse: reported.append(mse)})()
+        _, mses, _, _ = multi(H, 10, phis[0], *As, eps=0, queue=channel,
+                              stopping={"mse_every": 4})
+        assert np.allclose(reported, mses), f"{len(reported)} reports of 10 iterations"
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+    return n_errors
+
+def test_warm_start():
+    """Check the sources accepted by load_initial_fields and that fit_to_window brings a
+    beam of another window size onto the measured one, keeping its phase."""
+    n_errors = 0
+    print("Warm start sources... ", end="")
+    folder = tempfile.mkdtemp()
+    try:
+        X, Y = np.exp(1j*np.ones((8, 8))), np.exp(2j*np.ones((8, 8)))
+        np.savez(os.path.join(folder, "exported.npz"), Ex=X, Ey=Y, Ez=X)
+        np.savez(os.path.join(folder, "phases.npz"), phi_x=np.angle(X), phi_y=np.angle(Y))
+        for name, expected in (("exported.npz", (X, Y)), ("phases.npz", (1., 2.))):
+            fields = load_initial_fields(os.path.join(folder, name))
+            assert all(np.allclose(f, e) for f, e in zip(fields, expected)), name
+        assert all(f is X for f in load_initial_fields(X)), "shared field"
+        assert all(np.allclose(f, e) for f, e in zip(load_initial_fields(np.stack([X, Y])),
+                                                     (X, Y))), "stacked fields"
+        assert load_initial_fields((None, Y))[0] is None, "missing component"
+        np.savez(os.path.join(folder, "other.npz"), I=X)
+        for invalid in (os.path.join(folder, "other.npz"), (X,), np.ones(8)):
+            try:
+                load_initial_fields(invalid)
+            except ValueError:
+                continue
+            raise AssertionError(f"{invalid!r} accepted")
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+    finally:
+        shutil.rmtree(folder)
+
+    def beam(n, center, w=5.):
+        y, x = np.mgrid[:n, :n]
+        dy, dx = y-center[0], x-center[1]
+        return np.exp(-(dx*dx+dy*dy)/w**2), 0.05*(dx*dx+dy*dy)+0.2*dx
+
+    print("Warm start from a scalar export... ", end="")
+    try:
+        retriever = simulated_retriever(eps=0, executor="inline", n_iter=20, mode="scalar")
+        np.random.seed(0)
+        retriever.retrieve()
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "beam_retrieved.npz")
+            export_fields(retriever, path)
+            fields = load_initial_fields(path)
+            assert fields[0] is None and np.allclose(fields[1], retriever.get_trans_fields()[0])
+            warm = simulated_retriever(eps=0, executor="inline", n_iter=1, mode="scalar")
+            warm.retrieve(init=path)
+        # The warm started retrieval carries on from the exported one
+        assert warm.mse[1][0] <= retriever.mse[1][-1], f"{warm.mse[1][0]} vs {retriever.mse[1][-1]}"
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+
+    A0, phi0 = beam(64, (40, 28))
+    inside = A0 > 0.1**.5
+    for m, name in ((48, "padded"), (96, "cropped")):
+        print(f"Warm start fit to window ({name})... ", end="")
+        try:
+            A, phi = beam(m, (m//2, m//2))
+            fitted = fit_to_window(A*np.exp(1j*phi), A0**2)
+            error = np.angle(np.exp(1j*(fitted-phi0)))[inside]
+            assert fitted.shape == A0.shape, fitted.shape
+            assert np.abs(error).max() < 1e-10, f"phase error {np.abs(error).max():.3g}"
+            print(OK)
+        except Exception as error:
+            print(FAIL, error)
+            n_errors += 1
+    return n_errors
+
+def test_resume():
+    """Check that N iterations resumed from their checkpoint up to 2N give exactly the
+    result of 2N straight iterations."""
+    n_errors = 0
+    H, As, phis = synthetic_planes(n_planes=3)
+    niter = 20
+
+    print("Checkpoint resume... ", end="")
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "checkpoint.npz")
+            multi(H, niter, phis[0], *As, eps=0, checkpoint=path, checkpoint_every=7)
+            xk, mses, alphes, _ = multi(H, 2*niter, phis[0], *As, eps=0, resume=path)
+        xk_s, mses_s, alphes_s, _ = multi(H, 2*niter, phis[0], *As, eps=0)
+        assert np.array_equal(xk, xk_s)
+        assert np.array_equal(mses, mses_s) and np.array_equal(alphes, alphes_s)
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+
+    print("Retriever resume... ", end="")
+    try:
+        retriever = simulated_retriever(eps=0, executor="inline", n_iter=niter)
+        with tempfile.TemporaryDirectory() as folder:
+            retriever.config(checkpoint=os.path.join(folder, "checkpoint"))
+            np.random.seed(0)
+            retriever.retrieve()
+            retriever.resume(niter)
+            resumed = retriever.get_phases(), [list(mse) for mse in retriever.mse]
+        retriever.config(checkpoint=None, n_iter=2*niter)
+        np.random.seed(0)
+        retriever.retrieve()
+        for field, field_s in zip(resumed[0], retriever.get_phases()):
+            assert np.array_equal(field, field_s)
+        assert resumed[1] == retriever.mse
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+    return n_errors
+
+def test_scheduler():
+    """Check that an interactive job preempts a batch one, which is requeued and carries
+    on (warm started or from its checkpoint) up to its full MSE history, and that the
+    options of the retrievers are given back."""
+    n_errors = 0
+    for name, checkpoint, mse_every in (("warm start", False, 1), ("checkpoint", True, 1),
+                                        ("warm start, mse_every=5", False, 5),
+                                        ("checkpoint, mse_every=5", True, 5)):
+        print(f"Scheduler preemption ({name})... ", end="")
+        try:
+            with tempfile.TemporaryDirectory() as folder:
+                batch = simulated_retriever(eps=0, n_iter=60, executor="inline",
+                                            checkpoint=os.path.join(folder, "batch") if checkpoint else None,
+                                            checkpoint_every=5, mse_every=mse_every)
+                urgent = simulated_retriever(eps=0, n_iter=10, executor="inline")
+                scheduler = Scheduler(cores=1, max_jobs=1)
+                finished = []
+                job = scheduler.submit(batch, name="batch", callback=finished.append)
+                while scheduler.poll() and job.iterations < 10:
+                    time.sleep(0.01)
+                urgent_job = scheduler.submit(urgent, priority=INTERACTIVE, name="urgent",
+                                              callback=finished.append)
+                lengths = []    # MSE history lengths of the batch job along the run
+                requeued = False
+                while scheduler.poll():
+                    lengths.append([len(mse) for mse in job.mse])
+                    requeued |= job.state == QUEUED and urgent_job.state == RUNNING
+                    time.sleep(0.01)
+            assert [j.name for j in finished] == ["urgent", "batch"]
+            assert job.preemptions >= 1 and job.state == DONE and requeued
+            # The history of the runs before the preemption is kept, never restarted
+            assert min(lengths[0]) > 0
+            assert all(n >= b for before, now in zip(lengths, lengths[1:])
+                       for b, n in zip(before, now))
+            assert all(len(mse) == job.n_iter for mse in job.mse), [len(m) for m in job.mse]
+            assert job.counts == [job.n_iter]*2 and job.progress == 1., job.counts
+            for retriever in (batch, urgent):
+                assert retriever.options["executor"] == "inline"
+                assert retriever.options["fft_workers"] is None
+            print(OK)
+        except Exception as error:
+            print(FAIL, error)
+            n_errors += 1
+    return n_errors
+
+def test_watcher():
+    """Check that a FolderWatcher only queues the measurements holding every image of
+    every required plane, as they land."""
+    n_errors = 0
+    test_data = os.path.join(os.path.dirname(__file__), "phase_retriever_dataset", "simulated")
+    files = sorted(os.listdir(test_data))
+    images = [f for f in files if f.endswith(".png")]
+    # The image completing each measurement is copied last
+    for name, irradiance, planes, last in (("2 planes", False, 2, "testRad_z0_a90.png"),
+                                           ("irradiance", True, 2, "testRad_z2_aIrr.png"),
+                                           ("z values", False, [0, 2], "testRad_z2_aLev.png")):
+        print(f"Watch folder completeness ({name})... ", end="")
+        try:
+            with tempfile.TemporaryDirectory() as folder:
+                # Scanning never starts the retrievals, only queues them
+                scheduler = Scheduler()
+                watcher = FolderWatcher(folder, planes, irradiance, scheduler=scheduler,
+                                        verbose=False)
+                for f in files:
+                    if f.endswith(".json") or (f in images and f != last and
+                                               (irradiance or "aIrr" not in f)):
+                        shutil.copy(os.path.join(test_data, f), folder)
+                # Each file is only read once its size is the same on two scans
+                assert watcher.scan() == [] and watcher.scan() == []
+                assert watcher.complete_planes("testRad") is None
+                shutil.copy(os.path.join(test_data, last), folder)
+                assert watcher.scan() == []
+                assert watcher.scan() == ["testRad"] and scheduler.queue_depth == 1
+                assert watcher.scan() == [] and scheduler.queue_depth == 1
+            print(OK)
+        except Exception as error:
+            print(FAIL, error)
+            n_errors += 1
+
+    print("Watch folder planes out of order... ", end="")
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            watcher = FolderWatcher(folder, [4, 0, 2], scheduler=Scheduler(), verbose=False)
+            watcher.measurements["beam"] = ({z: {"scale": 1} for z in (2, 4, 0)},
+                                            {z: dict.fromkeys(watcher.required) for z in (2, 4, 0)})
+            assert watcher.complete_planes("beam") == [0, 2, 4], watcher.complete_planes("beam")
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+
+    print("Watch folder releases finished retrievers... ", end="")
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            for f in files:
+                if f in images or f.endswith(".json"):
+                    shutil.copy(os.path.join(test_data, f), folder)
+            scheduler = Scheduler(cores=1, max_jobs=1)
+            watcher = FolderWatcher(folder, [2, 0], scheduler=scheduler, verbose=False,
+                                    options={"n_iter": 5})
+            assert watcher.scan() == [] and watcher.scan() == ["testRad"]
+            retriever = weakref.ref(scheduler.queue[0][2].retriever)
+            watcher.run(interval=0., once=True)
+            gc.collect()
+            assert os.path.exists(watcher.results["testRad"]), "not exported"
+            assert scheduler.finished[0].iterations == 5
+            assert retriever() is None, "finished retriever still alive"
+        print(OK)
+    except Exception as error:
+        print(FAIL, error)
+        n_errors += 1
+
+    print("Watch folder without the initial plane... ", end="")
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            FolderWatcher(folder, [2, 4], scheduler=Scheduler(), verbose=False)
+        print(FAIL, "Planes without z=0 accepted")
+        n_errors += 1
+    except ValueError:
+        print(OK)
+    return n_errors
+
 def test_basics():
     n_errors = 0
 
@@ -85,6 +666,20 @@ def test_basics():
     print("\nAll loaded options: ", end='')
     print({**retriever.options}, "\n")
 
+    n_errors += test_imports()
+    n_errors += test_batch()
+    n_errors += test_precision()
+    n_errors += test_reduced_grid()
+    n_errors += test_pyramid()
+    n_errors += test_gradient()
+    n_errors += test_anderson()
+    n_errors += test_tie()
+    n_errors += test_stopping()
+    n_errors += test_warm_start()
+    n_errors += test_resume()
+    n_errors += test_scheduler()
+    n_errors += test_watcher()
+
     print("Retrieving...  (this may take a while)")
     Ax, Ay = retriever.retrieve()
     print("Number of iterations done:", len(retriever.mse[0]))
@@ -101,6 +696,12 @@ def test_basics():
     ground_t = np.load(os.path.join(test_data, f"{beam_name}_retrieved.npz"))
     Ex_gt, Ey_gt, Ez_gt = ground_t["Ex"], ground_t["Ey"], ground_t["Ez"]
 
+    try:
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib not found. Results are not plotted.")
+        print(f"\nErrors found: {n_errors}")
+        return n_errors
 
     fig0, ax0 = plt.subplots(1, 2, constrained_layout=True)
     msx, msy = retriever.mse
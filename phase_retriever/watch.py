@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Watch-folder streaming mode. The images written by an acquisition, named as
+get_polarimetric_names expects ({beam}_z{value}{unit}_a{pol}.png), are picked up
+as they land: each new file is parsed and decoded once, as soon as its size stops
+changing, and a retrieval is queued on a Scheduler as soon as a measurement (the
+images sharing their name but for the z and analyzer fields) holds a complete set
+of six images (seven, with the irradiance) at every required plane. As in the GUI,
+the plane at z=0 is the initial one of the retrieval, so it is always required.
+Results are written next to the images, as {measurement}_retrieved.npz.
+
+    python -m phase_retriever watch acquisitions/ --planes 3 --irradiance
+
+The retrievals are configured as in the batch mode (see batch), by the *.json of
+the folder. Each measurement is retrieved once.
+"""
+import os
+import sys
+import time
+import argparse
+
+from phase_retriever.retriever import PhaseRetriever, read_image
+from phase_retriever.scheduler import Scheduler, FAILED
+from phase_retriever.misc.file_selector import parse_polarimetric_name, add_polarimetric_image
+from phase_retriever.batch import load_config, dataset_config, prepare, export_fields, \
+    parse_options
+
+POLARIZATIONS = (0, 1, 2, 3, 4, 5)
+
+class FolderWatcher():
+    def __init__(self, folder, planes=2, irradiance=False, ftype="png", config=None,
+                 options=None, scheduler=None, verbose=True):
+        """Watcher of a folder receiving polarimetric images.
+
+        Parameters:
+            - folder: Folder to watch.
+            - planes: Number of planes of a complete measurement (z=0 and the next ones
+            along z, if there are more) or list of the (integer) z values required,
+            which must include 0. Either way, the planes are retrieved in order along z.
+            - irradiance: Whether a complete plane needs the irradiance image too.
+            - ftype: Extension of the images (png or npy).
+            - config: Configuration to use if the folder has no *.json (see batch).
+            - options: Retriever options overriding the configuration.
+            - scheduler: Scheduler running the retrievals (default: a new one, using
+            every core).
+            - verbose: Print the measurements queued and finished.
+        """
+        if not isinstance(planes, int) and 0 not in planes:
+            raise ValueError("The planes must include z=0, the initial plane of the retrieval")
+        self.folder = folder
+        self.planes = planes
+        self.required = set(POLARIZATIONS) | ({"Irr"} if irradiance else set())
+        self.ftype = ftype
+        self.config = config
+        self.options = options or {}
+        self.scheduler = scheduler or Scheduler()
+        self.verbose = verbose
+        self.measurements = {}  # Name: (polarimetric_sets, images) of those not yet queued
+        self.queued = set()
+        self.results = {}       # Name: path of the result, None if it failed
+        self._sizes = {}        # Files waiting for their size to settle
+        self._seen = set()      # Files already decoded, or not polarimetric images
+
+    def scan(self):
+        """Decode the new files and queue the measurements completed by them. Returns the
+        names of the measurements queued."""
+        for fname in sorted(os.listdir(self.folder)):
+            if fname in self._seen:
+                continue
+            parsed = parse_polarimetric_name(fname, ftype=self.ftype)
+            if parsed is None:
+                self._seen.add(fname)
+                continue
+            _, name, z, scale, polarization = parsed
+            if name in self.queued:
+                self._seen.add(fname)
+                continue
+            path = os.path.join(self.folder, fname)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            # Files still being written are left for the next scan
+            size = (stat.st_size, stat.st_mtime_ns)
+            if not stat.st_size or self._sizes.get(fname) != size:
+                self._sizes[fname] = size
+                continue
+            try:
+                image = read_image(path, self.ftype)
+            except Exception:
+                continue    # Not fully written after all, retried on the next scan
+            del self._sizes[fname]
+            self._seen.add(fname)
+            sets, images = self.measurements.setdefault(name, ({}, {}))
+            add_polarimetric_image(sets, path, z, scale, polarization)
+            images.setdefault(int(z), {})[polarization] = image
+        return [name for name in list(self.measurements) if self._queue(name)]
+
+    def complete_planes(self, name):
+        """z values of the complete planes of a measurement, to retrieve with, or None if
+        it is not complete yet."""
+        sets, images = self.measurements[name]
+        complete = [z for z in images if self.required <= set(images[z])]
+        if isinstance(self.planes, int):
+            if 0 not in complete:
+                return None
+            planes = sorted(complete, key=lambda z: z*sets[z]["scale"])
+            planes = planes[planes.index(0):]
+            return planes[:self.planes] if len(planes) >= self.planes else None
+        if not set(self.planes) <= set(complete):
+            return None
+        return sorted(self.planes, key=lambda z: z*sets[z]["scale"])
+
+    def _queue(self, name):
+        planes = self.complete_planes(name)
+        if planes is None:
+            return False
+        sets, images = self.measurements.pop(name)
+        self.queued.add(name)
+        try:
+            config = dataset_config(self.folder, self.config)
+            settings, _, bandwidth, ref_size = load_config(config) if config else ({}, None, None, 0)
+            retriever = PhaseRetriever()
+            retriever.config(**{**settings, **self.options})
+            retriever.set_images({z: sets[z] for z in planes}, {z: images[z] for z in planes})
+            prepare(retriever, bandwidth, ref_size)
+        except Exception as error:
+            self._report(name, None, error)
+            return False
+        self.scheduler.submit(retriever, name=name, callback=self._finished)
+        if self.verbose:
+            print(f"{name}: queued, planes {planes} ({self.scheduler.queue_depth} waiting)")
+        return True
+
+    def _finished(self, job):
+        path = None
+        if job.state != FAILED:
+            path = os.path.join(self.folder, f"{job.name}_retrieved.npz")
+            try:
+                export_fields(job.retriever, path)
+            except Exception as error:
+                job.error = error
+                path = None
+        self._report(job.name, path, job.error, job)
+        # The retriever holds the images and the shared memory blocks of the retrieval,
+        # which would otherwise pile up in the finished jobs of the scheduler
+        job.retriever = None
+
+    def _report(self, name, path, error=None, job=None):
+        self.results[name] = path
+        if not self.verbose:
+            return
+        if path is None:
+            print(f"{name}: FAILED ({error})", file=sys.stderr)
+        else:
+            mses = ", ".join(f"{mse[-1]:.4g}" for mse in job.mse if mse)
+            print(f"{name}: {job.iterations} iterations, MSE {mses} -> {path}")
+
+    def poll(self):
+        """Scan the folder and move the retrievals on. Returns whether retrievals are
+        queued or running."""
+        self.scan()
+        return self.scheduler.poll()
+
+    def run(self, interval=1., once=False):
+        """Watch the folder until interrupted, scanning it every interval seconds. once:
+        Stop as soon as no retrieval is left (the files still being written are still
+        waited for)."""
+        try:
+            while True:
+                busy = self.poll()
+                if once and not busy and not self._sizes:
+                    break
+                # The scheduler is polled more often than the folder is scanned
+                deadline = time.perf_counter()+interval
+                while self.scheduler.poll() and time.perf_counter() < deadline:
+                    time.sleep(0.01)
+                time.sleep(max(0., deadline-time.perf_counter()))
+        except KeyboardInterrupt:
+            for job in self.scheduler.running:
+                job.retriever.cancel()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m phase_retriever watch",
+                                     description="Retrieve the phase of each measurement "
+                                                 "written into a folder, as it completes.")
+    parser.add_argument("folder", help="Folder receiving the images")
+    parser.add_argument("-p", "--planes", type=int, default=2,
+                        help="Planes of a complete measurement (default: 2)")
+    parser.add_argument("-z", type=int, nargs="+", default=None, metavar="Z",
+                        help="Required z values, instead of a number of planes (0 included)")
+    parser.add_argument("--irradiance", action="store_true",
+                        help="Wait for the irradiance image (aIrr) of each plane too")
+    parser.add_argument("--ext", default="png", help="Extension of the images (default: png)")
+    parser.add_argument("-c", "--config", default=None,
+                        help="Configuration, if the folder has no *.json")
+    parser.add_argument("--cores", type=int, default=None,
+                        help="Cores shared by the retrievals (default: all)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Retrievals running at once (default: cores/2)")
+    parser.add_argument("-i", "--interval", type=float, default=1.,
+                        help="Seconds between scans of the folder (default: 1)")
+    parser.add_argument("--once", action="store_true",
+                        help="Exit once the measurements found are retrieved")
+    parser.add_argument("--set", nargs="*", default=[], metavar="OPTION=VALUE",
+                        help="Retriever options overriding the configuration (see batch)")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.folder):
+        parser.error(f"{args.folder} is not a directory")
+    if args.z is not None and 0 not in args.z:
+        parser.error("-z must include 0, the initial plane of the retrieval")
+
+    watcher = FolderWatcher(args.folder, args.z or args.planes, args.irradiance, args.ext,
+                            args.config, parse_options(args.set),
+                            Scheduler(args.cores, args.jobs))
+    watcher.run(args.interval, args.once)
+    return sum(path is None for path in watcher.results.values())
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,7 +17,7 @@ from .gui.wxentries import wxEntryPanel
 from .retriever import PhaseRetriever
 from .misc.focalprop import FocalPropagator
 
-delta_t = 30  # ms
+delta_t = 100  # ms, between polls of the progress of the retrieval
 
 class GUIRetriever(PhaseRetriever):
     def __init__(self, *args, **kwargs):
@@ -35,18 +35,11 @@ class GUIRetriever(PhaseRetriever):
         wx.CallLater(delta_t, self.check_status, *args)
 
     def check_status(self, plot):
-        for i, p in enumerate(self.processes):
-            full = True
-            while full:
-                try:
-                    data = self.queues[i].get_nowait()
-                    self.mse[i].append(data)
-                except:
-                    full = False
-            status = any([p.is_alive() for p in self.processes if p is not None])
-        self.update_function(plot)
+        running, updated = self.poll_progress()
+        if updated:
+            self.update_function(plot)
         # Check the processes again if they are still alive
-        if status:
+        if running:
             # FIXME: Recursion!!!!
             wx.CallLater(delta_t, self.check_status, plot)
         else:
@@ -94,6 +87,8 @@ class wxGUI(wx.Frame):
         self.hasSpectrum = False if hard else self.hasSpectrum
         self.finished = False
         self.beam_name = None if hard else self.beam_name
+        # Last retrieved fields, to warm start the next retrieval of the same data
+        self.warm_start = None if hard else getattr(self, "warm_start", None)
         self.retriever = GUIRetriever()
 
         # Disable some buttons
@@ -382,7 +377,7 @@ class wxGUI(wx.Frame):
         # Then, we call the retriever to commence the process
         self.retriever.config(mode="vectorial")  # self.entries.GetValue("mode")
         self.retriever.config(pixel_size=self.entries.GetValue("pixel_size"))
-        self.retriever.retrieve(args=(plot,), monitor=False)
+        self.retriever.retrieve(args=(plot,), monitor=False, init=self.warm_start)
         wx.CallLater(delta_t, self.retriever.monitor_process, plot)
         wx.CallLater(delta_t, self.OnCheckCompletion)
         wx.CallLater(delta_t*2, self.plotter.select_page, "MSE")
@@ -484,6 +479,8 @@ class wxGUI(wx.Frame):
         self.button_ready("export")
 
     def OnQuit(self, event):
+        # Running retrievals stop within a few iterations instead of keeping the app alive
+        self.retriever.cancel()
         self.Close()
 
     # --- Utils ---
@@ -531,6 +528,9 @@ class wxGUI(wx.Frame):
                 sayYes = dialog.ShowModal() == wx.ID_YES
 
             if sayYes:
+                # Keep the current result as starting point when only parameters change
+                if self.finished and not hard:
+                    self.warm_start = self.retriever.get_trans_fields()
                 # from scratch
                 self.plotter.clean()
                 del self.retriever